@@ -1126,8 +1126,9 @@ def evaluate_classifier(classifier, metadata, polygon, Sat, settings):
 
     Arguments:
     -----------
-    classifier: joblib object
-        classifier model to be used for image classification
+    classifier: joblib object or str
+        classifier model to be used for image classification (or path to 
+        its .pkl file, loaded through Toolbox.LoadModel)
     metadata: dict
         contains all the information about the satellite images that were downloaded
     settings: dict with the following keys
@@ -1156,6 +1157,9 @@ def evaluate_classifier(classifier, metadata, polygon, Sat, settings):
     
     """  
     
+    if isinstance(classifier, str):
+        classifier = Toolbox.LoadModel(classifier, settings.get('numpy_mlp', False))
+    
     # create folder called evaluation
     fp = os.path.join(os.getcwd(), 'evaluation')
     if not os.path.exists(fp):
@@ -19,6 +19,7 @@ import skimage.exposure as exposure
 from skimage.transform import resize
 from geoarray import GeoArray 
 import rasterio
+import rasterio.warp
 from arosics import COREG
 
 # other modules
@@ -31,7 +32,16 @@ from shapely import geometry
 import ee
 import geemap
 import glob
+import re
+import json
+import hashlib
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
+from pyproj import Proj
+from pyproj import transform as Transf
 
 # CoastSat modules
 from Toolshed import Toolbox
@@ -45,16 +55,8 @@ def preprocess_single(ImgColl, georef, fn, datelist, filenames, satname, setting
     Main function to preprocess a satellite image
     Updated FM Apr 2022
     
-    FM: Problem still exists for ee_to_numpy where requests are limited to 262144 pixels (5120m for S2, 7680m for L5/7/8).
-    Potential solution may be to export full image to Google Drive then convert from there?
-    Example:
-    bbox = img.getInfo()['properties']['system:footprint']['coordinates']
-    task = ee.batch.Export.image.toDrive(img, 
-        scale=10000,
-        description='MOD09A1',
-        fileFormat='GeoTIFF',
-        region=bbox)
-    task.start()
+    FM: ee_to_numpy requests are limited to 262144 pixels (5120m for S2, 7680m for L5/7/8),
+    so bigger AOIs are downloaded as a mosaic of tiles (see EEToNumpyCached and AOITiles).
 
     Parameters
     ----------
@@ -106,20 +108,19 @@ def preprocess_single(ImgColl, georef, fn, datelist, filenames, satname, setting
     #=============================================================================================#
     if satname == 'L5':
             
-        img = ee.Image(ImgColl.getInfo().get('features')[fn]['id'])
+        # image properties come from the collection metadata fetched once per run
+        ImgInfo = GetImgMetadata(ImgColl, settings, satname, filenames)[fn]
+        img = ee.Image(ImgInfo['id'])
         
-        acqtime = datetime.utcfromtimestamp(img.getInfo()['properties']['system:time_start']/1000).strftime('%H:%M:%S.%f')
+        acqtime = datetime.utcfromtimestamp(ImgInfo['properties']['system:time_start']/1000).strftime('%H:%M:%S.%f')
         acqdate = datelist[fn]
-        cloud_scoree = img.getInfo()['properties']['CLOUD_COVER']/100
+        cloud_scoree = ImgInfo['properties']['CLOUD_COVER']/100
         if cloud_scoree > settings['cloud_thresh']:
             print(' - Skipped: cloud threshold exceeded (%0.1f%%)' % (cloud_scoree*100))
             skipped['cloudy'].append([filenames[fn], satname, acqdate+' '+acqtime])
             return None, None, None, None, None, None, acqtime
         
-        im_ms = geemap.ee_to_numpy(img, 
-                                   bands = ['B1','B2','B3','B4','B5','QA_PIXEL'], 
-                                   region=ee.Geometry.Polygon(polygon),
-                                   scale=30)
+        im_ms = EEToNumpyCached(img, ImgInfo['id'], ['B1','B2','B3','B4','B5','QA_PIXEL'], polygon, 30, settings)
         
         # Run initial QA on image
         im_ms = QAMask(im_ms, satname, settings['cloud_thresh'])
@@ -174,22 +175,21 @@ def preprocess_single(ImgColl, georef, fn, datelist, filenames, satname, setting
     #=============================================================================================#
     elif satname == 'L7':
 
-        img = ee.Image(ImgColl.getInfo().get('features')[fn]['id'])
+        # image properties come from the collection metadata fetched once per run
+        ImgInfo = GetImgMetadata(ImgColl, settings, satname, filenames)[fn]
+        img = ee.Image(ImgInfo['id'])
         
-        acqtime = datetime.utcfromtimestamp(img.getInfo()['properties']['system:time_start']/1000).strftime('%H:%M:%S.%f')
+        acqtime = datetime.utcfromtimestamp(ImgInfo['properties']['system:time_start']/1000).strftime('%H:%M:%S.%f')
         acqdate = datelist[fn]
 
-        cloud_scoree = img.getInfo()['properties']['CLOUD_COVER']/100
+        cloud_scoree = ImgInfo['properties']['CLOUD_COVER']/100
         
         if cloud_scoree > settings['cloud_thresh']:
             print(' - Skipped: cloud threshold exceeded (%0.1f%%)' % (cloud_scoree*100))
             skipped['cloudy'].append([filenames[fn], satname, acqdate+' '+acqtime])
             return None, None, None, None, None, None, acqtime
         
-        im_ms = geemap.ee_to_numpy(img, 
-                                   bands = ['B1','B2','B3','B4','B5', 'B8','QA_PIXEL'], 
-                                   region=ee.Geometry.Polygon(polygon),
-                                   scale=30)
+        im_ms = EEToNumpyCached(img, ImgInfo['id'], ['B1','B2','B3','B4','B5', 'B8','QA_PIXEL'], polygon, 30, settings)
         
         # Run initial QA on image
         im_ms = QAMask(im_ms, satname, settings['cloud_thresh'])
@@ -208,10 +208,7 @@ def preprocess_single(ImgColl, georef, fn, datelist, filenames, satname, setting
         #Apply the mask to the image and display the result.
         masked = img.updateMask(mask);
         
-        im_pan = geemap.ee_to_numpy(img, 
-                                    bands = ['B8'], 
-                                    region=ee.Geometry.Polygon(polygon),
-                                    scale=15)
+        im_pan = EEToNumpyCached(img, ImgInfo['id'], ['B8'], polygon, 15, settings)
         
         # size of pan image
         nrows = im_pan.shape[0]
@@ -268,22 +265,21 @@ def preprocess_single(ImgColl, georef, fn, datelist, filenames, satname, setting
     #=============================================================================================#
     elif satname == 'L8':
         
-        img = ee.Image(ImgColl.getInfo().get('features')[fn]['id'])
+        # image properties come from the collection metadata fetched once per run
+        ImgInfo = GetImgMetadata(ImgColl, settings, satname, filenames)[fn]
+        img = ee.Image(ImgInfo['id'])
         
-        acqtime = datetime.utcfromtimestamp(img.getInfo()['properties']['system:time_start']/1000).strftime('%H:%M:%S.%f')      
+        acqtime = datetime.utcfromtimestamp(ImgInfo['properties']['system:time_start']/1000).strftime('%H:%M:%S.%f')      
         acqdate = datelist[fn]
 
-        cloud_scoree = img.getInfo()['properties']['CLOUD_COVER']/100
+        cloud_scoree = ImgInfo['properties']['CLOUD_COVER']/100
         
         if cloud_scoree > settings['cloud_thresh']:
             print(' - Skipped: cloud threshold exceeded (%0.1f%%)' % (cloud_scoree*100))
             skipped['cloudy'].append([filenames[fn], satname, acqdate+' '+acqtime])
             return None, None, None, None, None, None, acqtime
         
-        im_ms = geemap.ee_to_numpy(img, 
-                                   bands = ['B2','B3','B4','B5', 'B6','B7','B10','B11','QA_PIXEL'], 
-                                   region=ee.Geometry.Polygon(polygon),
-                                   scale=30)
+        im_ms = EEToNumpyCached(img, ImgInfo['id'], ['B2','B3','B4','B5', 'B6','B7','B10','B11','QA_PIXEL'], polygon, 30, settings)
         
         # Run initial QA on image
         im_ms = QAMask(im_ms, satname, settings['cloud_thresh'])
@@ -298,10 +294,7 @@ def preprocess_single(ImgColl, georef, fn, datelist, filenames, satname, setting
         #Create a mask from the cloud score and combine it with the image mask.
         mask = cloud_scored.select(['cloud']).lte(20);
         
-        im_pan = geemap.ee_to_numpy(img, 
-                                    bands = ['B8'], 
-                                    region=ee.Geometry.Polygon(polygon),
-                                    scale=15)
+        im_pan = EEToNumpyCached(img, ImgInfo['id'], ['B8'], polygon, 15, settings)
         
         # size of pan image
         nrows = im_pan.shape[0]
@@ -358,22 +351,21 @@ def preprocess_single(ImgColl, georef, fn, datelist, filenames, satname, setting
     #=============================================================================================#
     elif satname == 'L9':
         
-        img = ee.Image(ImgColl.getInfo().get('features')[fn]['id'])
+        # image properties come from the collection metadata fetched once per run
+        ImgInfo = GetImgMetadata(ImgColl, settings, satname, filenames)[fn]
+        img = ee.Image(ImgInfo['id'])
 
-        acqtime = datetime.utcfromtimestamp(img.getInfo()['properties']['system:time_start']/1000).strftime('%H:%M:%S.%f')
+        acqtime = datetime.utcfromtimestamp(ImgInfo['properties']['system:time_start']/1000).strftime('%H:%M:%S.%f')
         acqdate = datelist[fn]
         
-        cloud_scoree = img.getInfo()['properties']['CLOUD_COVER']/100
+        cloud_scoree = ImgInfo['properties']['CLOUD_COVER']/100
         
         if cloud_scoree > settings['cloud_thresh']:
             print(' - Skipped: cloud threshold exceeded (%0.1f%%)' % (cloud_scoree*100))
             skipped['cloudy'].append([filenames[fn], satname, acqdate+' '+acqtime])
             return None, None, None, None, None, None, acqtime
         
-        im_ms = geemap.ee_to_numpy(img, 
-                                   bands = ['B2','B3','B4','B5', 'B6','B8','B10','B11','QA_PIXEL'], 
-                                   region=ee.Geometry.Polygon(polygon),
-                                   scale=30)
+        im_ms = EEToNumpyCached(img, ImgInfo['id'], ['B2','B3','B4','B5', 'B6','B8','B10','B11','QA_PIXEL'], polygon, 30, settings)
         
         # Run initial QA on image
         im_ms = QAMask(im_ms, satname, settings['cloud_thresh'])
@@ -388,10 +380,7 @@ def preprocess_single(ImgColl, georef, fn, datelist, filenames, satname, setting
         #Create a mask from the cloud score and combine it with the image mask.
         mask = cloud_scored.select(['cloud']).lte(20);
   
-        im_pan = geemap.ee_to_numpy(img, 
-                                    bands = ['B8'], 
-                                    region=ee.Geometry.Polygon(polygon),
-                                    scale=15)
+        im_pan = EEToNumpyCached(img, ImgInfo['id'], ['B8'], polygon, 15, settings)
         
         # size of pan image
         nrows = im_pan.shape[0]
@@ -448,12 +437,14 @@ def preprocess_single(ImgColl, georef, fn, datelist, filenames, satname, setting
     #=============================================================================================#
     elif satname == 'S2':
         
-        img = ee.Image(ImgColl.getInfo().get('features')[fn]['id'])
+        # image properties come from the collection metadata fetched once per run
+        ImgInfo = GetImgMetadata(ImgColl, settings, satname, filenames)[fn]
+        img = ee.Image(ImgInfo['id'])
         
-        acqtime = datetime.utcfromtimestamp(img.getInfo()['properties']['system:time_start']/1000).strftime('%H:%M:%S.%f')
+        acqtime = datetime.utcfromtimestamp(ImgInfo['properties']['system:time_start']/1000).strftime('%H:%M:%S.%f')
         acqdate = datelist[fn]
         
-        cloud_scoree = img.getInfo()['properties']['CLOUDY_PIXEL_PERCENTAGE']/100
+        cloud_scoree = ImgInfo['properties']['CLOUDY_PIXEL_PERCENTAGE']/100
         
         if cloud_scoree > settings['cloud_thresh']:
             print(' - Skipped: cloud threshold exceeded (%0.1f%%)' % (cloud_scoree*100))
@@ -461,10 +452,7 @@ def preprocess_single(ImgColl, georef, fn, datelist, filenames, satname, setting
             return None, None, None, None, None, None, acqtime
 
         # read 10m bands (R,G,B,NIR)        
-        im10 = geemap.ee_to_numpy(img, 
-                                  bands = ['B2','B3','B4','B8'], 
-                                  region=ee.Geometry.Polygon(polygon),
-                                  scale=10)
+        im10 = EEToNumpyCached(img, ImgInfo['id'], ['B2','B3','B4','B8'], polygon, 10, settings)
         if im10 is None:
             print(' - Skipped: empty raster')
             skipped['empty_poor'].append([filenames[fn], satname, acqdate+' '+acqtime])
@@ -487,10 +475,7 @@ def preprocess_single(ImgColl, georef, fn, datelist, filenames, satname, setting
         ncols = im10.shape[1]
 
         # read 20m band (SWIR1)
-        im20 = geemap.ee_to_numpy(img, 
-                                  bands = ['B11'], 
-                                  region=ee.Geometry.Polygon(polygon),
-                                  scale=20)
+        im20 = EEToNumpyCached(img, ImgInfo['id'], ['B11'], polygon, 20, settings)
         
         if im20 is None:
             print(' - Skipped: empty raster')
@@ -511,15 +496,9 @@ def preprocess_single(ImgColl, georef, fn, datelist, filenames, satname, setting
         # create cloud mask using 60m QA band (not as good as Landsat cloud cover)
         # 2024 rename of QA bands to MSK_CLASSI; implemented additional option
         try:
-            im60 = geemap.ee_to_numpy(img, 
-                                      bands = ['QA60'], 
-                                      region=ee.Geometry.Polygon(polygon),
-                                      scale=60)
+            im60 = EEToNumpyCached(img, ImgInfo['id'], ['QA60'], polygon, 60, settings)
         except:
-            im60 = geemap.ee_to_numpy(img, 
-                                      bands = ['MSK_CLASSI_OPAQUE'], 
-                                      region=ee.Geometry.Polygon(polygon),
-                                      scale=60)
+            im60 = EEToNumpyCached(img, ImgInfo['id'], ['MSK_CLASSI_OPAQUE'], polygon, 60, settings)
         
         if im60 is None:
             print(' - Skipped: empty raster')
@@ -650,6 +629,564 @@ def preprocess_single(ImgColl, georef, fn, datelist, filenames, satname, setting
 ###################################################################################################
 
 
+# Earth Engine image metadata already fetched in this process, keyed by (satname, image IDs)
+ImgMetaCache = {}
+
+def EEGetInfo(obj):
+    """
+    Default backend for GetImgMetadata(): one blocking Earth Engine request.
+    FM Nov 2024
+    """
+    return obj.getInfo()
+
+
+def GetImgMetadata(ImgColl, settings, satname, filenames, GetInfo=None):
+    """
+    Image properties and band info (CRS, transform, footprint, cloud cover...)
+    for every image in a platform's collection, fetched in one batched 
+    getInfo() request rather than once or more per image. The result is saved
+    alongside the CollectMetadata pickle (as sitename_imgmetadata.pkl) so 
+    reruns and worker processes don't need to ask Earth Engine again, and is
+    kept in memory for the rest of the run.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    ImgColl : ImageCollection
+        GEE ImageCollection of images to be processed (as set in InitialiseImgs).
+    settings : dict
+        Dictionary of user-defined settings used for the veg edge extraction.
+    satname : str
+        Name of current satellite platform (L5, L7, L8, L9 or S2).
+    filenames : list
+        GEE image IDs making up the collection (metadata[satname]['filenames']).
+    GetInfo : function, optional
+        Function which takes an ee object and returns its info dict; swap for 
+        a local stand-in to run offline. The default is EEGetInfo.
+
+    Returns
+    -------
+    Features : list
+        Info dicts ('id', 'properties', 'bands') of each image in ImgColl, in 
+        collection order.
+
+    """
+    MetaKey = (satname, tuple(filenames))
+    if MetaKey in ImgMetaCache:
+        return ImgMetaCache[MetaKey]
+    
+    sitename = settings['inputs']['sitename']
+    MetaPath = os.path.join(settings['inputs']['filepath'], sitename, sitename + '_imgmetadata.pkl')
+    ImgMeta = {}
+    if os.path.isfile(MetaPath):
+        with open(MetaPath, 'rb') as f:
+            ImgMeta = pickle.load(f)
+    
+    # only reuse saved info if it was made for the same set of images
+    if satname in ImgMeta and ImgMeta[satname]['filenames'] == list(filenames):
+        Features = ImgMeta[satname]['features']
+    else:
+        if GetInfo is None:
+            GetInfo = EEGetInfo
+        print('fetching %s image metadata...' % satname)
+        Features = GetInfo(ImgColl).get('features')
+        ImgMeta[satname] = {'filenames': list(filenames), 'features': Features}
+        # write to a temporary file first so a half-written pickle is never read
+        with open(MetaPath + '.tmp', 'wb') as f:
+            pickle.dump(ImgMeta, f)
+        os.replace(MetaPath + '.tmp', MetaPath)
+    
+    ImgMetaCache[MetaKey] = Features
+    
+    return Features
+
+
+def EEToNumpyCached(img, ImgID, bands, polygon, scale, settings):
+    """
+    Image bands as an array, taken from the prefetch queue if PrefetchImgs() 
+    has already started downloading them, otherwise loaded with LoadTile().
+    AOIs bigger than the Earth Engine request limit are split into tiles by
+    AOITiles(), fetched in parallel and mosaicked back into one array.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    img : ee.Image
+        Earth Engine image to download bands from.
+    ImgID : str
+        GEE image ID.
+    bands : list
+        Band names to download.
+    polygon : list
+        List of WGS84 coordinate pairs marking the region to download.
+    scale : int
+        Pixel size (in metres) to download at.
+    settings : dict
+        Dictionary of user-defined settings used for the veg edge extraction.
+
+    Returns
+    -------
+    im : array or None
+        Image array (rows, cols, bands), or None if the download came back empty.
+
+    """
+    Tiles = AOITiles(polygon, scale, settings)
+    if Tiles is None: # small enough for a single request
+        return GetTile(img, ImgID, bands, polygon, scale, settings)
+    
+    with ThreadPoolExecutor(max_workers=settings.get('n_downloads', 4)) as executor:
+        TileIms = list(executor.map(lambda Tile: GetTile(img, ImgID, bands, Tile[0], scale, settings), Tiles))
+    if all(TileIm is None for TileIm in TileIms):
+        return None
+    
+    # paste the core of each tile (without its overlap) into place
+    Overlap = settings.get('tile_overlap', 4)
+    nrows, ncols = Tiles[-1][1].stop, Tiles[-1][2].stop
+    nbands = next(TileIm for TileIm in TileIms if TileIm is not None).shape[2]
+    im = np.zeros((nrows, ncols, nbands))
+    for (TileGrid, rowslice, colslice), TileIm in zip(Tiles, TileIms):
+        if TileIm is None: # tile outside image footprint; left as nodata (zeros)
+            continue
+        # a tile off the requested grid would leave a seam, so don't paste it anywhere
+        if tuple(TileIm.shape[:2]) != tuple(TileGrid['shape']):
+            raise ValueError('tile of %s came back as %s pixels instead of the %s requested; can\'t mosaic it'
+                             % (ImgID, TileIm.shape[:2], tuple(TileGrid['shape'])))
+        im[rowslice, colslice] = TileIm[Overlap:Overlap + rowslice.stop - rowslice.start,
+                                        Overlap:Overlap + colslice.stop - colslice.start]
+    
+    return im
+
+
+def GetTile(img, ImgID, bands, polygon, scale, settings):
+    """
+    Image bands for a single request region, taken from the prefetch queue if
+    PrefetchImgs() has already started downloading them, otherwise loaded with
+    LoadTile().
+    FM Nov 2024
+    """
+    Prefetched = PrefetchedTiles.pop(TileKey(ImgID, bands, polygon, scale), None)
+    if Prefetched is not None:
+        # waits for the download to finish (and raises any error it hit)
+        return Prefetched.result()
+    
+    return LoadTile(img, ImgID, bands, polygon, scale, settings)
+
+
+# tile grids already worked out in this process, keyed by AOI, scale and tiling settings
+AOITileCache = {}
+
+def AOITiles(polygon, scale, settings):
+    """
+    Split an AOI which is too big for a single Earth Engine pixel request 
+    (settings['ee_max_pixels'], default 262144 or 512x512) into a grid of tiles.
+    The grid is laid out in the projected CRS from the same top left corner as
+    Toolbox.CalcGeoref(), so the mosaic lines up with the image georef. Each 
+    tile is requested on its own exact pixel grid (see EEDownload()), with 
+    settings['tile_overlap'] extra pixels on every side (default 4); only the
+    tile's core is kept when mosaicking. Grids are worked out once per AOI and
+    scale, as every band request asks for them.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    polygon : list
+        List of WGS84 coordinate pairs marking the AOI.
+    scale : int
+        Pixel size (in metres) to download at.
+    settings : dict
+        Dictionary of user-defined settings used for the veg edge extraction.
+
+    Returns
+    -------
+    Tiles : list or None
+        List of (tile grid, row slice, column slice) for each tile, with the
+        slices giving the tile's place in the mosaic. Tile grids are dicts of
+        'epsg', 'transform' (GDAL-style [Xscale, 0, Xtr, 0, -Yscale, Ytr]) and 
+        'shape' (rows, cols incl. overlap). None if the AOI fits in one request.
+
+    """
+    MaxPixels = settings.get('ee_max_pixels', 262144)
+    Overlap = settings.get('tile_overlap', 4)
+    GridKey = (json.dumps(polygon, default=lambda obj: np.asarray(obj).tolist()), scale, MaxPixels, Overlap,
+               settings['ref_epsg'], settings['projection_epsg'])
+    if GridKey in AOITileCache:
+        return AOITileCache[GridKey]
+    
+    inProj = Proj(init='EPSG:'+str(settings['ref_epsg']))
+    outProj = Proj(init='EPSG:'+str(settings['projection_epsg']))
+    
+    Lons, Lats = np.array(polygon[0])[:,0], np.array(polygon[0])[:,1]
+    Xs, Ys = Transf(inProj, outProj, Lons, Lats)
+    # top left corner used for the georef (see Toolbox.CalcGeoref)
+    x0, y0 = Transf(inProj, outProj, polygon[0][3][0], polygon[0][3][1])
+    x0, y0 = round(x0), round(y0)
+    nrows = int(np.ceil((y0 - np.min(Ys))/scale))
+    ncols = int(np.ceil((np.max(Xs) - x0)/scale))
+    if nrows*ncols <= MaxPixels:
+        AOITileCache[GridKey] = None
+        return None
+    
+    TileSize = int(np.sqrt(MaxPixels)) - 2*Overlap
+    Tiles = []
+    for r0 in range(0, nrows, TileSize):
+        r1 = min(r0 + TileSize, nrows)
+        for c0 in range(0, ncols, TileSize):
+            c1 = min(c0 + TileSize, ncols)
+            TileGrid = {'epsg': settings['projection_epsg'],
+                        'transform': [scale, 0, x0 + (c0 - Overlap)*scale, 0, -scale, y0 - (r0 - Overlap)*scale],
+                        'shape': [r1 - r0 + 2*Overlap, c1 - c0 + 2*Overlap]}
+            Tiles.append((TileGrid, slice(r0, r1), slice(c0, c1)))
+    AOITileCache[GridKey] = Tiles
+    
+    return Tiles
+
+
+def TileKey(ImgID, bands, polygon, scale):
+    """
+    Hash identifying a band download request (image ID, bands, region and scale).
+    FM Nov 2024
+    """
+    TileInfo = {'id': ImgID, 'bands': list(bands), 'region': polygon, 'scale': scale}
+    return hashlib.sha1(json.dumps(TileInfo, sort_keys=True, default=lambda obj: np.asarray(obj).tolist()).encode()).hexdigest()
+
+
+def TileGeoref(polygon, scale, settings):
+    """
+    Projected pixel grid of a download request, saved in the tile cache 
+    sidecars: the tile grid itself for tiles from AOITiles(), otherwise the 
+    grid the AOI's georef is built on (top left corner as Toolbox.CalcGeoref()).
+    FM Nov 2024
+
+    Parameters
+    ----------
+    polygon : list or dict
+        List of WGS84 coordinate pairs marking the region, or a tile grid.
+    scale : int
+        Pixel size (in metres) of the request.
+    settings : dict
+        Dictionary of user-defined settings used for the veg edge extraction.
+
+    Returns
+    -------
+    georef : dict
+        'epsg' and 'transform' (GDAL-style [Xscale, 0, Xtr, 0, -Yscale, Ytr]).
+
+    """
+    if isinstance(polygon, dict):
+        return {'epsg': polygon['epsg'], 'transform': polygon['transform']}
+    inProj = Proj(init='EPSG:'+str(settings['ref_epsg']))
+    outProj = Proj(init='EPSG:'+str(settings['projection_epsg']))
+    x0, y0 = Transf(inProj, outProj, polygon[0][3][0], polygon[0][3][1])
+    
+    return {'epsg': settings['projection_epsg'], 'transform': [scale, 0, round(x0), 0, -scale, round(y0)]}
+
+
+# running size (bytes) of each tile cache folder, as seen by this process
+TileCacheBytes = {}
+TileCacheLock = threading.Lock()
+
+def LoadTile(img, ImgID, bands, polygon, scale, settings):
+    """
+    Download image bands as an array with geemap.ee_to_numpy() (via EEDownload),
+    keeping a copy on disk so reruns over the same images don't download them 
+    again. Tiles are keyed on TileKey() and saved as .npy arrays (opened 
+    memory-mapped) with a .json sidecar of the request details and georef
+    (TileGeoref()). Least recently used tiles are removed once the cache grows
+    past settings['tile_cache_gb'] (default 5GB; 0 turns the cache off). The cache folder is only scanned on
+    the first write and when the running total of new tiles passes the limit
+    (then trimmed to 90% of it).
+    FM Nov 2024
+
+    Parameters
+    ----------
+    img : ee.Image
+        Earth Engine image to download bands from.
+    ImgID : str
+        GEE image ID.
+    bands : list
+        Band names to download.
+    polygon : list
+        List of WGS84 coordinate pairs marking the region to download.
+    scale : int
+        Pixel size (in metres) to download at.
+    settings : dict
+        Dictionary of user-defined settings used for the veg edge extraction.
+
+    Returns
+    -------
+    im : array or None
+        Image array (rows, cols, bands), or None if the download came back empty.
+
+    """
+    CacheGB = settings.get('tile_cache_gb', 5)
+    if not CacheGB:
+        return EEDownload(img, bands, polygon, scale, settings)
+    
+    CacheDir = os.path.join(settings['inputs']['filepath'], 'tile_cache')
+    TilePath = os.path.join(CacheDir, TileKey(ImgID, bands, polygon, scale) + '.npy')
+    
+    if os.path.isfile(TilePath):
+        try:
+            # copy-on-write so downstream edits don't touch the saved tile
+            im = np.load(TilePath, mmap_mode='c')
+            os.utime(TilePath) # mark as recently used
+            return im
+        except (OSError, ValueError): # unreadable tile; download again
+            pass
+    
+    im = EEDownload(img, bands, polygon, scale, settings)
+    if im is None: # don't cache failed downloads
+        return im
+    
+    os.makedirs(CacheDir, exist_ok=True)
+    TileInfo = {'id': ImgID, 'bands': list(bands), 'region': polygon, 'scale': scale,
+                'georef': TileGeoref(polygon, scale, settings), 'shape': list(im.shape), 'dtype': str(im.dtype), 
+                'downloaded': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')}
+    with open(TilePath[:-4] + '.json', 'w') as f:
+        json.dump(TileInfo, f, default=lambda obj: np.asarray(obj).tolist())
+    # write to a temporary file first so a half-written tile is never read
+    with open(TilePath + '.tmp', 'wb') as f:
+        np.save(f, im)
+    os.replace(TilePath + '.tmp', TilePath)
+    
+    with TileCacheLock:
+        if CacheDir not in TileCacheBytes:
+            # first write from this process: count what's already there
+            TileCacheBytes[CacheDir] = TrimTileCache(CacheDir, CacheGB*1e9)
+        else:
+            TileCacheBytes[CacheDir] += os.path.getsize(TilePath)
+        if TileCacheBytes[CacheDir] > CacheGB*1e9:
+            # trim to 90% so the next few tiles don't trigger another scan
+            TileCacheBytes[CacheDir] = TrimTileCache(CacheDir, 0.9*CacheGB*1e9)
+    
+    return im
+
+
+# time of the last Earth Engine pixel request made by this process (for rate limiting)
+EELastRequest = [0.0]
+EERequestLock = threading.Lock()
+
+# HTTP statuses and Earth Engine error messages which are worth retrying after a pause
+# (not e.g. "Too many pixels in the region" or request size errors, which won't change)
+EETransientStatuses = [429, 500, 502, 503, 504]
+EETransientErrors = re.compile(r'too many (concurrent )?(requests|aggregations)|rate limit|quota exceeded|'
+                               r'capacity exceeded|deadline exceeded|timed out|service unavailable|'
+                               r'internal (server )?error|connection (reset|aborted|refused|error)|'
+                               r'(http|error|status|code)\W{0,3}(429|50[0234])\b', re.IGNORECASE)
+
+def EETransient(e):
+    """
+    Whether a failed Earth Engine request is worth retrying: connection errors
+    and timeouts, responses with a rate limit or server error status, or 
+    Earth Engine errors with a message saying so (EETransientErrors).
+    FM Nov 2024
+    """
+    # HTTP errors carry their status (googleapiclient: resp.status, requests: response.status_code)
+    Status = getattr(getattr(e, 'resp', None), 'status', None)
+    if Status is None:
+        Status = getattr(getattr(e, 'response', None), 'status_code', None)
+    if Status is not None:
+        return int(Status) in EETransientStatuses
+    if isinstance(e, (ConnectionError, TimeoutError)):
+        return True
+    return EETransientErrors.search(str(e)) is not None
+
+def EEDownload(img, bands, polygon, scale, settings):
+    """
+    Download image bands with geemap.ee_to_numpy(), keeping to at most 
+    settings['ee_max_rate'] requests per second (default 5) across all threads 
+    of this process. The limit is per process, so a pool of 
+    settings['n_workers'] processes can make up to n_workers times as many 
+    requests in total. Requests which fail with a transient error (see 
+    EETransient()) are retried up to settings['ee_retries'] times 
+    (default 3), with exponential backoff starting at settings['ee_backoff'] 
+    seconds (default 2) plus some jitter so threads don't retry in step.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    img : ee.Image
+        Earth Engine image to download bands from.
+    bands : list
+        Band names to download.
+    polygon : list or dict
+        List of WGS84 coordinate pairs marking the region to download, or a 
+        tile grid from AOITiles(); tiles are resampled onto exactly that grid.
+    scale : int
+        Pixel size (in metres) to download at.
+    settings : dict
+        Dictionary of user-defined settings used for the veg edge extraction.
+
+    Returns
+    -------
+    im : array or None
+        Image array (rows, cols, bands), or None if the download came back empty.
+
+    """
+    MaxRate = settings.get('ee_max_rate', 5)
+    Retries = settings.get('ee_retries', 3)
+    Backoff = settings.get('ee_backoff', 2)
+    
+    if isinstance(polygon, dict): # exact pixel grid of a tile
+        crs = 'EPSG:' + str(polygon['epsg'])
+        _, _, X0, _, _, Y0 = polygon['transform']
+        TileRows, TileCols = polygon['shape']
+        # region edges half a pixel inside the grid, so it covers exactly the pixels asked for
+        region = ee.Geometry.Rectangle([X0 + scale/2, Y0 - (TileRows - 0.5)*scale, 
+                                        X0 + (TileCols - 0.5)*scale, Y0 - scale/2], crs, False)
+        img = img.reproject(crs=crs, crsTransform=polygon['transform'])
+    else:
+        region = ee.Geometry.Polygon(polygon)
+    
+    for attempt in range(Retries + 1):
+        # space requests out to the maximum rate
+        with EERequestLock:
+            Wait = EELastRequest[0] + 1/MaxRate - time.monotonic()
+            if Wait > 0:
+                time.sleep(Wait)
+            EELastRequest[0] = time.monotonic()
+        try:
+            return geemap.ee_to_numpy(img, bands=bands, region=region, scale=scale)
+        except Exception as e:
+            # missing bands etc. are raised straight away (preprocess_single handles some of these)
+            if attempt == Retries or not EETransient(e):
+                raise
+            Wait = Backoff * 2**attempt * (1 + random.random())
+            print(' - download failed (%s), retrying in %.1fs' % (e, Wait))
+            time.sleep(Wait)
+
+
+# band downloads started ahead of time by PrefetchImgs(), keyed by TileKey()
+PrefetchedTiles = {}
+
+# bands and scales preprocess_single() downloads for each platform (in the same order)
+EETileRequests = {'L5': [(['B1','B2','B3','B4','B5','QA_PIXEL'], 30)],
+                  'L7': [(['B1','B2','B3','B4','B5', 'B8','QA_PIXEL'], 30), (['B8'], 15)],
+                  'L8': [(['B2','B3','B4','B5', 'B6','B7','B10','B11','QA_PIXEL'], 30), (['B8'], 15)],
+                  'L9': [(['B2','B3','B4','B5', 'B6','B8','B10','B11','QA_PIXEL'], 30), (['B8'], 15)],
+                  'S2': [(['B2','B3','B4','B8'], 10), (['B11'], 20), (['QA60'], 60)]}
+
+def PrefetchImgs(fns, ImgColl, settings, satname, filenames, polygon):
+    """
+    Generator over image indices which downloads the bands of the next 
+    settings['n_prefetch'] images (default 4) in a pool of settings['n_downloads'] 
+    threads (default 4) while the current image is processed. preprocess_single()
+    picks the downloads up through EEToNumpyCached(). Images that will be 
+    skipped on their cloud cover property aren't fetched, and downloads an image
+    didn't end up using are dropped once processing moves on from it.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    fns : list
+        Indices of images (in the platform's collection) to process, in order.
+    ImgColl : ImageCollection
+        GEE ImageCollection of images to be processed (as set in InitialiseImgs).
+    settings : dict
+        Dictionary of user-defined settings used for the veg edge extraction.
+    satname : str
+        Name of current satellite platform (L5, L7, L8, L9, S2 or PS/other).
+    filenames : list
+        GEE image IDs making up the collection (metadata[satname]['filenames']).
+    polygon : list
+        List of WGS84 coordinate pairs marking the region to download.
+
+    Yields
+    ------
+    fn : int
+        Index of the next image to process.
+
+    """
+    fns = list(fns)
+    NAhead = settings.get('n_prefetch', 4)
+    if satname not in EETileRequests or NAhead < 1 or len(fns) < 2:
+        yield from fns
+        return
+    
+    Features = GetImgMetadata(ImgColl, settings, satname, filenames)
+    CloudProp = 'CLOUDY_PIXEL_PERCENTAGE' if satname == 'S2' else 'CLOUD_COVER'
+    executor = ThreadPoolExecutor(max_workers=settings.get('n_downloads', 4))
+    Submitted = {}
+    
+    def Submit(fn):
+        Keys = []
+        if Features[fn]['properties'][CloudProp]/100 <= settings['cloud_thresh']:
+            img = ee.Image(Features[fn]['id'])
+            for bands, scale in EETileRequests[satname]:
+                # large AOIs are fetched tile by tile
+                Tiles = AOITiles(polygon, scale, settings)
+                TilePolygons = [polygon] if Tiles is None else [Tile[0] for Tile in Tiles] # (tile grids)
+                for TilePolygon in TilePolygons:
+                    Key = TileKey(Features[fn]['id'], bands, TilePolygon, scale)
+                    PrefetchedTiles[Key] = executor.submit(LoadTile, img, Features[fn]['id'], bands, TilePolygon, scale, settings)
+                    Keys.append(Key)
+        Submitted[fn] = Keys
+    
+    try:
+        for fn in fns[:NAhead]:
+            Submit(fn)
+        for i, fn in enumerate(fns):
+            if i + NAhead < len(fns):
+                Submit(fns[i + NAhead])
+            yield fn
+            # drop any downloads the image didn't use (e.g. skipped after QA)
+            for Key in Submitted.pop(fn):
+                PrefetchedTiles.pop(Key, None)
+    finally:
+        for Keys in Submitted.values():
+            for Key in Keys:
+                Prefetched = PrefetchedTiles.pop(Key, None)
+                if Prefetched is not None:
+                    Prefetched.cancel()
+        executor.shutdown(wait=False)
+
+
+def TrimTileCache(CacheDir, MaxBytes):
+    """
+    Remove least recently used tiles (and their sidecars) from the download
+    cache until it takes up less than MaxBytes.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    CacheDir : str
+        Path to tile cache folder.
+    MaxBytes : float
+        Maximum size of the cache in bytes.
+
+    Returns
+    -------
+    CacheBytes : int
+        Size of the tiles left in the cache in bytes.
+
+    """
+    Tiles = []
+    for TilePath in glob.glob(os.path.join(CacheDir, '*.npy')):
+        try:
+            TileStat = os.stat(TilePath)
+        except FileNotFoundError: # removed by another process
+            continue
+        Tiles.append((TileStat.st_mtime, TileStat.st_size, TilePath))
+    
+    CacheBytes = sum(Tile[1] for Tile in Tiles)
+    for _, TileSize, TilePath in sorted(Tiles):
+        if CacheBytes <= MaxBytes:
+            break
+        try:
+            os.remove(TilePath)
+        except FileNotFoundError: # removed by another process
+            pass
+        except OSError: # still in use (memory-mapped tiles can't be deleted on Windows), so keep it
+            continue
+        try:
+            os.remove(TilePath[:-4] + '.json')
+        except OSError:
+            pass
+        CacheBytes -= TileSize
+    
+    return CacheBytes
+
+
 def InitialiseImgs(metadata, settings, satname, imgs):
     """
     Set satellite specific parameters before VedgeSat/CoastSat run.
@@ -683,7 +1220,7 @@ def InitialiseImgs(metadata, settings, satname, imgs):
         clf_model = 'MLPClassifier_Veg_L5L8S2.pkl'
         ImgColl = ee.ImageCollection.fromImages(imgs).select(['B1','B2','B3','B4','B5','QA_PIXEL'])
         # adjust georeferencing vector to the new image size
-        raw_georef = ImgColl.getInfo().get('features')[0]['bands'][0]['crs_transform'] # get georef layout from first img Blue band
+        raw_georef = GetImgMetadata(ImgColl, settings, satname, metadata[satname]['filenames'])[0]['bands'][0]['crs_transform'] # get georef layout from first img Blue band
         init_georef = Toolbox.CalcGeoref(raw_georef, settings)
         # scale becomes pansharpened 15m and the origin is adjusted to the center of new top left pixel
         init_georef[1] = init_georef[1]/2 # xscale = 15m
@@ -697,7 +1234,7 @@ def InitialiseImgs(metadata, settings, satname, imgs):
         clf_model = 'MLPClassifier_Veg_L5L8S2.pkl'
         ImgColl = ee.ImageCollection.fromImages(imgs).select(['B1','B2','B3','B4','B5','B8','QA_PIXEL'])
         # adjust georeferencing vector to the new image size
-        raw_georef = ImgColl.getInfo().get('features')[0]['bands'][5]['crs_transform'] # get georef info from panchromatic band (updated to Band 8)
+        raw_georef = GetImgMetadata(ImgColl, settings, satname, metadata[satname]['filenames'])[0]['bands'][5]['crs_transform'] # get georef info from panchromatic band (updated to Band 8)
         init_georef = Toolbox.CalcGeoref(raw_georef, settings)
         print(f"Using initial georef: {init_georef}")
         
@@ -706,7 +1243,7 @@ def InitialiseImgs(metadata, settings, satname, imgs):
         clf_model = 'MLPClassifier_Veg_L5L8S2.pkl'
         ImgColl = ee.ImageCollection.fromImages(imgs).select(['B2','B3','B4','B5','B6','B7','B8','QA_PIXEL'])
         # adjust georeferencing vector to the new image size
-        raw_georef = ImgColl.getInfo().get('features')[0]['bands'][6]['crs_transform'] # get georef info from panchromatic band (updated to Band 8)
+        raw_georef = GetImgMetadata(ImgColl, settings, satname, metadata[satname]['filenames'])[0]['bands'][6]['crs_transform'] # get georef info from panchromatic band (updated to Band 8)
         init_georef = Toolbox.CalcGeoref(raw_georef, settings)
         print(f"Using initial georef: {init_georef}")
         
@@ -715,7 +1252,7 @@ def InitialiseImgs(metadata, settings, satname, imgs):
         clf_model = 'MLPClassifier_Veg_L5L8S2.pkl' 
         ImgColl = ee.ImageCollection.fromImages(imgs).select(['B2','B3','B4','B5','B6','B7','B8','QA_PIXEL'])
         # adjust georeferencing vector to the new image size
-        raw_georef = ImgColl.getInfo().get('features')[0]['bands'][6]['crs_transform'] # get georef info from panchromatic band (updated to Band 8)
+        raw_georef = GetImgMetadata(ImgColl, settings, satname, metadata[satname]['filenames'])[0]['bands'][6]['crs_transform'] # get georef info from panchromatic band (updated to Band 8)
         init_georef = Toolbox.CalcGeoref(raw_georef, settings)
         print(f"Using initial georef: {init_georef}")
         
@@ -724,13 +1261,14 @@ def InitialiseImgs(metadata, settings, satname, imgs):
         clf_model = 'MLPClassifier_Veg_L5L8S2.pkl' 
         ImgColl = ee.ImageCollection.fromImages(imgs).filter(ee.Filter.lte('CLOUDY_PIXEL_PERCENTAGE', 98.5))
         # adjust georeferencing vector to the new image size
-        raw_georef = ImgColl.getInfo().get('features')[0]['bands'][3]['crs_transform'] # get transform info from Band4
+        raw_georef = GetImgMetadata(ImgColl, settings, satname, metadata[satname]['filenames'])[0]['bands'][3]['crs_transform'] # get transform info from Band4
         init_georef = Toolbox.CalcGeoref(raw_georef, settings)
         print(f"Using initial georef: {init_georef}")
         
     else: # Planet or local
         pixel_size = metadata[settings['inputs']['sat_list'][0]]['acc_georef'][0][0] #pull first image's pixel size from transform matrix
         clf_model = 'MLPClassifier_Veg_PSScene.pkl' 
+        ImgColl = None # local images are read in directly
         init_georef = [] # georef gets set by each local image
         
     return pixel_size, clf_model, ImgColl, init_georef
@@ -740,7 +1278,11 @@ def InitialiseImgs(metadata, settings, satname, imgs):
 def Coreg(settings, im_ref_buffer, im_ms, cloud_mask, georef):
     """
     Coregister each satellite image to the first one in a list of images. Uses
-    the AROSICS package for calculating phase shifts in images.
+    the AROSICS package for calculating phase shifts in images. The reference
+    image is read (and reprojected if needed) once per run by CoregReference().
+    If settings['coreg_fft'] is True (default False), a whole-image masked 
+    cross-correlation (MaskedCorrShift) is tried first, and AROSICS is only run
+    when that doesn't find a match at least 40% reliable (correlation of 0.4).
     FM Jan 2024
     Parameters
     ----------
@@ -758,8 +1300,9 @@ def Coreg(settings, im_ref_buffer, im_ms, cloud_mask, georef):
     
     newbuff = False
     coreg_stats = {'dX': np.nan, 'dY': np.nan, 'Reliability': np.nan}
-    # reference image to coregister to (given as filepath)
-    refArr = GeoArray(settings['reference_coreg_im'])
+    # reference image to coregister to (given as filepath, read in once per run)
+    ref_arr, ref_gt, ref_prj, ref_nodata = CoregReference(settings)
+    refArr = GeoArray(ref_arr, ref_gt, ref_prj, nodata=ref_nodata)
     
     # target sat image to register (current image in loop)
     if refArr.shape != im_ms[:,:,0:3].shape:
@@ -776,6 +1319,30 @@ def Coreg(settings, im_ref_buffer, im_ms, cloud_mask, georef):
     else:
         trgArr = GeoArray(im_ms[:,:,0:3], georef, 'EPSG:'+str(settings['projection_epsg']))
     
+    # fast path: masked cross-correlation on the whole image, for the common case
+    # of a small clean shift between images on the same pixel grid
+    if settings.get('coreg_fft', False) and np.allclose(trgArr.geotransform[1::4], ref_gt[1::4]):
+        ref_mask = np.asarray(im_ref_buffer) > 0
+        if ref_nodata is not None:
+            ref_bad = ref_arr == ref_nodata
+            ref_mask = np.logical_or(ref_mask, np.any(ref_bad, axis=2) if ref_bad.ndim == 3 else ref_bad)
+        shift_px, ncc = MaskedCorrShift(ref_arr, trgArr[:], ref_mask, np.logical_or(cloud_mask, im_ref_buffer), max_shift=10)
+        # same reliability threshold as AROSICS; peaks on the edge of the search
+        # window may be past it, so leave those to AROSICS too
+        if ncc*100 >= 40 and np.all(np.abs(shift_px) < 10):
+            # target pixel (r+dy, c+dx) shows what reference pixel (r, c) does
+            newgeoref = list(trgArr.geotransform)
+            newgeoref[0] = ref_gt[0] - shift_px[1]*ref_gt[1]
+            newgeoref[3] = ref_gt[3] - shift_px[0]*ref_gt[5]
+            dX, dY = newgeoref[0] - trgArr.geotransform[0], newgeoref[3] - trgArr.geotransform[3]
+            print('\nCoreg (FFT): X shift = %0.3fm | Y shift = %0.3fm | Reliability = %0.1f%%' % (dX, dY, ncc*100))
+            coreg_stats = {'dX': dX, 'dY': dY, 'Reliability': ncc*100}
+            newbuff = True
+            # use original pixel sizes
+            newgeoref[1] = georef[1]
+            newgeoref[5] = georef[5]
+            return newgeoref, newbuff, coreg_stats
+    
     # add reference shoreline buffer (and cloud mask) to region for avoiding tie point creation
     refArr.mask_baddata = im_ref_buffer
     trgArr.mask_baddata = cloud_mask + im_ref_buffer
@@ -807,6 +1374,150 @@ def Coreg(settings, im_ref_buffer, im_ms, cloud_mask, georef):
     return newgeoref, newbuff, coreg_stats
 
 
+# coregistration reference images already read in, keyed by (filepath, modified time, target EPSG)
+CoregRefCache = {}
+
+def CoregReference(settings):
+    """
+    Read in the coregistration reference image once per run (rather than for
+    every target image), reprojected to settings['projection_epsg'] if it is 
+    in a different CRS. Kept in memory until the file changes.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    settings : dict
+        Dictionary of user-defined settings used for the veg edge extraction.
+
+    Returns
+    -------
+    ref_arr : array
+        Reference image (rows, cols, bands), or (rows, cols) if single band.
+    ref_gt : list
+        GDAL geotransform of the reference image [Xtr, Xscale, Xshear, Ytr, Yshear, Yscale].
+    ref_prj : str
+        Projection of the reference image as 'EPSG:xxxx'.
+    ref_nodata : float or None
+        Nodata value of the reference image.
+
+    """
+    RefPath = settings['reference_coreg_im']
+    RefKey = (os.path.abspath(RefPath), os.path.getmtime(RefPath), settings['projection_epsg'])
+    
+    if RefKey not in CoregRefCache:
+        with rasterio.open(RefPath) as src:
+            ref_nodata = src.nodata
+            if src.crs is not None and src.crs.to_epsg() != settings['projection_epsg']:
+                # reproject once here rather than inside every COREG run
+                dst_crs = 'EPSG:'+str(settings['projection_epsg'])
+                transform, width, height = rasterio.warp.calculate_default_transform(src.crs, dst_crs, src.width, src.height, *src.bounds)
+                ref_arr = np.zeros((src.count, height, width), dtype=src.dtypes[0])
+                rasterio.warp.reproject(source=src.read(), destination=ref_arr, 
+                                        src_transform=src.transform, src_crs=src.crs, src_nodata=ref_nodata,
+                                        dst_transform=transform, dst_crs=dst_crs, dst_nodata=ref_nodata,
+                                        resampling=rasterio.warp.Resampling.bilinear)
+            else:
+                transform = src.transform
+                ref_arr = src.read()
+        # GeoArray layout is (rows, cols, bands)
+        ref_arr = np.transpose(ref_arr, (1,2,0))
+        if ref_arr.shape[2] == 1:
+            ref_arr = ref_arr[:,:,0]
+        ref_gt = list(transform.to_gdal())
+        CoregRefCache.clear() # only one reference image is used at a time
+        CoregRefCache[RefKey] = (ref_arr, ref_gt, 'EPSG:'+str(settings['projection_epsg']), ref_nodata)
+    
+    return CoregRefCache[RefKey]
+
+
+def MaskedCorrShift(im_ref, im_trg, ref_mask, trg_mask, max_shift=10, min_overlap=0.5):
+    """
+    Estimate the (sub-pixel) shift between two images on the same pixel grid
+    using masked normalised cross-correlation (Padfield 2012). Masked pixels 
+    are left out of every sum (rather than set to a fill value), so masks 
+    shared by both images add no structure of their own. Each of the sums over
+    the overlapping valid pixels is done for all shifts at once by FFT, with 
+    enough zero padding that shifts up to max_shift don't wrap round. 
+    Sub-pixel position comes from a parabola through the peak.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    im_ref : array
+        Reference image, (rows, cols) or (rows, cols, bands) (bands are averaged).
+    im_trg : array
+        Target image, same rows and cols as im_ref.
+    ref_mask : array
+        Boolean 2D array, True where reference pixels should be ignored.
+    trg_mask : array
+        Boolean 2D array, True where target pixels should be ignored.
+    max_shift : int, optional
+        Largest shift (in pixels) searched in each direction. The default is 10.
+    min_overlap : float, optional
+        Fraction of the most valid pixels two images can share that a shift
+        must have to be considered. The default is 0.5.
+
+    Returns
+    -------
+    shift_px : array
+        Shift of the target relative to the reference in pixels as (rows, cols),
+        i.e. reference pixel (r, c) shows up at target pixel (r+dy, c+dx).
+    ncc : float
+        Masked normalised cross-correlation at the peak (1 for a perfect match,
+        near 0 for unrelated images).
+
+    """
+    ims, masks = [], []
+    for im, mask in zip([im_ref, im_trg], [ref_mask, trg_mask]):
+        im = np.asarray(im, dtype=float)
+        if im.ndim == 3:
+            im = np.mean(im[:,:,0:3], axis=2)
+        valid = np.logical_and(np.asarray(mask) == 0, np.isfinite(im))
+        if not np.any(valid):
+            return np.array([np.nan, np.nan]), 0.0
+        # demean (for numerical precision) and zero out masked pixels
+        im = np.where(valid, im - np.mean(im[valid]), 0)
+        ims.append(im)
+        masks.append(valid.astype(float))
+    
+    nrows, ncols = ims[0].shape
+    shape = (nrows + max_shift + 1, ncols + max_shift + 1)
+    FT = lambda arr: np.fft.rfft2(arr, shape)
+    # XCorr(FX, FY)[d] = sum over x of X(x) * Y(x+d), for all shifts d
+    XCorr = lambda FX, FY: np.fft.irfft2(np.conj(FX) * FY, shape)
+    
+    FA, FAA, FMA = FT(ims[0]), FT(ims[0]**2), FT(masks[0])
+    FB, FBB, FMB = FT(ims[1]), FT(ims[1]**2), FT(masks[1])
+    N = np.round(XCorr(FMA, FMB))
+    SA, SB = XCorr(FA, FMB), XCorr(FMA, FB)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Num = XCorr(FA, FB) - SA*SB/N
+        VarA = np.maximum(XCorr(FAA, FMB) - SA**2/N, 0)
+        VarB = np.maximum(XCorr(FMA, FBB) - SB**2/N, 0)
+        Corr = Num / np.sqrt(VarA*VarB)
+    
+    # only look at shifts within max_shift, with enough pixels in common
+    dshifts = np.arange(-max_shift, max_shift+1)
+    Corr = Corr[np.ix_(dshifts % shape[0], dshifts % shape[1])]
+    N = N[np.ix_(dshifts % shape[0], dshifts % shape[1])]
+    Corr[~np.isfinite(Corr) | (N < min_overlap*np.max(N))] = -1
+    
+    pr, pc = np.unravel_index(np.argmax(Corr), Corr.shape)
+    ncc = Corr[pr, pc]
+    shift_px = np.array([dshifts[pr], dshifts[pc]], dtype=float)
+    # sub-pixel refinement along each axis (peaks on the edge of the search can't be refined)
+    for axis, idx, size in [(0, pr, Corr.shape[0]), (1, pc, Corr.shape[1])]:
+        if idx == 0 or idx == size-1:
+            continue
+        before = Corr[idx-1, pc] if axis == 0 else Corr[pr, idx-1]
+        after = Corr[idx+1, pc] if axis == 0 else Corr[pr, idx+1]
+        denom = before - 2*ncc + after
+        if denom < 0:
+            shift_px[axis] += 0.5 * (before - after) / denom
+    
+    return shift_px, float(np.clip(ncc, -1, 1))
+
+
 def ClipIndexVec(cloud_mask, im_ndi, im_labels, im_ref_buffer):
     """
     Create classified band index value vectors and clip them to coastal buffer.
@@ -841,9 +1552,9 @@ def ClipIndexVec(cloud_mask, im_ndi, im_labels, im_ref_buffer):
     vec_veg = im_labels[:,:,0].reshape(ncols*nrows)
     vec_nonveg = im_labels[:,:,1].reshape(ncols*nrows)
 
-    # use im_ref_buffer and dilate it by 5 pixels
-    se = morphology.disk(5)
-    im_ref_buffer_extra = morphology.binary_dilation(im_ref_buffer, se)
+    # use im_ref_buffer and dilate it by 5 pixels (same buffer gives same dilation, so cache it)
+    im_ref_buffer_extra = Toolbox.CachedMask(('refbuffer_dilated', 5, Toolbox.ArrayHash(im_ref_buffer)),
+                                             lambda: morphology.binary_dilation(im_ref_buffer, morphology.disk(5)))
     # create a buffer
     vec_buffer = im_ref_buffer_extra.reshape(nrows*ncols)
     
@@ -1017,9 +1728,9 @@ def save_TZone(im_ms, im_labels, cloud_mask, im_ref_buffer, georef, filenames, s
         im_TZ = np.empty(im_ndvi.shape)
         im_TZ[:] = np.nan
     
-    # use im_ref_buffer and dilate it by 5 pixels
-    se = morphology.disk(5)
-    im_ref_buffer_extra = morphology.binary_dilation(im_ref_buffer, se)
+    # use im_ref_buffer and dilate it by 5 pixels (same buffer gives same dilation, so cache it)
+    im_ref_buffer_extra = Toolbox.CachedMask(('refbuffer_dilated', 5, Toolbox.ArrayHash(im_ref_buffer)),
+                                             lambda: morphology.binary_dilation(im_ref_buffer, morphology.disk(5)))
     
     # select pixels that are within the buffer
     im_TZ_cl = np.ma.masked_where(im_ref_buffer_extra==False, im_TZ)
@@ -18,10 +18,6 @@ import skimage.morphology as morphology
 
 # machine learning modules
 import sklearn
-if sklearn.__version__[:4] == '0.20':
-    from sklearn.externals import joblib
-else:
-    import joblib
 from shapely.geometry import LineString
 
 # other modules
@@ -122,15 +118,15 @@ def extract_shorelines(metadata, settings, polygon, dates):
         if satname in ['L5','L7','L8']:
             pixel_size = 15
             if settings['sand_color'] == 'dark':
-                clf = joblib.load(os.path.join(filepath_models, 'NN_4classes_Landsat_dark%s.pkl'%str_new))
+                clf = Toolbox.LoadModel(os.path.join(filepath_models, 'NN_4classes_Landsat_dark%s.pkl'%str_new), settings.get('numpy_mlp', False))
             elif settings['sand_color'] == 'bright':
-                clf = joblib.load(os.path.join(filepath_models, 'NN_4classes_Landsat_bright%s.pkl'%str_new))
+                clf = Toolbox.LoadModel(os.path.join(filepath_models, 'NN_4classes_Landsat_bright%s.pkl'%str_new), settings.get('numpy_mlp', False))
             else:
-                clf = joblib.load(os.path.join(filepath_models, 'NN_4classes_Landsat%s.pkl'%str_new))
+                clf = Toolbox.LoadModel(os.path.join(filepath_models, 'NN_4classes_Landsat%s.pkl'%str_new), settings.get('numpy_mlp', False))
 
         elif satname == 'S2':
             pixel_size = 10
-            clf = joblib.load(os.path.join(filepath_models, 'NN_4classes_S2%s.pkl'%str_new))
+            clf = Toolbox.LoadModel(os.path.join(filepath_models, 'NN_4classes_S2%s.pkl'%str_new), settings.get('numpy_mlp', False))
 
         # convert settings['min_beach_area'] and settings['buffer_size'] from metres to pixels
         buffer_size_pixels = np.ceil(settings['buffer_size']/pixel_size)
@@ -318,41 +314,18 @@ def calculate_features(im_ms, cloud_mask, im_bool):
         
     """
 
-    # add all the multispectral bands
-    features = np.expand_dims(im_ms[im_bool,0],axis=1)
-    for k in range(1,im_ms.shape[2]):
-        feature = np.expand_dims(im_ms[im_bool,k],axis=1)
-        features = np.append(features, feature, axis=-1)
     # NIR-G
     im_NIRG = Toolbox.nd_index(im_ms[:,:,3], im_ms[:,:,1], cloud_mask)
-    features = np.append(features, np.expand_dims(im_NIRG[im_bool],axis=1), axis=-1)
     # SWIR-G
     im_SWIRG = Toolbox.nd_index(im_ms[:,:,4], im_ms[:,:,1], cloud_mask)
-    features = np.append(features, np.expand_dims(im_SWIRG[im_bool],axis=1), axis=-1)
     # NIR-R
     im_NIRR = Toolbox.nd_index(im_ms[:,:,3], im_ms[:,:,2], cloud_mask)
-    features = np.append(features, np.expand_dims(im_NIRR[im_bool],axis=1), axis=-1)
     # SWIR-NIR
     im_SWIRNIR = Toolbox.nd_index(im_ms[:,:,4], im_ms[:,:,3], cloud_mask)
-    features = np.append(features, np.expand_dims(im_SWIRNIR[im_bool],axis=1), axis=-1)
     # B-R
     im_BR = Toolbox.nd_index(im_ms[:,:,0], im_ms[:,:,2], cloud_mask)
-    features = np.append(features, np.expand_dims(im_BR[im_bool],axis=1), axis=-1)
-    # calculate standard deviation of individual bands
-    for k in range(im_ms.shape[2]):
-        im_std =  Toolbox.image_std(im_ms[:,:,k], 1)
-        features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    # calculate standard deviation of the spectral indices
-    im_std = Toolbox.image_std(im_NIRG, 1)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    im_std = Toolbox.image_std(im_SWIRG, 1)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    im_std = Toolbox.image_std(im_NIRR, 1)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    im_std = Toolbox.image_std(im_SWIRNIR, 1)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    im_std = Toolbox.image_std(im_BR, 1)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
+    # bands, indices and standard deviation of each (written into one float32 array)
+    features = Toolbox.image_features(im_ms, [im_NIRG, im_SWIRG, im_NIRR, im_SWIRNIR, im_BR], im_bool, 1)
 
     return features
 
@@ -736,17 +709,8 @@ def process_shoreline(contours, cloud_mask, georef, image_epsg, settings):
 
     # now remove any shoreline points that are attached to cloud pixels
     if sum(sum(cloud_mask)) > 0:
-        # get the coordinates of the cloud pixels
-        idx_cloud = np.where(cloud_mask)
-        idx_cloud = np.array([(idx_cloud[0][k], idx_cloud[1][k]) for k in range(len(idx_cloud[0]))])
-        # convert to world coordinates and same epsg as the shoreline points
-        coords_cloud = Toolbox.convert_epsg(Toolbox.convert_pix2world(idx_cloud, georef),
-                                               image_epsg, settings['output_epsg'])[:,:-1]
         # only keep the shoreline points that are at least 30m from any cloud pixel
-        idx_keep = np.ones(len(shoreline)).astype(bool)
-        for k in range(len(shoreline)):
-            if np.any(np.linalg.norm(shoreline[k,:] - coords_cloud, axis=1) < 30):
-                idx_keep[k] = False
+        idx_keep = ~Toolbox.NearCloud(shoreline, cloud_mask, georef, image_epsg, settings['output_epsg'], 30)
         shoreline = shoreline[idx_keep]
     return shoreline, shoreline_latlon, shoreline_proj
 
@@ -8,11 +8,14 @@ COASTGUARD edits and updates: Freya Muir, University of Glasgow
 
 """
 
+import os
 import numpy as np
 import pytz
 import datetime
 from datetime import datetime, timedelta
 
+from concurrent.futures import ProcessPoolExecutor
+
 from scipy import integrate as sintegrate
 from scipy import signal as ssignal
 from scipy import interpolate as sinterpolate
@@ -26,7 +29,7 @@ from matplotlib import lines
 
 #%%
 
-def CoastSatSlope(dates_sat_tr, tides_sat_tr, cross_distances):
+def CoastSatSlope(dates_sat_tr, tides_sat_tr, cross_distances, settings_slope=None):
     """
     Run the main CoastSat.slope routines to get beach slope which minimises high
     frequency tidal fluctuations compared to lower-frequency erosion/accretion signals.
@@ -41,6 +44,9 @@ def CoastSatSlope(dates_sat_tr, tides_sat_tr, cross_distances):
     cross_distances : list
         List of distances along a cross-shore transect where each sat-derived 
         waterline intersects (per-transect timeseries).
+    settings_slope : dict, optional
+        Slope settings shared across a site (from SiteSlopeSettings()). The 
+        default is None (settings and tidal peak found from this transect).
 
     Returns
     -------
@@ -50,21 +56,143 @@ def CoastSatSlope(dates_sat_tr, tides_sat_tr, cross_distances):
     """
     # Slope calculation happens per-transect, so single value returned if only
     # one timeseries list is provided
-    settings_slope = DefineSlopeSettings(cross_distances)
-    
-    # find tidal peak frequency
-    settings_slope['freqs_max'] = find_tide_peak(dates_sat_tr, tides_sat_tr, settings_slope)
+    if settings_slope is None:
+        settings_slope = DefineSlopeSettings(cross_distances)
+        
+        # find tidal peak frequency
+        settings_slope['freqs_max'] = find_tide_peak(dates_sat_tr, tides_sat_tr, settings_slope)
     
     # remove NaNs (but won't be any in VedgeSat GDF per-transect list)
     # idx_nan = np.isnan(cross_distances)
     # tide = tides_sat_tr[~idx_nan]
     # composite = cross_distances[~idx_nan]
     
-    tcorr = tide_correct(cross_distances, tides_sat_tr, settings_slope['beach_slopes'])
-    slope_est, conf_ints = integrate_power_spectrum(dates_sat_tr, tcorr, settings_slope)
+    # energy of tide-corrected timeseries for every trial slope at once
+    slope_est, conf_ints = integrate_power_spectrum(dates_sat_tr, cross_distances, tides_sat_tr, settings_slope)
     
     return slope_est
     
+
+def CoastSatSlopes(dates_sat, tides_sat, dates_sat_trs, tides_sat_trs, cross_distances_trs, n_workers=1, min_obs=10):
+    """
+    Run CoastSatSlope() for every transect at a site. The slope settings, tidal
+    peak and frequency grid only depend on the site's image dates and tides, so
+    are found once and shared; the per-transect slope searches are then run 
+    across a pool of processes. Transects with fewer than min_obs observations,
+    or where the slope search fails, fall back on the global-constant beach 
+    slope of tan(Beta) = 0.1.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    dates_sat : list
+        Datetime of all satellite image capture times at the site.
+    tides_sat : list
+        Tidal elevations at each satellite image capture time at the site.
+    dates_sat_trs : list of lists
+        Datetime of satellite image capture times (per-transect timeseries).
+    tides_sat_trs : list of lists
+        Tidal elevations at each satellite image capture time (per-transect timeseries).
+    cross_distances_trs : list of lists
+        Cross-shore waterline distances (per-transect timeseries).
+    n_workers : int, optional
+        Number of processes to run transects across (None = all available cores). 
+        The default is 1.
+    min_obs : int, optional
+        Minimum number of observations on a transect to estimate a slope from. 
+        The default is 10.
+
+    Returns
+    -------
+    slope_ests : list
+        Estimated tan(Beta) beach slope value for each transect (in transect order).
+
+    """
+    settings_slope = SiteSlopeSettings(dates_sat, tides_sat)
+    
+    if n_workers is None or n_workers < 1: # use every available core
+        n_workers = os.cpu_count()
+    TrArgs = zip(dates_sat_trs, tides_sat_trs, cross_distances_trs)
+    if n_workers > 1:
+        # map() hands results back in transect order
+        with ProcessPoolExecutor(max_workers=n_workers, initializer=InitSlopeWorker, 
+                                 initargs=(settings_slope, min_obs)) as executor:
+            slope_ests = list(executor.map(SlopeWorker, TrArgs, chunksize=16))
+    else:
+        InitSlopeWorker(settings_slope, min_obs)
+        slope_ests = [SlopeWorker(args) for args in TrArgs]
+    
+    # report failures grouped by their error, next to the transects they hit
+    failed = {}
+    for Tr, (slope_est, error) in enumerate(slope_ests):
+        if error is not None:
+            failed.setdefault(error, []).append(Tr)
+    if len(failed) > 0:
+        print('\nslope estimation failed on %d transect(s); using tan(Beta) = 0.1 for these:' % sum(len(Trs) for Trs in failed.values()))
+        for error, Trs in failed.items():
+            print('  %s (transect(s) %s)' % (error, Trs))
+    slope_ests = [0.1 if error is not None else slope_est for slope_est, error in slope_ests]
+    
+    return slope_ests
+
+
+def SiteSlopeSettings(dates_sat, tides_sat):
+    """
+    Define the slope routine settings shared by every transect at a site, 
+    including the tidal peak frequency band and frequency grid (found from 
+    the site's full set of image dates and tides).
+    FM Nov 2024
+
+    Parameters
+    ----------
+    dates_sat : list
+        Datetime of all satellite image capture times at the site.
+    tides_sat : list
+        Tidal elevations at each satellite image capture time at the site.
+
+    Returns
+    -------
+    settings_slope : dict
+        Dictionary of settings required for slope-finding routine.
+
+    """
+    settings_slope = DefineSlopeSettings(None)
+    # find tidal peak frequency
+    settings_slope['freqs_max'] = find_tide_peak(dates_sat, tides_sat, settings_slope)
+    settings_slope['freqs'] = FreqParams(dates_sat, settings_slope)[-1]
+    
+    return settings_slope
+
+
+def InitSlopeWorker(settings_slope, min_obs):
+    """
+    Store the shared site slope settings for SlopeWorker() to use on each 
+    transect it is handed.
+    FM Nov 2024
+
+    """
+    global SlopeWorkerState
+    SlopeWorkerState = {'settings_slope':settings_slope, 'min_obs':min_obs}
+
+
+def SlopeWorker(args):
+    """
+    Estimate the beach slope on a single transect with the shared site settings.
+    Returns (slope, None), with a slope of 0.1 if too few observations exist, 
+    or (None, error) with the error type and message if the slope search fails.
+    FM Nov 2024
+
+    """
+    dates_sat_tr, tides_sat_tr, cross_distances = args
+    # if only a few observations exist, just use global-constant beach slope of tan(Beta) = 0.1
+    if len(dates_sat_tr) < SlopeWorkerState['min_obs']:
+        return 0.1, None
+    try:
+        return CoastSatSlope(dates_sat_tr, tides_sat_tr, cross_distances, SlopeWorkerState['settings_slope']), None
+    except Exception as e:
+        # passed back as text so it can be reported (and pickled back from a pool worker)
+        return None, '%s: %s' % (type(e).__name__, e)
+    
 #%%
 
 def DefineSlopeSettings(cross_distances):
@@ -221,6 +349,75 @@ def power_spectrum(t, y, freqs, idx_cut):
     return ps, E, Ec
 
 
+def power_spectrum_slopes(t, chain, tide_level, beach_slopes, freqs):
+    """
+    Compute Lomb-Scargle power spectra (psd normalisation, floating mean, as in
+    power_spectrum()) of a timeseries tide-corrected with every trial slope at once. 
+    Tide-corrected series only differ by tide_level/slope, so the sinusoid terms
+    at each frequency are built once and the fit for each slope is a linear 
+    combination of the fits to the cross-shore distances and the tide levels.
+    Uses the exact Lomb-Scargle sums (no fast approximation).
+    FM Nov 2024
+
+    Parameters
+    ----------
+    t : array
+        Array of timesteps as floats.
+    chain : array
+        Cross-shore distances (uncorrected).
+    tide_level : array
+        Tide levels at each timestep.
+    beach_slopes : array
+        Trial slopes to tide-correct with.
+    freqs : array
+        Frequencies to compute power at.
+
+    Returns
+    -------
+    ps : array
+        Power spectra with shape (slopes, frequencies).
+
+    """
+    n = len(t)
+    w = np.ones(n) / n
+    # centre the data (the tide-corrected series centre as chain + tide/slope)
+    Y = np.vstack([chain, tide_level]).astype('float64')
+    Y = Y - np.dot(Y, w)[:,np.newaxis]
+    
+    omega_t = 2 * np.pi * np.outer(t, freqs)
+    sin_omega_t = np.sin(omega_t)
+    cos_omega_t = np.cos(omega_t)
+    # compute time-shift tau
+    S2 = 2 * np.dot(w, sin_omega_t * cos_omega_t)
+    C2 = 2 * np.dot(w, 0.5 - sin_omega_t**2)
+    S = np.dot(w, sin_omega_t)
+    C = np.dot(w, cos_omega_t)
+    S2 -= 2 * S * C
+    C2 -= C * C - S * S
+    
+    # compute components needed for the fit
+    omega_t_tau = omega_t - 0.5 * np.arctan2(S2, C2)
+    sin_omega_t_tau = np.sin(omega_t_tau)
+    cos_omega_t_tau = np.cos(omega_t_tau)
+    Ctau = np.dot(w, cos_omega_t_tau)
+    Stau = np.dot(w, sin_omega_t_tau)
+    CCtau = np.dot(w, cos_omega_t_tau**2) - Ctau * Ctau
+    SStau = np.dot(w, sin_omega_t_tau**2) - Stau * Stau
+    # fit terms for chain (row 0) and tide (row 1)
+    Ymean = np.dot(Y, w)[:,np.newaxis]
+    YCtau = np.dot(Y * w, cos_omega_t_tau) - Ymean * Ctau
+    YStau = np.dot(Y * w, sin_omega_t_tau) - Ymean * Stau
+    
+    # combine into fit terms for each trial slope
+    inv_slopes = (1 / np.asarray(beach_slopes, dtype='float64'))[:,np.newaxis]
+    YCtau_slopes = YCtau[0] + inv_slopes * YCtau[1]
+    YStau_slopes = YStau[0] + inv_slopes * YStau[1]
+    ps = YCtau_slopes**2 / CCtau + YStau_slopes**2 / SStau
+    ps *= 0.5 * n
+    
+    return ps
+
+
 def range_slopes(min_slope, max_slope, delta_slope):
     'create list of beach slopes to test'
     beach_slopes = []
@@ -233,18 +430,19 @@ def range_slopes(min_slope, max_slope, delta_slope):
     return beach_slopes
 
 
-def integrate_power_spectrum(dates_rand, tsall, settings_slope, Plot=False):
-    'integrate power spectrum at the frequency band of peak tidal signal'
+def integrate_power_spectrum(dates_rand, chain, tide_level, settings_slope, Plot=False):
+    'integrate power spectrum at the frequency band of peak tidal signal (for all trial slopes at once)'
     # set common params
     t, days_in_year, seconds_in_day, time_step, freqs = FreqParams(dates_rand, settings_slope)
+    # use site-wide frequency grid if one has been set
+    if 'freqs' in settings_slope:
+        freqs = settings_slope['freqs']
 
     beach_slopes = settings_slope['beach_slopes']
-    # integrate power spectrum
+    # integrate power spectrum (only needs computing within the frequency band)
     idx_interval = np.logical_and(freqs >= settings_slope['freqs_max'][0], freqs <= settings_slope['freqs_max'][1]) 
-    E = np.zeros(beach_slopes.size)
-    for i in range(len(tsall)):
-        ps, _, _ = power_spectrum(t,tsall[i],freqs,[])
-        E[i] = sintegrate.simps(ps[idx_interval], x=freqs[idx_interval], even='avg')
+    ps = power_spectrum_slopes(t, chain, tide_level, beach_slopes, freqs[idx_interval])
+    E = sintegrate.simps(ps, x=freqs[idx_interval], even='avg', axis=-1)
     # calculate confidence interval
     delta = 0.0001
     prc = settings_slope['prc_conf']
@@ -11,7 +11,9 @@ import os
 import glob
 import numpy as np
 import pickle
+import json
 import math
+import hashlib
 from datetime import datetime, timedelta
 from IPython.display import clear_output
 
@@ -19,20 +21,29 @@ from IPython.display import clear_output
 from osgeo import gdal, osr
 import pandas as pd
 import geopandas as gpd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import utm
-from shapely import geometry, affinity
-from shapely.geometry import Polygon, LineString, MultiPoint
+from shapely import geometry, affinity, wkb
+from shapely.geometry import Polygon, LineString, MultiLineString, MultiPoint
 import folium
-from pyproj import Proj
+from pyproj import Proj, Transformer, CRS
 from pyproj import transform as Transf
+from collections.abc import Sequence
 
 import skimage.transform as transform
 import sklearn
+import sklearn.neural_network
+if sklearn.__version__[:4] == '0.20':
+    from sklearn.externals import joblib
+else:
+    import joblib
 import scipy
 from scipy import interpolate
+from scipy import ndimage
+from scipy.spatial import cKDTree, Delaunay
 from scipy.stats import circmean, circstd, skew, kurtosis
 from statsmodels.tsa.seasonal import seasonal_decompose
-from astropy.convolution import convolve
 
 import ee
 import geemap
@@ -141,6 +152,9 @@ def convert_world2pix(points, georef):
     return points_converted
 
 
+# GDAL coordinate transforms already made in this process, keyed by (epsg_in, epsg_out)
+CoordTransformCache = {}
+
 def convert_epsg(points, epsg_in, epsg_out):
     """
     Converts from one spatial reference to another using the epsg codes
@@ -163,13 +177,15 @@ def convert_epsg(points, epsg_in, epsg_out):
         
     """
 
-    # define input and output spatial references
-    inSpatialRef = osr.SpatialReference()
-    inSpatialRef.ImportFromEPSG(epsg_in)
-    outSpatialRef = osr.SpatialReference()
-    outSpatialRef.ImportFromEPSG(epsg_out)
-    # create a coordinates transform
-    coordTransform = osr.CoordinateTransformation(inSpatialRef, outSpatialRef)
+    # create a coordinates transform (or reuse one already made for this pair)
+    if (epsg_in, epsg_out) not in CoordTransformCache:
+        # define input and output spatial references
+        inSpatialRef = osr.SpatialReference()
+        inSpatialRef.ImportFromEPSG(epsg_in)
+        outSpatialRef = osr.SpatialReference()
+        outSpatialRef.ImportFromEPSG(epsg_out)
+        CoordTransformCache[(epsg_in, epsg_out)] = osr.CoordinateTransformation(inSpatialRef, outSpatialRef)
+    coordTransform = CoordTransformCache[(epsg_in, epsg_out)]
     # if list of arrays
     if type(points) is list:
         points_converted = []
@@ -185,6 +201,139 @@ def convert_epsg(points, epsg_in, epsg_out):
     return points_converted
 
 
+# pyproj transformers already made in this process, keyed by (epsg_in, epsg_out)
+TransformerCache = {}
+
+def GetTransformer(epsg_in, epsg_out):
+    """
+    Return a pyproj Transformer between two EPSG codes (always in X,Y order),
+    making it only the first time each pair is asked for.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    epsg_in : int
+        EPSG code of the input coordinates.
+    epsg_out : int
+        EPSG code of the output coordinates.
+
+    Returns
+    -------
+    Transformer
+        pyproj Transformer from epsg_in to epsg_out.
+
+    """
+    if (epsg_in, epsg_out) not in TransformerCache:
+        TransformerCache[(epsg_in, epsg_out)] = Transformer.from_crs(epsg_in, epsg_out, always_xy=True)
+    
+    return TransformerCache[(epsg_in, epsg_out)]
+
+
+def ReprojectLines(linesGS, epsg_in, epsgs_out):
+    """
+    Reproject a GeoSeries of LineStrings to several coordinate systems at once.
+    All vertices are pulled out into one array and each target CRS is done in
+    a single vectorised transform, rather than one to_crs() per CRS.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    linesGS : GeoSeries
+        LineStrings in epsg_in.
+    epsg_in : int
+        EPSG code of the input lines.
+    epsgs_out : list
+        EPSG codes to reproject to.
+
+    Returns
+    -------
+    linesOut : list
+        GeoSeries of the lines in each of epsgs_out (same order and index as linesGS).
+
+    """
+    coords = [np.asarray(line.coords)[:,:2] for line in linesGS]
+    if len(coords) == 0:
+        return [gpd.GeoSeries([], crs=epsg_out) for epsg_out in epsgs_out]
+    allcoords = np.concatenate(coords)
+    # where each line's vertices end in the stacked array
+    splits = np.cumsum([len(c) for c in coords])[:-1]
+    
+    linesOut = []
+    for epsg_out in epsgs_out:
+        if epsg_out == epsg_in:
+            linesOut.append(linesGS.copy())
+            continue
+        X, Y = GetTransformer(epsg_in, epsg_out).transform(allcoords[:,0], allcoords[:,1])
+        newcoords = np.split(np.column_stack([X, Y]), splits)
+        linesOut.append(gpd.GeoSeries([LineString(c) for c in newcoords], index=linesGS.index, crs=epsg_out))
+    
+    return linesOut
+
+
+class ReprojectedLines(Sequence):
+    """
+    Read-only list view of per-image line GeoSeries (e.g. output['veglines']) 
+    in another CRS. Each image's lines are only reprojected the first time they
+    are asked for, and kept for later; lines already in the CRS are passed 
+    straight through, as are images with no lines (NaN). The view keeps its
+    own list of the lines, so removing images from the source list (e.g. 
+    RemoveDuplicates) doesn't shift the cached positions.
+    FM Nov 2024
+    """
+    
+    def __init__(self, lines, epsg):
+        self.lines = list(lines)
+        self.epsg = int(str(epsg).upper().replace('EPSG:', ''))
+        self.cache = {}
+    
+    def __len__(self):
+        return len(self.lines)
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if i not in self.cache:
+            lines = self.lines[i]
+            if not isinstance(lines, gpd.GeoSeries) or lines.crs is None or lines.crs.to_epsg() == self.epsg:
+                return lines
+            if (lines.geom_type == 'LineString').all():
+                self.cache[i] = ReprojectLines(lines, lines.crs.to_epsg(), [self.epsg])[0]
+            else:
+                self.cache[i] = lines.to_crs(self.epsg)
+        return self.cache[i]
+
+
+def OutputView(output, epsg):
+    """
+    View of a merged output dictionary with its veglines and waterlines in 
+    another CRS. Each info list is a shallow copy of the one in output (so 
+    edits to one dict don't change the other), and the lines are only 
+    reprojected when read (ReprojectedLines).
+    FM Nov 2024
+
+    Parameters
+    ----------
+    output : dict
+        Dictionary of extracted veg edges and associated info with each (merged format).
+    epsg : int
+        EPSG code of the CRS to view the lines in.
+
+    Returns
+    -------
+    outputView : dict
+        Same as output, with the lines in epsg.
+
+    """
+    outputView = {key: list(value) if isinstance(value, list) else value for key, value in output.items()}
+    for linekey in ['veglines', 'waterlines']:
+        if linekey in outputView.keys():
+            outputView[linekey] = ReprojectedLines(output[linekey], epsg)
+    
+    return outputView
+
+
 def get_UTMepsg_from_wgs(lat, lon):
     """
     Retrieves an epsg code from lat lon in wgs84
@@ -335,7 +484,8 @@ def rbnd_index(im1, im2, im3, cloud_mask):
 def image_std(image, radius):
     """
     Calculates the standard deviation of an image, using a moving window of 
-    specified radius. Uses astropy's convolution library'
+    specified radius. NaN pixels are left out of each window and stay NaN in
+    the output (same behaviour as the old astropy convolve version).
     
     Arguments:
     -----------
@@ -352,24 +502,279 @@ def image_std(image, radius):
         
     """  
     
-    # convert to float
-    image = image.astype(float)
-    # first pad the image
-    image_padded = np.pad(image, radius, 'reflect')
-    # window size
-    win_rows, win_cols = radius*2 + 1, radius*2 + 1
-    # calculate std with uniform filters
-    win_mean = convolve(image_padded, np.ones((win_rows,win_cols)), boundary='extend',
-                        normalize_kernel=True, nan_treatment='interpolate', preserve_nan=True)
-    win_sqr_mean = convolve(image_padded**2, np.ones((win_rows,win_cols)), boundary='extend',
-                        normalize_kernel=True, nan_treatment='interpolate', preserve_nan=True)
-    win_var = win_sqr_mean - win_mean**2
-    win_std = np.sqrt(win_var)
-    # remove padding
-    win_std = win_std[radius:-radius, radius:-radius]
+    win_std = image_std_stack([image], radius)[:,:,0]
 
     return win_std
 
+
+def image_std_stack(images, radius, out=None):
+    """
+    Calculates the moving window standard deviation of several single-band
+    images with a shared box filter (scipy uniform_filter, mirrored edges).
+    NaNs are excluded from each window mean and preserved in the output; 
+    flat windows give 0.
+    FM Nov 2024
+    
+    Arguments:
+    -----------
+    images: list
+        list of 2D arrays of the same shape (bands or spectral indices)
+    radius: int
+        radius defining the moving window (radius = 1 is a 3x3 window)
+    out: np.array, optional
+        3D array (rows, cols, len(images)) to write the results into; 
+        allocated as float64 if not given
+        
+    Returns:    
+    -----------
+    out: np.array
+        3D array with the standard deviation of each image along the last axis
+        
+    """
+    
+    winsize = radius*2 + 1
+    if out is None:
+        out = np.empty(images[0].shape + (len(images),), dtype=float)
+    for k, image in enumerate(images):
+        # convert to float (copy, as NaNs get zeroed below)
+        image = np.array(image, dtype=float)
+        nanmask = np.isnan(image)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            if nanmask.any():
+                # NaN-aware window means: sums over valid pixels / valid pixel count
+                image[nanmask] = 0
+                win_count = ndimage.uniform_filter((~nanmask).astype(float), winsize, mode='mirror')
+                # windows with no valid pixels (allow for round-off in the running sums)
+                win_count[win_count < 0.5/winsize**2] = np.nan
+                win_mean = ndimage.uniform_filter(image, winsize, mode='mirror') / win_count
+                win_sqr_mean = ndimage.uniform_filter(image**2, winsize, mode='mirror') / win_count
+            else:
+                win_mean = ndimage.uniform_filter(image, winsize, mode='mirror')
+                win_sqr_mean = ndimage.uniform_filter(image**2, winsize, mode='mirror')
+            # clamp round-off below zero (flat areas) so it gives 0 rather than NaN
+            win_var = np.maximum(win_sqr_mean - win_mean**2, 0)
+            win_std = np.sqrt(win_var)
+        win_std[nanmask] = np.nan
+        out[:,:,k] = win_std
+        
+    return out
+
+
+def image_features(im_ms, im_inds, im_bool, radius=1, im_std_inds=None):
+    """
+    Builds the classifier feature matrix in one preallocated float32 array:
+    the image bands, then the spectral indices, then the moving window 
+    standard deviation of each band and each index (in that order).
+    FM Nov 2024
+    
+    Arguments:
+    -----------
+    im_ms: np.array
+        3D multispectral image (rows, cols, bands)
+    im_inds: list
+        2D spectral index images to add as features
+    im_bool: np.array
+        2D array of boolean indicating where on the image to calculate the features
+    radius: int
+        radius of the standard deviation moving window
+    im_std_inds: list, optional
+        index images to take the standard deviation of, if these differ from
+        im_inds (default uses im_inds)
+        
+    Returns:    
+    -----------
+    features: np.array
+        matrix containing each feature (columns) calculated for all
+        the pixels (rows) indicated in im_bool
+        
+    """
+    
+    if im_std_inds is None:
+        im_std_inds = im_inds
+    nbands = im_ms.shape[2]
+    nlayers = nbands + len(im_inds)
+    features = np.empty(im_ms.shape[:2] + (nlayers + nbands + len(im_std_inds),), dtype=np.float32)
+    
+    # bands and indices
+    features[:,:,:nbands] = im_ms
+    for i, im_ind in enumerate(im_inds):
+        features[:,:,nbands+i] = im_ind
+    # standard deviation of bands and indices (computed on the float64 inputs)
+    StdLayers = [im_ms[:,:,k] for k in range(nbands)] + list(im_std_inds)
+    image_std_stack(StdLayers, radius, out=features[:,:,nlayers:])
+    
+    if np.all(im_bool):
+        # every pixel requested, so no need for a boolean index copy
+        return features.reshape(-1, features.shape[2])
+    else:
+        return features[im_bool]
+
+
+
+# trained classifiers already loaded in this process, keyed by (model path, compiled)
+ModelCache = {}
+
+def LoadModel(modelpath, compiled=False):
+    """
+    Load a pickled (joblib) classifier, once per process. Models are kept in 
+    memory keyed by their path and reloaded only if the file's modification 
+    time changes. Pool workers forked after a model is loaded share the 
+    parent's copy rather than unpickling their own.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    modelpath : str
+        Path to the classifier .pkl file.
+    compiled : bool, optional
+        If True, return a NumpyMLP version of the classifier (plain numpy 
+        forward pass, see CompileMLP). The default is False.
+
+    Returns
+    -------
+    clf : sklearn classifier or NumpyMLP
+        Trained classifier. Shared between calls, so should not be edited in place.
+
+    """
+    ModelKey = (os.path.abspath(modelpath), compiled)
+    ModelModTime = os.path.getmtime(modelpath)
+    
+    if ModelKey not in ModelCache or ModelCache[ModelKey][0] != ModelModTime:
+        if compiled:
+            clf = CompileMLP(LoadModel(modelpath))
+        else:
+            clf = joblib.load(modelpath)
+        ModelCache[ModelKey] = (ModelModTime, clf)
+    
+    return ModelCache[ModelKey][1]
+
+
+def CompileMLP(clf):
+    """
+    Pull the weights out of a trained sklearn MLPClassifier into a NumpyMLP, 
+    which predicts the same labels without sklearn's per-call input checks.
+    Anything other than an MLPClassifier is handed back unchanged.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    clf : sklearn classifier
+        Trained classifier.
+
+    Returns
+    -------
+    clf : NumpyMLP or sklearn classifier
+        Compiled classifier (or the original one if it couldn't be compiled).
+
+    """
+    if not isinstance(clf, sklearn.neural_network.MLPClassifier) or clf.activation not in NumpyMLP.activations:
+        print('Classifier is not an MLP that can be compiled; using sklearn prediction.')
+        return clf
+    
+    return NumpyMLP([np.asarray(W) for W in clf.coefs_], 
+                    [np.asarray(b) for b in clf.intercepts_], 
+                    clf.activation, clf.classes_)
+
+
+class NumpyMLP(object):
+    """
+    Forward pass of a trained multi-layer perceptron in plain numpy, as a drop-in
+    for MLPClassifier.predict(). The output activation is skipped, since softmax
+    and logistic don't change which class scores highest (or whether the binary
+    score is above 0.5). Pixels are run through in chunks to keep the hidden 
+    layer arrays small.
+    FM Nov 2024
+    """
+    activations = {'relu': lambda X: np.maximum(X, 0, out=X),
+                   'tanh': lambda X: np.tanh(X, out=X),
+                   'logistic': lambda X: np.divide(1, 1 + np.exp(-X, out=X), out=X),
+                   'identity': lambda X: X}
+    
+    def __init__(self, coefs, intercepts, activation, classes, chunksize=2**18):
+        self.coefs = coefs
+        self.intercepts = intercepts
+        self.activation = activation
+        self.classes_ = classes
+        self.chunksize = chunksize
+    
+    def predict(self, X):
+        hidden = self.activations[self.activation]
+        labels = np.empty(len(X), dtype=self.classes_.dtype)
+        for start in range(0, len(X), self.chunksize):
+            A = X[start:start+self.chunksize]
+            for i, (W, b) in enumerate(zip(self.coefs, self.intercepts)):
+                A = A @ W
+                A += b
+                if i < len(self.coefs) - 1:
+                    A = hidden(A)
+            if A.shape[1] == 1: # binary classifier (single logistic output)
+                labels[start:start+self.chunksize] = self.classes_[(A[:,0] > 0).astype(int)]
+            else:
+                labels[start:start+self.chunksize] = self.classes_[np.argmax(A, axis=1)]
+        
+        return labels
+
+
+def NearCloud(points, cloud_mask, georef, image_epsg, output_epsg, dist=30):
+    """
+    Flag points that lie within a given distance of any cloud pixel. Only cloud
+    pixels on the edge of a cloud can be the nearest to a point outside that 
+    cloud, so a KD-tree is built from the edge pixels alone and queried once 
+    for all points; points sitting on top of a cloud pixel are flagged directly
+    from the mask. This gives the same result as measuring the distance from 
+    every point to every cloud pixel, without the O(points x cloud pixels) cost.
+    The one difference is for points outside the image: cloud pixels on the 
+    image border only count as edges if they have a clear neighbour inside the
+    image, so a point just off the image next to a cloud covering the border
+    isn't flagged.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    points : np.array
+        Array with 2 columns (X,Y) of world coordinates (in output_epsg).
+    cloud_mask : np.array
+        2D cloud mask with True where cloud pixels are.
+    georef : np.array
+        Vector of 6 elements [Xtr, Xscale, Xshear, Ytr, Yshear, Yscale].
+    image_epsg : int
+        Spatial reference system of the image the cloud mask belongs to.
+    output_epsg : int
+        Spatial reference system of the points.
+    dist : float, optional
+        Distance (in metres) from cloud within which points are flagged. The default is 30.
+
+    Returns
+    -------
+    near : np.array
+        Boolean array, True where a point is within dist of a cloud pixel.
+
+    """
+    near = np.zeros(len(points)).astype(bool)
+    if len(points) == 0 or not np.any(cloud_mask):
+        return near
+    
+    # cloud pixels with at least one clear neighbour
+    cloud_edge = np.logical_and(cloud_mask, ~ndimage.binary_erosion(cloud_mask, border_value=1))
+    idx_cloud = np.argwhere(cloud_edge).astype('float64')
+    if len(idx_cloud) > 0:
+        # convert to world coordinates and same epsg as the points
+        coords_cloud = convert_epsg(convert_pix2world(idx_cloud, georef),
+                                    image_epsg, output_epsg)[:,:-1]
+        # distance to nearest cloud edge pixel (inf if none are closer than dist)
+        dist_cloud, _ = cKDTree(coords_cloud).query(points, k=1, distance_upper_bound=dist)
+        near = dist_cloud < dist
+    
+    # points on top of cloud pixels (whose nearest cloud pixel may be inside the cloud)
+    if image_epsg != output_epsg:
+        points = convert_epsg(points, output_epsg, image_epsg)[:,:-1]
+    points_pix = np.round(convert_world2pix(points, georef)).astype(int) # as (col, row)
+    inside = np.logical_and.reduce((points_pix[:,0] >= 0, points_pix[:,0] < cloud_mask.shape[1],
+                                    points_pix[:,1] >= 0, points_pix[:,1] < cloud_mask.shape[0]))
+    near[inside] = np.logical_or(near[inside], cloud_mask[points_pix[inside,1], points_pix[inside,0]])
+    
+    return near
+
 def mask_raster(fn, mask):
     """
     Masks a .tif raster using GDAL.
@@ -831,6 +1236,7 @@ def output_to_gdf(output, geomtype):
      
     # loop through the mapped shorelines
     counter = 0
+    gdf_list = []
     for i in range(len(output['shorelines'])):
         # skip if there shoreline is empty 
         if len(output['shorelines'][i]) == 0:
@@ -856,11 +1262,10 @@ def output_to_gdf(output, geomtype):
             gdf.loc[i,'satname'] = output['satname'][i]
             gdf.loc[i,'cloud_cover'] = output['cloud_cover'][i]
             # store into geodataframe
-            if counter == 0:
-                gdf_all = gdf
-            else:
-                gdf_all = gdf_all.append(gdf)
+            gdf_list.append(gdf)
             counter = counter + 1
+    # GeoDataFrame.append has been removed from (geo)pandas
+    gdf_all = gpd.GeoDataFrame(pd.concat(gdf_list))
             
     return gdf_all
 
@@ -1006,9 +1411,13 @@ def ResumeVeglines(filepath_data, filepath_out, sitename, metadata):
     """
     Check if VedgeSat/CoastSat run alredy exists partially (e.g. if a previous
     run failed and only some of the satellite platforms have been processed). 
-    If a partial run does exist (i.e. if an output.pkl file has been saved),
-    load it in and only run the process from start of the platforms not yet done.
-    If no output file exists, initialise the output and skipped dictionaries.
+    If a partial run does exist (i.e. if platforms have been saved to the 
+    output.parquet store), only run the process from start of the platforms not
+    yet done. If no output exists, initialise the output and skipped dictionaries.
+    Partial runs saved before the GeoParquet store (as output.pkl) are moved 
+    into it first.
+    Any per-image results journalled for platforms that weren't finished are
+    also read back in, so that those images don't need to be processed again.
     
     This is to save time if a run fails on a specific image or for some unsolved
     reason, so users don't need to re-process images that were already successful.
@@ -1032,29 +1441,39 @@ def ResumeVeglines(filepath_data, filepath_out, sitename, metadata):
         List of satellite platform names, either full list from metadata or 
         shortened to just the platforms not processed yet.
     output : dict
-        Dictionary of extracted veg edges and associated info with each.
-    output_latlon : dict
-        Dictionary of extracted veg edges and associated info with each (in WGS84).
-    output_proj : dict
-        Dictionary of extracted veg edges and associated info with each (in chosen CRS).
+        Dictionary to add each platform's extracted veg edges and info to 
+        (platforms already done are in the output store, not here).
     skipped : dict
         Global dictionary storing the reasons for each image that fails or is skipped.
+    journal : dict
+        Per-image results already processed for the platforms in satnames,
+        in the format {satname: {filename: result}}.
 
     """
     
-    # If output already exists, load it in
-    if os.path.isfile(os.path.join(filepath_out, sitename + '_output.pkl')):
-        SiteFilepath = os.path.join(filepath_data, sitename)
+    SiteFilepath = os.path.join(filepath_data, sitename)
+    StorePath = os.path.join(filepath_out, sitename + '_output.parquet')
+    # Partial run saved as a pickle before the GeoParquet store; move it over
+    if os.path.isfile(os.path.join(filepath_out, sitename + '_output.pkl')) and not os.path.isdir(StorePath):
         with open(os.path.join(SiteFilepath, sitename + '_output.pkl'), 'rb') as f:
             output = pickle.load(f)
-        with open(os.path.join(SiteFilepath, sitename + '_output_latlon.pkl'), 'rb') as f:
-            output_latlon = pickle.load(f)
-        with open(os.path.join(SiteFilepath, sitename + '_output_proj.pkl'), 'rb') as f:
-            output_proj = pickle.load(f)
+        # store every platform in the same CRS (so empty platforms get one too)
+        epsg = None
+        for lines in [lines for satname in output.keys() for lines in output[satname]['veglines']]:
+            if isinstance(lines, gpd.GeoSeries) and lines.crs is not None:
+                epsg = lines.crs.to_epsg()
+                break
+        for satname in output.keys():
+            SaveOutputParquet(output[satname], satname, filepath_out, sitename, epsg)
+    
+    # If output already exists, find which platforms it has
+    if os.path.isdir(StorePath):
+        output = dict([])
         # If platform has already been processed and saved to output,
         # redefine satnames from ones which haven't been done yet
-        satnames = sorted(set(metadata.keys()) ^ set(output_proj.keys()))
-        satnames_done = sorted(set(metadata.keys()) & set(output_proj.keys()))
+        satnames_saved = [os.path.splitext(partname)[0] for partname in os.listdir(StorePath) if partname.endswith('.parquet')]
+        satnames = sorted(set(metadata.keys()) ^ set(satnames_saved))
+        satnames_done = sorted(set(metadata.keys()) & set(satnames_saved))
         
         # Load in existing counter for run success rates
         with open(os.path.join(SiteFilepath, sitename + '_skip_stats.pkl'), 'rb') as f:
@@ -1071,8 +1490,6 @@ def ResumeVeglines(filepath_data, filepath_out, sitename, metadata):
         satnames = metadata.keys()
         # initialise output structure
         output = dict([])
-        output_latlon = dict([])
-        output_proj = dict([])
         
         # Initialise counter for run success rates
         skipped = {
@@ -1081,21 +1498,92 @@ def ResumeVeglines(filepath_data, filepath_out, sitename, metadata):
             'cloudy': [],
             'no_classes': [],
             'no_contours': []}
+    
+    # Replay per-image results of any platforms left unfinished
+    journal = ReadVeglineJournal(os.path.join(filepath_out, sitename + '_output_journal.pkl'))
+    journal = {satname: journal[satname] for satname in satnames if satname in journal.keys()}
+    for satname in journal.keys():
+        print(f"Already found {len(journal[satname])} / {len(metadata[satname]['filenames'])} {satname} images processed")
         
-    return satnames, output, output_latlon, output_proj, skipped
+    return satnames, output, skipped, journal
 
 
-def ReadOutput(inputs):
+def AppendVeglineJournal(journalpath, satname, result):
     """
-    Read in the saved output dictionary from a run of VedgeSat/CoastSat, and 
-    convert it from the format:
-        {'L5':{}, 'L7':{}, etc.}
-    to the easier to use and date-sorted format:
+    Append the result of processing a single image to the run's journal file, 
+    so that the image doesn't need to be processed again if the run fails 
+    before its platform is finished. Records are pickled one after another 
+    into the same file.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    journalpath : str
+        Path to journal pickle file.
+    satname : str
+        Satellite platform the image belongs to.
+    result : dict
+        Per-image result from VegetationLine.ExtractSingleVegline().
+
+    """
+    with open(journalpath, 'ab') as f:
+        pickle.dump((satname, result), f)
+
+
+def ReadVeglineJournal(journalpath):
+    """
+    Read back in all per-image results appended to a run's journal file. A 
+    record left incomplete by a crash part way through writing is cut off the
+    end of the file, so new records can be appended cleanly after it.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    journalpath : str
+        Path to journal pickle file.
+
+    Returns
+    -------
+    journal : dict
+        Per-image results in the format {satname: {filename: result}}.
+
+    """
+    journal = {}
+    if not os.path.isfile(journalpath):
+        return journal
+    
+    with open(journalpath, 'rb') as f:
+        while True:
+            endgood = f.tell() # end of last complete record
+            try:
+                satname, result = pickle.load(f)
+            except (EOFError, pickle.UnpicklingError): # end of file or half-written last record
+                break
+            if satname not in journal.keys():
+                journal[satname] = {}
+            journal[satname][result['filename']] = result
+    
+    if os.path.getsize(journalpath) > endgood:
+        os.truncate(journalpath, endgood)
+            
+    return journal
+
+
+def ReadOutput(inputs, dates=None, satnames=None, columns=None):
+    """
+    Read in the saved output from a run of VedgeSat/CoastSat in the easier to 
+    use and date-sorted format:
         {'dates':[], 'satname':[], 'veglines':[], etc.}
-    Should only run with new runs of VedgeSat, old output files will not be 
-    affected and should be loaded in using the old method:
+    Outputs are read from the site's GeoParquet store (one row per image, see
+    SaveOutputParquet()). Only the images within dates and from satnames, and 
+    only the fields in columns, are read in; the rest of the file is skipped.
+    Runs saved before the store (per-platform output.pkl, in the format 
+    {'L5':{}, 'L7':{}, etc.}) are read in whole and then cut down the same way.
+    Old output files from CoastSat should be loaded in using the old method:
         with open(os.path.join(SiteFilepath, inputs['sitename'] + '_output.pkl'), 'rb') as f:
             output = pickle.load(f)
+    Only the one output is read; output_latlon and output_proj are views
+    of it (OutputView) which reproject each image's lines when first used.
         
     FM Oct 2024
 
@@ -1103,6 +1591,12 @@ def ReadOutput(inputs):
     ----------
     inputs : dict
         Dictionary of user requirements for VedgeSat/CoastSat run.
+    dates : list, optional
+        Start and end dates to read in, as yyyy-mm-dd strings. The default is None (all dates).
+    satnames : list, optional
+        Satellite platforms to read in. The default is None (all platforms).
+    columns : list, optional
+        Fields to read in (e.g. ['dates','vthreshold']). The default is None (all fields).
 
     Returns
     -------
@@ -1115,23 +1609,233 @@ def ReadOutput(inputs):
 
     """
     SiteFilepath = os.path.join(inputs['filepath'], inputs['sitename'])
+    StorePath = os.path.join(SiteFilepath, inputs['sitename'] + '_output.parquet')
     
-    with open(os.path.join(SiteFilepath, inputs['sitename'] + '_output.pkl'), 'rb') as f:
-        output = pickle.load(f)
-    with open(os.path.join(SiteFilepath, inputs['sitename'] + '_output_latlon.pkl'), 'rb') as f:
-        output_latlon = pickle.load(f)
-    with open(os.path.join(SiteFilepath, inputs['sitename'] + '_output_proj.pkl'), 'rb') as f:
-        output_proj = pickle.load(f)
-
-    # output saved as dict{'satname1':{}, 'satname2':{}, etc.}
-    # Need to convert it to dict{'dates':[], 'satname':[], 'veglines':[], etc.}
-    output = merge_output(output)
-    output_latlon = merge_output(output_latlon)
-    output_proj = merge_output(output_proj)
+    if os.path.isdir(StorePath):
+        output = ReadOutputParquet(StorePath, dates, satnames, columns)
+    else:
+        with open(os.path.join(SiteFilepath, inputs['sitename'] + '_output.pkl'), 'rb') as f:
+            output = pickle.load(f)
+        # output saved as dict{'satname1':{}, 'satname2':{}, etc.}
+        # Need to convert it to dict{'dates':[], 'satname':[], 'veglines':[], etc.}
+        output = merge_output(output)
+        # cut down to requested images and fields
+        idx_keep = [i for i in range(len(output['dates'])) if 
+                    (dates is None or dates[0] <= output['dates'][i] <= dates[1]) and 
+                    (satnames is None or output['satname'][i] in satnames)]
+        output = {key: [output[key][i] for i in idx_keep] for key in output.keys() 
+                  if columns is None or key in columns}
+    
+    # lat-long and projected versions are reprojected from output when needed
+    ref_epsg, projection_epsg = OutputEPSGs(inputs, output)
+    output_latlon = OutputView(output, ref_epsg)
+    output_proj = OutputView(output, projection_epsg)
 
     return output, output_latlon, output_proj
 
 
+# Arrow types of the output store fields (any others are inferred from their values)
+OutputSchema = {'dates': pa.string(),
+                'times': pa.string(),
+                'veglines': pa.binary(),
+                'waterlines': pa.binary(),
+                'filename': pa.string(),
+                'cloud_cover': pa.float64(),
+                'idx': pa.int64(),
+                'vthreshold': pa.float64(),
+                'wthreshold': pa.float64(),
+                'tideelev': pa.float64(),
+                'satname': pa.string()}
+
+def SaveOutputParquet(output_sat, satname, filepath_out, sitename, epsg=None):
+    """
+    Save one platform's extracted veg edges and info to the site's GeoParquet
+    output store (a folder of one file per platform, read as one table). Each 
+    row is one image; its veglines and waterlines are stored as MultiLineStrings
+    (WKB) in epsg. Every file is written with the same explicit schema 
+    (OutputSchema), so platforms with no images still read in alongside the 
+    rest. Saving a platform again replaces its file.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    output_sat : dict
+        Dictionary of extracted veg edges and associated info for one platform,
+        as {'dates':[], 'veglines':[], etc.}.
+    satname : str
+        Satellite platform name.
+    filepath_out : str
+        Path to site folder to save outputs to.
+    sitename : str
+        Name of site of interest.
+    epsg : int, optional
+        EPSG code to store lines in. The default is None (CRS of the first image's lines).
+
+    Returns
+    -------
+    None.
+
+    """
+    StorePath = os.path.join(filepath_out, sitename + '_output.parquet')
+    if not os.path.isdir(StorePath):
+        os.makedirs(StorePath)
+    
+    if epsg is None:
+        # CRS of the first image with lines
+        for lines in output_sat['veglines']:
+            if isinstance(lines, gpd.GeoSeries) and lines.crs is not None:
+                epsg = lines.crs.to_epsg()
+                break
+    
+    # one column per field (kept in output order), one row per image
+    columns = dict([])
+    for key in list(output_sat.keys()) + ['satname']:
+        if key in ['veglines', 'waterlines']:
+            lines = ReprojectedLines(output_sat[key], epsg) if epsg is not None else output_sat[key]
+            values = [LinesToMulti(lines[i]) for i in range(len(lines))]
+            values = [wkb.dumps(geom) if geom is not None else None for geom in values]
+        elif key == 'satname':
+            values = [satname] * len(output_sat['dates'])
+        else:
+            values = list(output_sat[key])
+        columns[key] = pa.array(values, type=OutputSchema.get(key), from_pandas=True)
+    
+    # GeoParquet metadata so the lines are read back as geometries
+    crs = CRS.from_epsg(epsg).to_json_dict() if epsg is not None else None
+    geo = {'version': '1.0.0', 
+           'primary_column': 'veglines',
+           'columns': {key: {'encoding': 'WKB', 'geometry_types': [], 'crs': crs} 
+                       for key in ['veglines', 'waterlines'] if key in columns.keys()}}
+    outputTable = pa.table(columns).replace_schema_metadata({'geo': json.dumps(geo)})
+    
+    # write to a temporary file first so an interrupted save doesn't leave a broken part
+    # (files starting with _ are ignored when the store is read)
+    PartPath = os.path.join(StorePath, satname + '.parquet')
+    TmpPath = os.path.join(StorePath, '_' + satname + '.parquet.tmp')
+    pq.write_table(outputTable, TmpPath)
+    os.replace(TmpPath, PartPath)
+    
+
+def ReadOutputParquet(StorePath, dates=None, satnames=None, columns=None):
+    """
+    Read in (part of) a GeoParquet output store written by SaveOutputParquet(),
+    in the date-sorted format {'dates':[], 'satname':[], 'veglines':[], etc.}.
+    Date and platform limits are passed down to the Parquet reader, so row 
+    groups outside them are never read, and files are memory-mapped.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    StorePath : str
+        Path to output store folder.
+    dates : list, optional
+        Start and end dates to read in, as yyyy-mm-dd strings. The default is None (all dates).
+    satnames : list, optional
+        Satellite platforms to read in. The default is None (all platforms).
+    columns : list, optional
+        Fields to read in. The default is None (all fields).
+
+    Returns
+    -------
+    output : dict
+        Dictionary of extracted veg edges and associated info with each.
+
+    """
+    filters = []
+    if dates is not None:
+        filters.extend([('dates', '>=', dates[0]), ('dates', '<=', dates[1])])
+    if satnames is not None:
+        filters.append(('satname', 'in', list(satnames)))
+    if columns is not None:
+        # dates and times are always needed for sorting
+        columns = list(dict.fromkeys(['dates', 'times'] + list(columns)))
+    
+    if columns is None or 'veglines' in columns or 'waterlines' in columns:
+        outputDF = gpd.read_parquet(StorePath, columns=columns, filters=filters or None, memory_map=True)
+    else: # no geometry columns wanted
+        outputDF = pd.read_parquet(StorePath, columns=columns, filters=filters or None, memory_map=True)
+    outputDF = outputDF.sort_values(['dates', 'times'], kind='stable')
+    
+    output = dict([])
+    for key in outputDF.columns:
+        if key in ['veglines', 'waterlines']:
+            # back to a GeoSeries of lines per image (NaN where there are none)
+            output[key] = [gpd.GeoSeries(list(geom.geoms), crs=outputDF[key].crs) if geom is not None else np.nan 
+                           for geom in outputDF[key]]
+        else:
+            output[key] = outputDF[key].tolist()
+    
+    return output
+
+
+def LinesToMulti(lines):
+    """
+    Combine an image's GeoSeries of lines into one MultiLineString for storing
+    (None if the image has no lines, e.g. NaN waterlines).
+    FM Nov 2024
+
+    Parameters
+    ----------
+    lines : GeoSeries
+        Lines extracted from one image.
+
+    Returns
+    -------
+    MultiLineString or None
+        All lines as one feature.
+
+    """
+    if not isinstance(lines, gpd.GeoSeries):
+        return None
+    parts = []
+    for geom in lines:
+        if geom is None or geom.is_empty:
+            continue
+        if geom.geom_type == 'MultiLineString':
+            parts.extend(geom.geoms)
+        else:
+            parts.append(geom)
+    
+    return MultiLineString(parts)
+
+
+def OutputEPSGs(inputs, output):
+    """
+    Find the lat-long and projected EPSG codes the output lines were (or would
+    have been) converted to in a VedgeSat run, from the run's saved settings. 
+    Falls back on WGS84 and the CRS of the output lines if no settings were saved.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    inputs : dict
+        Dictionary of user requirements for VedgeSat/CoastSat run.
+    output : dict
+        Dictionary of extracted veg edges and associated info with each (merged format).
+
+    Returns
+    -------
+    ref_epsg : int
+        EPSG code for lat-long outputs.
+    projection_epsg : int
+        EPSG code for projected outputs.
+
+    """
+    SettingsPath = os.path.join(inputs['filepath'], inputs['sitename'], inputs['sitename'] + '_settings.pkl')
+    if os.path.isfile(SettingsPath):
+        with open(SettingsPath, 'rb') as f:
+            settings = pickle.load(f)
+        return settings.get('ref_epsg', 4326), settings['projection_epsg']
+    
+    projection_epsg = 4326
+    for lines in output.get('veglines', []):
+        if isinstance(lines, gpd.GeoSeries) and lines.crs is not None:
+            projection_epsg = lines.crs.to_epsg()
+            break
+    
+    return 4326, projection_epsg
+
+
 def SaveShapefiles(output, name_prefix, sitename, epsg):
     """
     Save shapefiles of coastal change indicator lines generated.
@@ -1217,21 +1921,7 @@ def SaveConvShapefiles(outputOG, name_prefix, sitename, epsg): #, shpFileName):
         # drop duplicate shorelines column
         outputsGDF = outputGDF.drop('veglines', axis=1)
     else:    
-        DFlist = []
-        for i in range(len(output['veglines'])): # for each image + associated metadata
-            # create geodataframe of individual features from each geoseries (i.e. feature collection)
-            convlines = output['veglines'][i].to_crs(str(epsg))
-            outputGDF = gpd.GeoDataFrame(geometry=convlines, crs=str(epsg))
-            if 'waterlines' in output.keys():
-                del output['waterlines']
-            for key in output.keys(): # for each column
-                # add column to geodataframe with repeated metadata
-                outputGDF[key] = output[key][i]
-            # add formatted geodataframe to list of all geodataframes
-            DFlist.append(outputGDF)
-        # concatenate to one GDF with individual lines exploded out
-        outputsGDF = gpd.GeoDataFrame( pd.concat( DFlist, ignore_index=True), crs=str(epsg))
-        outputsGDF = outputsGDF.drop('veglines', axis=1)
+        outputsGDF = OutputLinesGDF(output, epsg, 'veglines')
     
     print(f"saving shapefile to {os.path.join(name_prefix, sitename + '_' + str(min(output['dates'])) + '_' + str(max(output['dates'])) + '_veglines.shp')}")
     outputsGDF.to_file(os.path.join(name_prefix, sitename + '_' + str(min(output['dates'])) + '_' + str(max(output['dates'])) + '_veglines.shp'))
@@ -1240,6 +1930,48 @@ def SaveConvShapefiles(outputOG, name_prefix, sitename, epsg): #, shpFileName):
     
     return
 
+def OutputLinesGDF(output, epsg, linekey='veglines'):
+    """
+    Flatten a merged output dictionary into a GeoDataFrame with one row per 
+    line feature, each carrying its image's info (dates, satname etc.). Lines 
+    are reprojected to epsg where needed (ReprojectedLines), so output can be
+    the stored veglines as they are.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    output : dict
+        Dictionary of data generated by VedgeSat/CoastSat (merged format).
+    epsg : int
+        Projection of the GeoDataFrame.
+    linekey : str, optional
+        Which lines to use, 'veglines' or 'waterlines'. The default is 'veglines'.
+
+    Returns
+    -------
+    outputsGDF : GeoDataFrame
+        Line features with per-image info as columns.
+
+    """
+    lines = ReprojectedLines(output[linekey], epsg)
+    # image info columns (other lines are left out)
+    cols = [key for key in output.keys() if key not in ['veglines', 'waterlines']]
+    
+    DFlist = []
+    for i in range(len(lines)): # for each image + associated metadata
+        # create geodataframe of individual features from each geoseries (i.e. feature collection)
+        outputGDF = gpd.GeoDataFrame(geometry=lines[i], crs=lines.epsg)
+        for key in cols: # for each column
+            # add column to geodataframe with repeated metadata
+            outputGDF[key] = output[key][i]
+        # add formatted geodataframe to list of all geodataframes
+        DFlist.append(outputGDF)
+    # concatenate to one GDF with individual lines exploded out
+    outputsGDF = gpd.GeoDataFrame( pd.concat( DFlist, ignore_index=True), crs=lines.epsg)
+    
+    return outputsGDF
+
+
 def SaveConvShapefiles_Water(outputOG, name_prefix, sitename, epsg):
 
     """
@@ -1272,21 +2004,7 @@ def SaveConvShapefiles_Water(outputOG, name_prefix, sitename, epsg):
         # drop duplicate shorelines column
         outputsGDF = outputGDF.drop('waterlines', axis=1)
     else:    
-        DFlist = []
-        for i in range(len(output['waterlines'])): # for each image + associated metadata
-            # create geodataframe of individual features from each geoseries (i.e. feature collection)
-            convlines = output['waterlines'][i].to_crs(str(epsg))
-            outputGDF = gpd.GeoDataFrame(geometry=convlines, crs=str(epsg))
-            if 'veglines' in output.keys():
-                del output['veglines']
-            for key in output.keys(): # for each column
-                # add column to geodataframe with repeated metadata
-                outputGDF[key] = output[key][i]
-            # add formatted geodataframe to list of all geodataframes
-            DFlist.append(outputGDF)
-        # concatenate to one GDF with individual lines exploded out
-        outputsGDF = gpd.GeoDataFrame( pd.concat( DFlist, ignore_index=True), crs=str(epsg))
-        outputsGDF = outputsGDF.drop('waterlines', axis=1)
+        outputsGDF = OutputLinesGDF(output, epsg, 'waterlines')
     
     print(f"saving shapefile to {os.path.join(name_prefix, sitename + '_' + str(min(output['dates'])) + '_' + str(max(output['dates'])) + '_waterlines.shp')}")        
     outputsGDF.to_file(os.path.join(name_prefix, sitename + '_' + str(min(output['dates'])) + '_' + str(max(output['dates'])) + '_waterlines.shp'))
@@ -1750,7 +2468,7 @@ def AOI(lonmin, lonmax, latmin, latmax, sitename):
     BBoxGDF = BBoxGDF.to_crs(crs=projstr)
     # Check if AOI could exceed the 262144 (512x512) pixel limit on ee requests
     if (int(BBoxGDF.area)/(10*10))>262144:
-        print('Warning: your bounding box is too big for GEE requests (%s pixels too big)' % int((BBoxGDF.area/(10*10))-262144))
+        print('Note: your bounding box is too big for a single GEE request (%s pixels too big); images will be downloaded in tiles' % int((BBoxGDF.area/(10*10))-262144))
     
     BBoxGDF['Area'] = BBoxGDF.area/(10*10)
     mapcentrelon = lonmin + ((lonmax - lonmin)/2)
@@ -1816,50 +2534,7 @@ def AOIfromLeaflet(polygon, point, sitename):
     BBoxGDF = BBoxGDF.to_crs(crs=projstr)
     # Check if AOI could exceed the 262144 (512x512) pixel limit on ee requests
     if (int(BBoxGDF.area)/(10*10))>262144:
-        print('Warning: your bounding box is too big for GEE requests (%s pixels too big)' % int((BBoxGDF.area/(10*10))-262144))
-        response = input('Do you want us to try shrinking your bounding box? Type "yes" to run shrinking, or "no" to redraw the box yourself.')
-    
-        if response == 'no':
-            return
-        else:
-            def ShrinkRect(rectangle, scale_factor=0.9):
-                """
-                Shrink edges of rectangle until AOI fits in BBox limit
-                """
-                # Get the current center of the rectangle
-                center = rectangle.centroid
-                # Scale the rectangle about its center
-                shrunken_rectangle = affinity.scale(rectangle, xfact=scale_factor, yfact=scale_factor, origin=center)
-                return shrunken_rectangle
-        
-            scale_factor = 0.9
-            tolerance = 1e-9
-            area_limit = 2000
-            
-            while True:
-                current_area = BBoxGDF.geometry.area.iloc[0]
-                if current_area <= area_limit or current_area <= tolerance:
-                    break
-            
-                # Shrink the geometry
-                shrunken_rectangle = ShrinkRect(BBoxGDF.geometry.iloc[0], scale_factor=scale_factor)
-            
-                # Check if the new geometry is valid and non-degenerate
-                if shrunken_rectangle.is_empty or not shrunken_rectangle.is_valid:
-                    print("Warning: Geometry became invalid. Stopping the loop.")
-                    break
-            
-                BBoxGDF['geometry'] = gpd.GeoSeries([shrunken_rectangle])
-            
-                # Reduce the scale_factor for finer control over the shrinking process
-                scale_factor *= 0.95
-            
-            # Output the final area
-            print(f"Final area: {round(BBoxGDF.geometry.area.iloc[0],2)} m")
-            lonmin = float(BBoxGDF.bounds.minx)
-            lonmax = float(BBoxGDF.bounds.maxx)
-            latmin = float(BBoxGDF.bounds.miny)
-            latmax = float(BBoxGDF.bounds.maxy)
+        print('Note: your bounding box is too big for a single GEE request (%s pixels too big); images will be downloaded in tiles' % int((BBoxGDF.area/(10*10))-262144))
     
     # Export as polygon and ee point for use in clipping satellite image requests
     polygon = [[[lonmin, latmin],[lonmax, latmin],[lonmin, latmax],[lonmax, latmax]]]
@@ -1914,7 +2589,7 @@ def AOIfromLine(referenceLinePath, max_dist_ref, sitename):
 
     # Check if AOI could exceed the 262144 (512x512) pixel limit on ee requests
     if (int(BBoxGDF.area)/(10*10))>262144:
-        print('Warning: your bounding box is too big for Sentinel2 (%s pixels too big)' % int((BBoxGDF.area/(10*10))-262144))
+        print('Note: your bounding box is too big for a single Sentinel2 request (%s pixels too big); images will be downloaded in tiles' % int((BBoxGDF.area/(10*10))-262144))
     
     BBoxGDF['Area'] = BBoxGDF.area/(10*10)
     mapcentrelon = lonmin + ((lonmax - lonmin)/2)
@@ -1993,6 +2668,69 @@ def GStoArr(shoreline):
     shorelineArr = np.array(shorelineArrList)
     return shorelineArr
 
+# read-only boolean masks (e.g. reference line buffers) already built in this process, keyed by what they were made from
+BufferMaskCache = {}
+
+def CachedMask(key, MakeMask, MaxMasks=32):
+    """
+    Return the boolean mask stored under key, or build it with MakeMask() and 
+    store it. Stored masks are made read-only so they can be shared between 
+    images safely. Only the MaxMasks most recently built masks are kept (images
+    that have been coregistered each have a slightly different georef).
+    FM Nov 2024
+
+    Parameters
+    ----------
+    key : tuple
+        Hashable description of everything the mask depends on.
+    MakeMask : function
+        Function taking no arguments which builds the mask.
+    MaxMasks : int, optional
+        Maximum number of masks to keep in memory. The default is 32.
+
+    Returns
+    -------
+    mask : array
+        Read-only boolean mask.
+
+    """
+    if key not in BufferMaskCache:
+        mask = np.array(MakeMask(), dtype=bool)
+        mask.setflags(write=False)
+        if len(BufferMaskCache) >= MaxMasks:
+            # drop the oldest mask (dicts keep insertion order)
+            BufferMaskCache.pop(next(iter(BufferMaskCache)))
+        BufferMaskCache[key] = mask
+    
+    return BufferMaskCache[key]
+
+
+def ArrayHash(arr):
+    """
+    Short hash of an array's shape, type and contents, for use in cache keys.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    arr : array
+        Array to hash.
+
+    Returns
+    -------
+    str
+        Hex digest of the array.
+
+    """
+    arr = np.ascontiguousarray(arr)
+    if arr.dtype == bool:
+        # pack booleans to bits to hash 8x less data
+        arrbytes = np.packbits(arr).tobytes()
+    else:
+        arrbytes = arr.tobytes()
+    
+    return hashlib.sha1(str((arr.shape, arr.dtype.str)).encode() + arrbytes).hexdigest()
+
+
 def ArrtoGS(refline,georef):
     """
     Shoreline array to coords
@@ -2094,10 +2832,82 @@ def NearDate(target,items):
         return nearestDate
 
 
-def FindWPThresh(int_veg, int_nonveg):
+def NearDates(targets, items, targetgroups=None, itemgroups=None, maxdays=153):
+    """
+    Vectorised version of NearDate(); find the nearest date in items to every
+    date in targets using a binary search of the sorted item dates. Ties are
+    resolved the same way as NearDate() (first matching item in list order),
+    and matches are only returned if within maxdays (default 5 months). If 
+    group labels are supplied (e.g. transect numbers), targets are only
+    matched to items in the same group, so many transects can be done in one call.
+    
+    FM Nov 2024
+
+    Parameters
+    ----------
+    targets : list or array
+        Target dates to find nearest dates to (datetimes or 'YYYY-MM-DD' strings).
+    items : list or array
+        Dates to search through (datetimes or 'YYYY-MM-DD' strings).
+    targetgroups : array of int, optional
+        Group label of each target date. The default is None.
+    itemgroups : array of int, optional
+        Group label of each item date. The default is None.
+    maxdays : int, optional
+        Maximum number of days between matching dates. The default is 153.
+
+    Returns
+    -------
+    matches : array of int
+        Index of nearest date in items for each target (-1 where no match exists).
+
+    """
+    matches = np.full(len(targets), -1, dtype=np.int64)
+    if len(targets) == 0 or len(items) == 0:
+        return matches
+    
+    # dates as integer days since epoch
+    targetdays = np.asarray(targets, dtype='datetime64[D]').astype(np.int64)
+    itemdays = np.asarray(items, dtype='datetime64[D]').astype(np.int64)
+    if targetgroups is not None:
+        # offset each group far enough apart that dates can never match across groups
+        daymin = min(targetdays.min(), itemdays.min())
+        span = 2*(max(targetdays.max(), itemdays.max()) - daymin) + 2*maxdays + 2
+        targetdays = (targetdays - daymin) + np.asarray(targetgroups, dtype=np.int64)*span
+        itemdays = (itemdays - daymin) + np.asarray(itemgroups, dtype=np.int64)*span
+    
+    # stable sort so equal dates keep their list order
+    order = np.argsort(itemdays, kind='stable')
+    itemsorted = itemdays[order]
+    # nearest item on or after each target, and nearest item before
+    right = np.searchsorted(itemsorted, targetdays, side='left')
+    left = right - 1
+    hasright = right < len(itemsorted)
+    hasleft = left >= 0
+    right = np.clip(right, 0, len(itemsorted)-1)
+    # first position of the earlier date (in case of repeated dates)
+    left = np.searchsorted(itemsorted, itemsorted[np.clip(left, 0, None)], side='left')
+    
+    rightdist = np.where(hasright, itemsorted[right] - targetdays, np.inf)
+    leftdist = np.where(hasleft, targetdays - itemsorted[left], np.inf)
+    # equally near dates either side go to whichever comes first in items
+    useleft = (leftdist < rightdist) | ((leftdist == rightdist) & (order[left] < order[right]))
+    nearest = np.where(useleft, order[left], order[right])
+    neardist = np.minimum(leftdist, rightdist)
+    
+    # if difference is longer than 5 months, no match exists
+    matches = np.where(neardist <= maxdays, nearest, -1)
+    
+    return matches
+
+
+def FindWPThresh(int_veg, int_nonveg, kde='binned'):
     """
     Find threshold normalised difference value using Weighted Peaks, based on 
     a weighting between the two probability density function peaks of 0.2:0.8.
+    The density functions are estimated with a binned FFT KDE (BinnedKDE) by 
+    default; kde='sklearn' uses the original scikit-learn KernelDensity fit
+    (slow on large scenes, kept as a reference).
     FM Sept 2023
     
     
@@ -2107,6 +2917,8 @@ def FindWPThresh(int_veg, int_nonveg):
         Array of normalised difference pixel values for the vegetation class.
     int_nonveg : array of float64
         Array of normalised difference pixel values for the 'other' class.
+    kde : str, optional
+        KDE method, either 'binned' or 'sklearn'. The default is 'binned'.
 
     Returns
     -------
@@ -2119,21 +2931,22 @@ def FindWPThresh(int_veg, int_nonveg):
     bins = np.arange(-1, 1, 0.01) # start, stop, bin width
     peaks = []
     for i, intdata in enumerate([int_veg, int_nonveg]):
-        model = sklearn.neighbors.KernelDensity(bandwidth=0.01, kernel='gaussian')
-        sample = intdata.reshape((len(intdata), 1))
-        # fill nan values using pandas interpolation
-        sample = np.array(pd.DataFrame(sample).interpolate(limit_direction='both'))
-        model.fit(sample)
-        # sample probabilities for a range of outcomes
-        values = np.asarray([value for value in bins])
-        values = values.reshape((len(values), 1))
-        # calculate probability fns 
-        probabilities = model.score_samples(values)
-        probabilities = np.exp(probabilities)
+        values = bins.reshape((len(bins), 1))
+        if kde == 'sklearn':
+            model = sklearn.neighbors.KernelDensity(bandwidth=0.01, kernel='gaussian')
+            sample = intdata.reshape((len(intdata), 1))
+            # fill nan values using pandas interpolation
+            sample = np.array(pd.DataFrame(sample).interpolate(limit_direction='both'))
+            model.fit(sample)
+            # calculate probability fns for a range of outcomes
+            probabilities = model.score_samples(values)
+            probabilities = np.exp(probabilities)
+        else:
+            probabilities = BinnedKDE(intdata, bins, bandwidth=0.01)
         
         if i == 0: # class with weaker signal
             # take value of band index where probability is max
-            peaks.append(float(values[list(probabilities).index(np.nanmax(probabilities))]))
+            peaks.append(float(bins[np.nanargmax(probabilities)]))
         else:
             prom, _ = scipy.signal.find_peaks(probabilities, prominence=0.5)
             if len(prom) == 0: # for marshland where no peak above NDVI = 0 exists
@@ -2162,6 +2975,64 @@ def FindWPThresh(int_veg, int_nonveg):
 
 
 
+def BinnedKDE(sample, bins, bandwidth=0.01, subdiv=10):
+    """
+    Gaussian kernel density estimate of a 1D sample, evaluated at regularly 
+    spaced bins. The sample is histogrammed onto a grid subdiv times finer than
+    the bins (with linear binning) and convolved with the Gaussian kernel by 
+    FFT, so the cost scales with the number of samples plus the grid size 
+    rather than their product (as with sklearn's KernelDensity.score_samples).
+    NaN samples are dropped.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    sample : array
+        1D array of sample values (e.g. NDVI pixel values of one class).
+    bins : array
+        Regularly spaced values at which to evaluate the density.
+    bandwidth : float, optional
+        Standard deviation of the Gaussian kernel. The default is 0.01.
+    subdiv : int, optional
+        Number of fine grid steps per bin step. The default is 10.
+
+    Returns
+    -------
+    probabilities : array
+        Probability density at each of the bins.
+
+    """
+    sample = np.asarray(sample, dtype=float).ravel()
+    sample = sample[np.isfinite(sample)]
+    if len(sample) == 0:
+        return np.full(len(bins), np.nan)
+    
+    step = (bins[1] - bins[0]) / subdiv
+    # pad the grid by the kernel reach so samples just outside the bins still count
+    npad = int(np.ceil(5 * bandwidth / step))
+    grid0 = bins[0] - npad*step
+    ngrid = (len(bins)-1)*subdiv + 1 + 2*npad
+    
+    # linear binning: split each sample's weight between its two nearest grid points
+    pos = (sample - grid0) / step
+    inside = (pos >= 0) & (pos < ngrid-1)
+    pos = pos[inside]
+    lower = np.floor(pos).astype(int)
+    frac = pos - lower
+    counts = np.bincount(lower, weights=1-frac, minlength=ngrid) + np.bincount(lower+1, weights=frac, minlength=ngrid)
+    
+    # discrete Gaussian kernel (sums to 1) 
+    kx = np.arange(-npad, npad+1) * step
+    kernel = np.exp(-0.5 * (kx/bandwidth)**2)
+    kernel /= kernel.sum()
+    # normalise by all samples (incl. ones far outside the grid) to match a full KDE
+    density = scipy.signal.fftconvolve(counts, kernel, mode='same') / (len(sample) * step)
+    
+    probabilities = np.maximum(density[npad:npad + len(bins)*subdiv:subdiv], 0)
+    
+    return probabilities
+
+
 def TZValuesSTDV(int_veg, int_nonveg):
     """
     Generate bounds for transition zone plot by using the 3rd standard deviations of the two classes.
@@ -2592,6 +3463,47 @@ def ChangeYAMLPaths(configfile, tidepath):
         file.write(filedata)
 
 
+# parsed tide series already read in, keyed by (sitename, start date, end date)
+TideCache = {}
+
+def ReadTideData(settings):
+    """
+    Read in formatted CSV of tide heights and times for a site and date range.
+    The parsed series is kept in memory (per site and date range) so repeated 
+    tidal lookups don't re-read the CSV; it is read again if the file changes.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    settings : dict
+        Dictionary of user-defined settings used for the veg edge/waterline extraction.
+
+    Returns
+    -------
+    Tide_Data : DataFrame
+        Tide heights ('tide') and times ('date'). Shared between calls, so should not be edited in place.
+    TideTimes : array of int64
+        Tide times as nanoseconds since epoch.
+    Tides : array of float64
+        Tide heights.
+
+    """
+    # TideFilepath = os.path.join(settings['inputs']['filepath'],'tides',settings['inputs']['sitename']+'_tides.csv')
+    TideFilepath = os.path.join(settings['inputs']['filepath'],
+                                'tides',settings['inputs']['sitename']+'_tides_'+
+                                settings['inputs']['dates'][0]+'_'+settings['inputs']['dates'][1]+'.csv')
+    TideKey = (settings['inputs']['sitename'], settings['inputs']['dates'][0], settings['inputs']['dates'][1])
+    TideModTime = os.path.getmtime(TideFilepath)
+    
+    if TideKey not in TideCache or TideCache[TideKey][0] != TideModTime:
+        Tide_Data = pd.read_csv(TideFilepath, parse_dates=['date'])
+        TideTimes = Tide_Data['date'].to_numpy(dtype='datetime64[ns]').astype(np.int64)
+        Tides = Tide_Data['tide'].to_numpy(dtype=np.float64)
+        TideCache[TideKey] = (TideModTime, Tide_Data, TideTimes, Tides)
+    
+    return TideCache[TideKey][1:]
+
+
 def GetWaterElevs(settings, Dates_Sat, Daily=False):
     '''
     Extracts matching water elevations from formatted CSV of tide heights and times.
@@ -2612,50 +3524,45 @@ def GetWaterElevs(settings, Dates_Sat, Daily=False):
     '''
 
     # load tidal data
-    # TideFilepath = os.path.join(settings['inputs']['filepath'],'tides',settings['inputs']['sitename']+'_tides.csv')
-    TideFilepath = os.path.join(settings['inputs']['filepath'],
-                                'tides',settings['inputs']['sitename']+'_tides_'+
-                                settings['inputs']['dates'][0]+'_'+settings['inputs']['dates'][1]+'.csv')
-    Tide_Data = pd.read_csv(TideFilepath, parse_dates=['date'])
-    Dates_ts = [_.to_pydatetime() for _ in Tide_Data['date']]
-    Tides_ts = np.array(Tide_Data['tide'])
+    Tide_Data, TideTimes, Tides_ts = ReadTideData(settings)
 
     # Calculate time step used for interpolating data between
-    TimeStep = (Dates_ts[1]-Dates_ts[0]).total_seconds()/(60*60)
-    
-    Tides_Sat = []
+    TimeStep = TideTimes[1] - TideTimes[0]
     
     # Previously found first following tide time, but incorrect when time is e.g. only 1min past the hour
     # for i,date in enumerate(dates_sat):
     #     tides_sat.append(tides_ts[find(min(item for item in dates_ts if item > date), dates_ts)])
     
     # Interpolate tide using number of minutes through the hour the satellite image was captured
-    for i,date in enumerate(Dates_Sat):
-        # find preceding and following hourly tide levels and times
-        # Time_1 = Dates_ts[find(min(item for item in Dates_ts if item > date-timedelta(hours=TimeStep)), Dates_ts)]
-        Tide_1 = Tides_ts[find(min(item for item in Dates_ts if item > date-timedelta(hours=TimeStep)), Dates_ts)]
-        Time_2 = Dates_ts[find(min(item for item in Dates_ts if item > date), Dates_ts)]
-        Tide_2 = Tides_ts[find(min(item for item in Dates_ts if item > date), Dates_ts)]
-        
-        # Find time difference of actual satellite timestamp (next hour minus sat timestamp)
-        TimeDiff = Time_2 - date
-        # Get proportion of time through the hour (e.g. 59mins past = 0.01)
-        TimeProp = TimeDiff / timedelta(hours=TimeStep)
-        
-        # Get difference between the two tidal stages
-        TideDiff = (Tide_2 - Tide_1)
-        Tide_Sat = Tide_2 - (TideDiff * TimeProp)
-        
-        Tides_Sat.append(Tide_Sat)
+    SatTimes = np.array(Dates_Sat, dtype='datetime64[ns]').astype(np.int64)
+    # find preceding and following hourly tide levels and times
+    # (first tide time after satellite time minus one time step, and first tide time after satellite time)
+    Ind_1 = np.searchsorted(TideTimes, SatTimes - TimeStep, side='right')
+    Ind_2 = np.searchsorted(TideTimes, SatTimes, side='right')
+    if np.any(Ind_2 == len(TideTimes)):
+        raise ValueError('Satellite image times fall outside the range of the tide data in '+
+                         settings['inputs']['sitename']+'_tides_'+settings['inputs']['dates'][0]+'_'+
+                         settings['inputs']['dates'][1]+'.csv')
+    Tide_1 = Tides_ts[Ind_1]
+    Tide_2 = Tides_ts[Ind_2]
+    
+    # Find time difference of actual satellite timestamp (next hour minus sat timestamp)
+    TimeDiff = TideTimes[Ind_2] - SatTimes
+    # Get proportion of time through the hour (e.g. 59mins past = 0.01)
+    TimeProp = TimeDiff / TimeStep
+    
+    # Get difference between the two tidal stages
+    TideDiff = (Tide_2 - Tide_1)
+    Tides_Sat = list(Tide_2 - (TideDiff * TimeProp))
     
     # if no daily tide data needed, just return interpolated list of tide elevs
     if Daily==False:
         return Tides_Sat
     else:
         # Otherwise, calculate daily mean and max of tide elevs for whole timeseries
-        Tide_Data.index = Tide_Data['date']
-        Tides_DailyMean = Tide_Data.resample('D')['tide'].mean()
-        Tides_DailyMax = Tide_Data.resample('D')['tide'].max()
+        Tide_Daily = Tide_Data.set_index('date').resample('D')['tide']
+        Tides_DailyMean = Tide_Daily.mean()
+        Tides_DailyMax = Tide_Daily.max()
         return Tides_Sat, Tides_DailyMean, Tides_DailyMax
 
 
@@ -2678,10 +3585,7 @@ def BeachTideLoc(settings, TideSeries=None):
     '''
     
     if TideSeries is None:
-        tidefilepath = os.path.join(settings['inputs']['filepath'],'tides',settings['inputs']['sitename']+
-                                    '_tides_'+settings['inputs']['dates'][0]+'_'+settings['inputs']['dates'][1]+'.csv')
-        tide_data = pd.read_csv(tidefilepath, parse_dates=['date'])
-        tides_ts = np.array(tide_data['tide'])
+        _, _, tides_ts = ReadTideData(settings)
     else:
         tides_ts = TideSeries
     
@@ -2973,6 +3877,58 @@ def InterpolateRaster(raster, method='nearest'):
     
     return interp_raster
 
+def RasterFillWeights(mask, method='nearest'):
+    """
+    Work out which valid cells (and weights) each empty cell of a raster would 
+    be filled from, so the same fill can be reused on every raster in a stack 
+    with a static mask (e.g. land cells in a wave timeseries). 'nearest' matches
+    InterpolateRaster(), and 'linear' (with nearest for cells outside the valid
+    data) matches InterpolateCircRaster() when applied to sin/cos components.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    mask : array
+        2D boolean array, True where raster cells are empty.
+    method : str, optional
+        Interpolation method to be used ['nearest','linear']. The default is 'nearest'.
+
+    Returns
+    -------
+    fillcoords : array
+        Row and column of each empty cell (shape=(n empty, 2)).
+    srccoords : array
+        Rows and columns of the valid cells to fill each empty cell from 
+        (shape=(n empty, k, 2), with k=1 for nearest and 3 for linear).
+    weights : array
+        Weight of each valid cell used in the fill (shape=(n empty, k)).
+
+    """
+    validcoords = np.array(np.nonzero(~mask)).T
+    fillcoords = np.array(np.nonzero(mask)).T
+    
+    # nearest valid cell to each empty cell
+    _, nearest = cKDTree(validcoords).query(fillcoords)
+    if method == 'nearest':
+        srcind = nearest[:, None]
+        weights = np.ones((len(fillcoords), 1))
+    else:
+        # triangle of valid cells around each empty cell and barycentric weights
+        tri = Delaunay(validcoords)
+        simplex = tri.find_simplex(fillcoords)
+        transform = tri.transform[simplex]
+        bary = np.einsum('ijk,ik->ij', transform[:, :2], fillcoords - transform[:, 2])
+        weights = np.c_[bary, 1 - bary.sum(axis=1)]
+        srcind = tri.simplices[simplex]
+        # cells outside the valid data use nearest valid cell instead
+        outside = simplex == -1
+        srcind[outside] = nearest[outside, None]
+        weights[outside] = [1., 0., 0.]
+    srccoords = validcoords[srcind]
+    
+    return fillcoords, srccoords, weights
+
+
 def InterpolateCircRaster(raster, method='nearest', nodata_value=-32767):
     '''
     Interpolate over empty values in a raster of angles in degrees between 0 and 360 (e.g. wave directions).
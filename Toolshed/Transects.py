@@ -25,6 +25,7 @@ from scipy import stats
 from pylab import ginput
 import rasterio as rio
 from rasterio.features import shapes
+import shapely
 from shapely.geometry import Point, Polygon, LineString, MultiLineString, MultiPoint
 
 
@@ -197,8 +198,9 @@ def GetIntersections(BasePath, TransectGDF, ShorelineGDF):
         Path to shapefiles of transects.
     TransectGDF : GeoDataFrame
         GDF of shore-normal transects created.
-    ShorelineGDF : GeoDataFrame
-        GDF of lines extracted from sat images.
+    ShorelineGDF : GeoDataFrame or dict
+        GDF of lines extracted from sat images, or the (merged) output dictionary
+        of veglines itself, which is flattened in the transects' CRS.
 
     Returns
     -------
@@ -209,84 +211,228 @@ def GetIntersections(BasePath, TransectGDF, ShorelineGDF):
      
     print("performing intersections between transects...")
     
+    if type(ShorelineGDF) == dict:
+        # lines straight from the output store, reprojected to match the transects
+        ShorelineGDF = Toolbox.OutputLinesGDF(ShorelineGDF, TransectGDF.crs.to_epsg(), 'veglines')
+    
     # checking for mismatched coordinate systems
     if TransectGDF.crs != ShorelineGDF.crs:
         print("Your coordinate systems are mismatched; changing transect CRS to match shorelines CRS...")
         TransectGDF.to_crs(ShorelineGDF.crs, inplace=True)
-    # initialise where each intersection between lines and transects will be saved
-    ColumnData = []
-    Geoms = []
-    # for each row/feature in transect
-    for _, _, ID, TrGeom, refpnt in TransectGDF.itertuples():
-        # for each row/feature shoreline
-        for _,dates,times,filename,cloud,ids,vthresh,wthresh,tideelev,satn,SGeom in ShorelineGDF.itertuples():
-            # calculate intersections between each transect and shoreline
-            Intersects = TrGeom.intersection(SGeom)
-            ColumnData.append((ID,refpnt,dates,times,filename,cloud,ids,vthresh,wthresh,tideelev,satn))
-            Geoms.append(Intersects)
-            
-    # create GDF from appended lists of intersections        
-    AllIntersects = gpd.GeoDataFrame(ColumnData,geometry=Geoms,columns=['TransectID','reflinepnt','dates','times','filename','cloud_cove','idx','vthreshold','wthreshold','tideelev','satname'])
-    # remove any rows with no intersections
-    AllIntersects = AllIntersects[~AllIntersects.is_empty].reset_index().drop('index',axis=1)
-    # duplicate geom column to save point intersections
-    AllIntersects['interpnt'] = AllIntersects['geometry']
-    # take only first point on any transects which intersected a single shoreline more than once
-    for inter in range(len(AllIntersects)):
-        if AllIntersects['interpnt'][inter].geom_type == 'MultiPoint':
-            AllIntersects['interpnt'][inter] = list(AllIntersects['interpnt'][inter].geoms)[0] # list() accesses individual points in MultiPoint
-    # AllIntersects = AllIntersects.drop('geometry',axis=1)
-    AllIntersects = AllIntersects.rename_geometry('pntgeometry')
-
-    # attribute join on transect ID to get transect geometry back
-    AllIntersects = AllIntersects.merge(TransectGDF[['TransectID','geometry']], on='TransectID')
-    AllIntersects = AllIntersects.drop('pntgeometry',axis=1)
-
     
-    print("formatting into GeoDataFrame...")
-    # initialise distances of intersections 
-    distances = []
-    # for each intersection
-    for i in range(len(AllIntersects)):
-        # calculate distance of intersection along transect
-        distances.append(np.sqrt( 
-            (AllIntersects['interpnt'][i].x - AllIntersects['geometry'][i].coords[0][0])**2 + 
-            (AllIntersects['interpnt'][i].y - AllIntersects['geometry'][i].coords[0][1])**2 ))
-    AllIntersects['distances'] = distances
+    # shoreline attributes are taken in column order
+    LineCols = ['dates','times','filename','cloud_cove','idx','vthreshold','wthreshold','tideelev','satname']
+    LineCols = dict(zip(LineCols, ShorelineGDF.drop(columns=ShorelineGDF.geometry.name).columns))
     
+    # intersect every transect with every shoreline in one go
+    AllIntersects = IntersectTransects(TransectGDF, ShorelineGDF, LineCols, TrCols=['reflinepnt'])
+
+    print("formatting into GeoDataFrame...")
     TransectDict = TransectGDF.to_dict('list')
-    for Key in AllIntersects.drop(['TransectID','geometry'],axis=1).keys():
-        TransectDict[Key] = {}
-    TransectDict['interpnt'] = AllIntersects['interpnt'].copy()
-    TransectDict['distances'] = AllIntersects['distances'].copy()
+    KeyName = ['reflinepnt'] + list(LineCols.keys()) + ['interpnt', 'distances']
+    # split intersection values out into lists for each transect
+    TransectDict.update(TransectLists(AllIntersects, TransectGDF['TransectID'], KeyName))
+    
+    print("TransectDict with intersections created.")
     
+    TransectInterGDF = gpd.GeoDataFrame(TransectDict, crs=ShorelineGDF.crs)
 
-    #initialise lists used for storing each transect's intersection values
-    reflinepnt, dates, times, filename, cloud_cove, idx, vthreshold, wthreshold, satname, tideelev, distances, interpnt = ([] for i in range(12)) # per-transect lists of values
+    return TransectInterGDF
+
+
+def IntersectTransects(TransectGDF, LineGDF, LineCols={}, TrCols=[], ExtendDist=None, PntName='interpnt', DistName='distances'):
+    """
+    Intersect every transect with every line in one vectorised pass. Candidate
+    transect-line pairs are found with an STRtree of the lines, and only pairs
+    that actually cross are intersected. Where a transect crosses a line more 
+    than once, only the first point is kept. Distances are measured from the 
+    start (landward end) of each original (unextended) transect.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    TransectGDF : GeoDataFrame
+        GDF of shore-normal transects (with a 'TransectID' field).
+    LineGDF : GeoDataFrame
+        GDF of lines to intersect with (veglines, waterlines, validation lines etc.).
+    LineCols : dict, optional
+        Line fields to carry through to each intersection, as {new name : LineGDF field}. 
+        The default is {}.
+    TrCols : list, optional
+        Transect fields to carry through to each intersection. The default is [].
+    ExtendDist : float, optional
+        Distance to extend each transect by (both seaward and landward) before
+        intersecting, using Toolbox.ExtendLine(). The default is None (no extension).
+    PntName : str, optional
+        Name of field to store intersection points in. The default is 'interpnt'.
+    DistName : str, optional
+        Name of field to store distances along transect in. The default is 'distances'.
 
-    Key = [reflinepnt,dates,times,filename,cloud_cove,idx,vthreshold, wthreshold,satname,tideelev,  distances, interpnt]
-    KeyName = ['reflinepnt','dates','times','filename','cloud_cove','idx','vthreshold', 'wthreshold','tideelev','satname', 'distances', 'interpnt']
+    Returns
+    -------
+    AllIntersects : DataFrame
+        One row per transect-line intersection (sorted by transect then line), 
+        with the fields 'TransectID', TrCols, LineCols, PntName and DistName.
+
+    """
+    TrGeoms = np.asarray(TransectGDF.geometry.values)
+    LineGeoms = np.asarray(LineGDF.geometry.values)
+    if ExtendDist is not None:
+        # Extend transect lines out to sea and inland
+        InterGeoms = np.array([Toolbox.ExtendLine(TrGeom, ExtendDist) for TrGeom in TrGeoms], dtype=object)
+    else:
+        InterGeoms = TrGeoms
     
-    # for each column name
-    for i in range(len(Key)):
-        # for each transect
-        for Tr in range(len(TransectGDF['TransectID'])):
-            # refresh per-transect list
-            TrKey = []
-            # for each matching intersection on a single transect
-            for j in range(len(AllIntersects.loc[AllIntersects['TransectID']==Tr])):
-                # append each intersection value to a list for each transect
-                # iloc used so index doesn't restart at 0 each loop
-                TrKey.append(AllIntersects[KeyName[i]].loc[AllIntersects['TransectID']==Tr].iloc[j]) 
-            Key[i].append(TrKey)
+    # find every transect-line pair that crosses, in transect then line order
+    TrInd, LineInd = shapely.STRtree(LineGeoms).query(InterGeoms, predicate='intersects')
+    PairOrder = np.lexsort((LineInd, TrInd))
+    TrInd, LineInd = TrInd[PairOrder], LineInd[PairOrder]
     
-        TransectDict[KeyName[i]] = Key[i]
+    Intersects = shapely.intersection(InterGeoms[TrInd], LineGeoms[LineInd])
+    # remove any pairs that only touched with no intersection left
+    NotEmpty = ~shapely.is_empty(Intersects)
+    TrInd, LineInd, Intersects = TrInd[NotEmpty], LineInd[NotEmpty], Intersects[NotEmpty]
     
-    print("TransectDict with intersections created.")
+    # take only first point on any transects which intersected a single line more than once
+    IsMulti = shapely.get_type_id(Intersects) == shapely.GeometryType.MULTIPOINT
+    Intersects[IsMulti] = shapely.get_geometry(Intersects[IsMulti], 0)
     
-    TransectInterGDF = gpd.GeoDataFrame(TransectDict, crs=ShorelineGDF.crs)
+    # calculate distance of intersection along transect
+    TrStarts = shapely.get_point(TrGeoms[TrInd], 0)
+    Distances = np.sqrt( (shapely.get_x(Intersects) - shapely.get_x(TrStarts))**2 + 
+                         (shapely.get_y(Intersects) - shapely.get_y(TrStarts))**2 )
+    
+    AllIntersects = pd.DataFrame({'TransectID': TransectGDF['TransectID'].to_numpy()[TrInd]})
+    for Col in TrCols:
+        AllIntersects[Col] = TransectGDF[Col].to_numpy()[TrInd]
+    for NewCol, Col in LineCols.items():
+        AllIntersects[NewCol] = LineGDF[Col].to_numpy()[LineInd]
+    AllIntersects[PntName] = Intersects
+    AllIntersects[DistName] = Distances
+    
+    return AllIntersects
 
-    return TransectInterGDF
+
+def TransectLists(AllIntersects, TransectIDs, Keys):
+    """
+    Scatter rows of intersection values back into per-transect lists, using a 
+    single groupby on transect ID. Values keep the order they appear in 
+    AllIntersects, and transects without intersections get empty lists.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    AllIntersects : DataFrame
+        Intersection values, one row per intersection (with a 'TransectID' field).
+    TransectIDs : list or Series
+        IDs of transects, in the order the lists should be returned.
+    Keys : list
+        Names of intersection fields to split into lists.
+
+    Returns
+    -------
+    TrLists : dict
+        Each key in Keys with a list (one per transect) of intersection values.
+
+    """
+    # positions of each transect's rows in AllIntersects
+    TrRows = AllIntersects.groupby('TransectID', sort=False).indices
+    
+    TrLists = {}
+    for Key in Keys:
+        Values = AllIntersects[Key].to_numpy()
+        TrLists[Key] = [list(Values[TrRows[TrID]]) if TrID in TrRows else [] for TrID in TransectIDs]
+    
+    return TrLists
+
+
+def FlattenTransectLists(TrLists):
+    """
+    Flatten per-transect lists of values into one array, alongside the 
+    transect number of each value (the inverse of SplitTransectLists()).
+    FM Nov 2024
+
+    Parameters
+    ----------
+    TrLists : list or Series
+        Lists of values, one list per transect.
+
+    Returns
+    -------
+    Values : array
+        All values in transect order.
+    TrNums : array of int
+        Transect number (position in TrLists) of each value.
+    Lengths : array of int
+        Number of values for each transect.
+
+    """
+    Lengths = np.array([len(TrList) for TrList in TrLists], dtype=int)
+    Values = np.array([Value for TrList in TrLists for Value in TrList])
+    TrNums = np.repeat(np.arange(len(Lengths)), Lengths)
+    
+    return Values, TrNums, Lengths
+
+
+def SplitTransectLists(Values, Lengths):
+    """
+    Split a flat array of values back into per-transect lists.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    Values : array
+        All values in transect order.
+    Lengths : array of int
+        Number of values for each transect.
+
+    Returns
+    -------
+    list
+        Lists of values, one list per transect.
+
+    """
+    return [list(TrValues) for TrValues in np.split(Values, np.cumsum(Lengths)[:-1])]
+
+
+def VegWaterDists(TransectInterGDFWater):
+    """
+    Calculate beach widths (veg edge to tidally corrected waterline) along every
+    transect, by matching each waterline date to the nearest veg edge date on
+    the same transect in one call of Toolbox.NearDates(). Waterlines with no
+    veg edge within 5 months get NaN; transects with no veg edges get empty lists.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    TransectInterGDFWater : GeoDataFrame
+        GDF of cross-shore transects with veg edge and (corrected) waterline intersections.
+
+    Returns
+    -------
+    list
+        Beach widths for each transect (one per waterline date).
+
+    """
+    WLDates, WLTrs, WLLengths = FlattenTransectLists(TransectInterGDFWater['wldates'])
+    VLDates, VLTrs, _ = FlattenTransectLists(TransectInterGDFWater['dates'])
+    WLDists, _, _ = FlattenTransectLists(TransectInterGDFWater['wlcorrdist'])
+    VLDists, _, _ = FlattenTransectLists(TransectInterGDFWater['distances'])
+    
+    # index of closest vegline date to each waterline date
+    DateIndex = Toolbox.NearDates(WLDates, VLDates, WLTrs, VLTrs)
+    # calculate distance between two intersections (veg - water means +ve is veg measured seaward towards water)
+    VLSLDists = np.full(len(WLDates), np.nan)
+    Matched = DateIndex > -1
+    VLSLDists[Matched] = WLDists[Matched] - VLDists[DateIndex[Matched]]
+    
+    BeachWidths = SplitTransectLists(VLSLDists, WLLengths)
+    # no widths at all on transects without veg edges
+    for Tr, VLDateList in enumerate(TransectInterGDFWater['dates']):
+        if len(VLDateList) == 0:
+            BeachWidths[Tr] = []
+    
+    return BeachWidths
     
  
 
@@ -330,69 +476,15 @@ def GetBeachWidth(BasePath, TransectGDF, TransectInterGDF, WaterlineGDF, setting
     if TransectGDF.crs != WaterlineGDF.crs:
         print("Your coordinate systems are mismatched; changing transect CRS to match shorelines CRS...")
         TransectGDF.to_crs(WaterlineGDF.crs, inplace=True)
-    # initialise where each intersection between lines and transects will be saved
-    ColumnData = []
-    Geoms = []
-    # for each row/feature in transect
-    for _, _, ID, TrGeom, refpnt in TransectGDF.itertuples():
-        # Extend transect line out to sea and inland
-        TrGeom = Toolbox.ExtendLine(TrGeom, 300)
-        # for each row/feature shoreline
-        for _,dates,_,_,_,_,_,_,_,_,SGeom in WaterlineGDF.itertuples():
-            # calculate intersections between each transect and shoreline
-            Intersects = TrGeom.intersection(SGeom)
-            ColumnData.append((ID,dates))
-            Geoms.append(Intersects)
-            
-    # create GDF from appended lists of intersections        
-    AllIntersects = gpd.GeoDataFrame(ColumnData,geometry=Geoms,columns=['TransectID', 'wldates'])
-    # remove any rows with no intersections
-    AllIntersects = AllIntersects[~AllIntersects.is_empty].reset_index().drop('index',axis=1)
-    # duplicate geom column to save point intersections
-    AllIntersects['wlinterpnt'] = AllIntersects['geometry']
-    # take only first point on any transects which intersected a single shoreline more than once
-    for inter in range(len(AllIntersects)):
-        if AllIntersects['wlinterpnt'][inter].geom_type == 'MultiPoint':
-            AllIntersects['wlinterpnt'][inter] = list(AllIntersects['wlinterpnt'][inter].geoms)[0] # list() accesses individual points in MultiPoint
-    # AllIntersects = AllIntersects.drop('geometry',axis=1)
-    AllIntersects = AllIntersects.rename_geometry('pntgeometry')
-
-    # attribute join on transect ID to get transect geometry back
-    AllIntersects = AllIntersects.merge(TransectGDF[['TransectID','geometry']], on='TransectID')
-    AllIntersects = AllIntersects.drop('pntgeometry',axis=1)
-
+    # intersect extended transects with every waterline (dates taken from first field)
+    AllIntersects = IntersectTransects(TransectGDF, WaterlineGDF, {'wldates':WaterlineGDF.columns[0]}, 
+                                       ExtendDist=300, PntName='wlinterpnt', DistName='wldists')
 
     print("formatting into GeoDataFrame...")
-    # initialise distances of intersections 
-    distances = []
-    # for each intersection
-    for i in range(len(AllIntersects)):
-        # calculate distance of intersection along transect
-        distances.append(np.sqrt( 
-            (AllIntersects['wlinterpnt'][i].x - AllIntersects['geometry'][i].coords[0][0])**2 + 
-            (AllIntersects['wlinterpnt'][i].y - AllIntersects['geometry'][i].coords[0][1])**2 ))
-    AllIntersects['wldists'] = distances
-
-    #initialise lists used for storing each transect's intersection values
-    dates, distances, interpnt = ([] for i in range(3)) # per-transect lists of values
-
-    Key = [dates, distances, interpnt]
-    KeyName = ['wldates','wldists','wlinterpnt']
-       
-    # for each column name
-    for i in range(len(Key)):
-        # for each transect
-        for Tr in range(len(TransectGDF['TransectID'])):
-            # refresh per-transect list
-            TrKey = []
-            # for each matching intersection on a single transect
-            for j in range(len(AllIntersects.loc[AllIntersects['TransectID']==Tr])):
-                # append each intersection value to a list for each transect
-                # iloc used so index doesn't restart at 0 each loop
-                TrKey.append(AllIntersects[KeyName[i]].loc[AllIntersects['TransectID']==Tr].iloc[j]) 
-            Key[i].append(TrKey)
-    
-        TransectInterGDFWater[KeyName[i]] = Key[i]
+    # split intersection values out into lists for each transect
+    WLData = TransectLists(AllIntersects, TransectGDF['TransectID'], ['wldates','wldists','wlinterpnt'])
+    for Key, Data in WLData.items():
+        TransectInterGDFWater[Key] = Data
         
     
     # Create beach width attribute
@@ -419,29 +511,9 @@ def GetBeachWidth(BasePath, TransectGDF, TransectInterGDF, WaterlineGDF, setting
 
         TransectInterGDFWater['tidezone'].iloc[Tr] = ShoreLevels
         
-        
-        print('calculating distances between veg and water lines...')
-        # dates into transect-specific list
-        WLDateList = [datetime.strptime(date, '%Y-%m-%d') for date in TransectInterGDFWater['wldates'].iloc[Tr]]
-        VLDateList = [datetime.strptime(date, '%Y-%m-%d') for date in TransectInterGDFWater['dates'].iloc[Tr]]
-        # find index of closest waterline date to each vegline date
-        VLSLDists = []
-        for D, WLDate in enumerate(WLDateList):
-            # index of matching nearest date
-            if VLDateList != []:
-                DateLoc = Toolbox.NearDate(WLDate,VLDateList)
-                if DateLoc == False:
-                    VLSLDists.append(np.nan)
-                    continue
-                else:
-                    DateIndex = VLDateList.index(DateLoc)
-            else:
-                continue
-            # use date index to identify matching distance along transect
-            # and calculate distance between two intersections (veg - water means +ve is veg measured seaward towards water)
-            VLSLDists.append(TransectInterGDFWater['wlcorrdist'].iloc[Tr][D] - TransectInterGDFWater['distances'].iloc[Tr][DateIndex])
-        TransectInterGDFWater['beachwidth'].iloc[Tr] = VLSLDists
-        
+    print('calculating distances between veg and water lines...')
+    # match waterline dates to nearest vegline dates on all transects at once
+    TransectInterGDFWater['beachwidth'] = VegWaterDists(TransectInterGDFWater)
         
     print("TransectDict with beach width and waterline intersections created.")
         
@@ -490,72 +562,20 @@ def GetWaterIntersections(BasePath, TransectGDF, TransectInterGDF, WaterlineGDF,
     if TransectGDF.crs != WaterlineGDF.crs:
         print("Your coordinate systems are mismatched; changing transect CRS to match shorelines CRS...")
         TransectGDF.to_crs(WaterlineGDF.crs, inplace=True)
-    # initialise where each intersection between lines and transects will be saved
-    ColumnData = []
-    Geoms = []
-    
-    # START of faster code
-    # Spatial indexing with `sindex`
-    WaterlineGDF_sindex = WaterlineGDF.sindex
-    # Perform intersection operations
-    for row in TransectGDF.itertuples():
-        _, _, ID, TrGeom, refpnt = row
-        # Extend transect line out to sea and inland
-        TrGeom = Toolbox.ExtendLine(TrGeom, 300)
-        # Use spatial indexing to find possible intersecting shorelines
-        MatchesID = list(WaterlineGDF_sindex.intersection(TrGeom.bounds))
-        Matches = WaterlineGDF.iloc[MatchesID]
-        # for each row/feature shoreline
-        for WL_row in Matches.itertuples():
-            _, dates, times, _, _, _, _, _, _, _, SGeom = WL_row
-            Intersects = TrGeom.intersection(SGeom)
-            # ignore any rows with no intersections
-            if not Intersects.is_empty:
-                ColumnData.append((ID, dates, times))
-                Geoms.append(Intersects)
-    
-    # Create GeoDataFrame of intersections and filter empty intersections
-    AllIntersects = gpd.GeoDataFrame(ColumnData, geometry=Geoms, columns=['TransectID', 'wldates', 'wltimes'])
-    
-    # take only first point on any transects which intersected a single shoreline more than once
-    AllIntersects['wlinterpnt'] = AllIntersects['geometry'].apply(
-        lambda geom: geom.geoms[0] if geom.geom_type == 'MultiPoint' else geom)
-    # END of faster code
-    
-    # AllIntersects = AllIntersects.drop('geometry',axis=1)
-    AllIntersects = AllIntersects.rename_geometry('pntgeometry')
-
-    # attribute join on transect ID to get transect geometry back
-    AllIntersects = AllIntersects.merge(TransectGDF[['TransectID','geometry']], on='TransectID')
-    AllIntersects = AllIntersects.drop('pntgeometry',axis=1)
-    
-    # START of faster code
-    # calculate distances of intersections 
-    AllIntersects['wldists'] = AllIntersects.apply(
-        lambda row: row['wlinterpnt'].distance(Point(row['geometry'].coords[0])) 
-        if row['wlinterpnt'] 
-        else np.nan, axis=1)
+    # intersect extended transects with every waterline (dates and times taken from first two fields)
+    AllIntersects = IntersectTransects(TransectGDF, WaterlineGDF, 
+                                       {'wldates':WaterlineGDF.columns[0], 'wltimes':WaterlineGDF.columns[1]}, 
+                                       ExtendDist=300, PntName='wlinterpnt', DistName='wldists')
 
     print("formatting into GeoDataFrame...")
     TransectInterGDFWater = TransectInterGDF.copy()
-    # Initialise dictionary with empty lists for each TransectID in TransectInterGDFWater
-    WLData = {name: [[] for _ in range(len(TransectInterGDFWater))] for name in ['wldates', 'wltimes', 'wldists', 'wlinterpnt']}
-
-    # Create a mapping of TransectID to index for quick assignment
-    Tr_Ind = {Tr: idx for idx, Tr in enumerate(TransectInterGDFWater['TransectID'])}
-
-    # Populate WLData only for TransectIDs with intersections
-    for TrID, TrGroup in AllIntersects.groupby('TransectID'):
-        # Sort the wldists lists to maintain temporal order
-        TrGroup_sort = TrGroup.sort_values(by='wldates')
-        idx = Tr_Ind[TrID]  # Get the index in TransectInterGDF for this TransectID
-        for datakey in ['wldates','wltimes','wldists','wlinterpnt']:
-            WLData[datakey][idx] = TrGroup_sort[datakey].tolist()
+    # Sort the intersections to maintain temporal order within each transect
+    AllIntersects = AllIntersects.sort_values(by='wldates', kind='stable')
+    WLData = TransectLists(AllIntersects, TransectInterGDFWater['TransectID'], ['wldates','wltimes','wldists','wlinterpnt'])
 
     # Assign now-filled lists to the corresponding TransectInterGDFWater columns
     for key, data in WLData.items():
         TransectInterGDFWater[key] = data
-    # END of faster code
 
     return TransectInterGDFWater
 
@@ -581,30 +601,9 @@ def CalcBeachWidth(settings, TransectGDF, TransectInterGDFWater):
                 ShoreLevels.append('upper')
 
         TransectInterGDFWater['tidezone'].iloc[Tr] = ShoreLevels
-        
-        # dates into transect-specific list
-        WLDateList = [datetime.strptime(date, '%Y-%m-%d') for date in TransectInterGDFWater['wldates'].iloc[Tr]]
-        VLDateList = [datetime.strptime(date, '%Y-%m-%d') for date in TransectInterGDFWater['dates'].iloc[Tr]]
-        # find index of closest waterline date to each vegline date
-        VLSLDists = []
-        for D, WLDate in enumerate(WLDateList):
-            # index of matching nearest date
-            if VLDateList != []:
-                DateLoc = Toolbox.NearDate(WLDate,VLDateList)
-                if DateLoc == False:
-                    VLSLDists.append(np.nan)
-                    continue
-                else:
-                    DateIndex = VLDateList.index(DateLoc)
-            else:
-                continue
-            # use date index to identify matching distance along transect
-            # and calculate distance between two intersections (veg - water means +ve is veg measured seaward towards water)
-            VLSLDists.append(TransectInterGDFWater['wlcorrdist'].iloc[Tr][D] - TransectInterGDFWater['distances'].iloc[Tr][DateIndex])
-
-
-        TransectInterGDFWater['beachwidth'].iloc[Tr] = VLSLDists
-        
+    
+    # match waterline dates to nearest vegline dates on all transects at once
+    TransectInterGDFWater['beachwidth'] = VegWaterDists(TransectInterGDFWater)
         
     print("\nTransectDict with beach width and waterline intersections created.")
         
@@ -661,35 +660,42 @@ def TidalCorrection(settings, output, TransectInterGDFWater, AvBeachSlope=None):
     TidalStages = [] # timeseries value per transect
     CorrectedDists = [] # timeseries value per transect
     
+    DatesSatTrs, TidesSatTrs = [], [] # timeseries value per transect
     for Tr in range(len(TransectInterGDFWater)):
-        print(f"\r{Tr} / {len(TransectInterGDFWater)}", end='\r')        
-        
         dates_dt_tr = [datetime.strptime(date_str, '%Y-%m-%d').date() for date_str in TransectInterGDFWater['wldates'].iloc[Tr]]
         dates_sat_tr = [] # attach times to per-transect dates
         for date in dates_dt_tr:
             for dt in dates_sat:
                 if dt.date() == date:
                     dates_sat_tr.append(datetime.combine(date, dt.time()))
-        tides_sat_tr = [tide_dict[date] for date in dates_sat_tr]
+        DatesSatTrs.append(dates_sat_tr)
+        TidesSatTrs.append([tide_dict[date] for date in dates_sat_tr])
+    
+    # TO DO: figure out way of running this per transect
+    DEMpath = os.path.join(settings['inputs']['filepath'],'tides',settings['inputs']['sitename']+'_DEM.tif')
+    if os.path.exists(DEMpath):
+        MSL = 1.0
+        MHWS = 0.1
+        TrBeachSlopes = [GetBeachSlopesDEM(MSL, MHWS, DEMpath)] * len(TransectInterGDFWater)
+    
+    elif AvBeachSlope is None: # no average slope provided, calculate slope
+        # tidal peak and frequencies found once for the site, then each transect's
+        # slope is estimated in parallel (global-constant slope of tan(Beta) = 0.1 
+        # if only a few observations exist)
+        print('estimating beach slopes...')
+        TrBeachSlopes = Slope.CoastSatSlopes(dates_sat, tides_sat, DatesSatTrs, TidesSatTrs, 
+                                             list(TransectInterGDFWater['wldists']), 
+                                             n_workers=settings.get('n_workers', 1))
+    
+    else: # just use user-provided beach-average slope
+        TrBeachSlopes = [AvBeachSlope] * len(TransectInterGDFWater)
+    
+    for Tr in range(len(TransectInterGDFWater)):
+        print(f"\r{Tr} / {len(TransectInterGDFWater)}", end='\r')        
         
+        tides_sat_tr = TidesSatTrs[Tr]
         cross_distances = TransectInterGDFWater['wldists'].iloc[Tr]
-        
-        # TO DO: figure out way of running this per transect
-        DEMpath = os.path.join(settings['inputs']['filepath'],'tides',settings['inputs']['sitename']+'_DEM.tif')
-        if os.path.exists(DEMpath):
-            MSL = 1.0
-            MHWS = 0.1
-            BeachSlope = GetBeachSlopesDEM(MSL, MHWS, DEMpath)
-        
-        elif AvBeachSlope is None: # no average slope provided, calculate slope
-            # if only a few observations exist, just use global-constant beach slope of tan(Beta) = 0.1
-            if len(dates_sat_tr) < 10:
-                BeachSlope = 0.1
-            else:
-                BeachSlope = Slope.CoastSatSlope(dates_sat_tr, tides_sat_tr, cross_distances)
-        
-        else: # just use user-provided beach-average slope
-            BeachSlope = AvBeachSlope
+        BeachSlope = TrBeachSlopes[Tr]
         
         # After calculating tidal stages (and beach slopes if needed), perform 
         # tidal correction on each waterline position in each transect
@@ -791,30 +797,37 @@ def WLCorrections(settings, output, TransectInterGDFWater, TransectInterGDFWave=
     else:
         BeachSlopeDEM = None  # No DEM slope
     
+    # Gather and match dates for each transect's observations
+    DatesSatTrs = []
+    for _, transect in TransectInterGDFWater.iterrows():
+        dates_dt_tr = [datetime.strptime(date_str, '%Y-%m-%d').date() for date_str in transect['wldates']]
+        DatesSatTrs.append([datetime.combine(date, next(dt.time() for dt in dates_sat if dt.date() == date)) for date in dates_dt_tr])
+    TidesSatTrs = [[tide_dict[date] for date in dates_sat_tr] for dates_sat_tr in DatesSatTrs]
+    
+    # Determine beach slope for each transect
+    if BeachSlopeDEM is not None:
+        TrBeachSlopes = [BeachSlopeDEM] * len(TransectInterGDFWater)
+    elif AvBeachSlope is not None:
+        TrBeachSlopes = [AvBeachSlope] * len(TransectInterGDFWater)
+    else:
+        # Calculate beach slopes dynamically if needed; tidal peak and frequencies
+        # are found once for the site and each transect's slope estimated in parallel
+        # (tides needs to be used bc if any nan, then fine_tide_peak fails)
+        print('estimating beach slopes...')
+        TrBeachSlopes = Slope.CoastSatSlopes(dates_sat, hourlytides, DatesSatTrs, TidesSatTrs, 
+                                             list(TransectInterGDFWater['wldists']), 
+                                             n_workers=settings.get('n_workers', 1))
+    
     # Process each transect
-    for Tr, transect in TransectInterGDFWater.iterrows():
+    for Tr, (_, transect) in enumerate(TransectInterGDFWater.iterrows()):
         print(f"\r corrected {Tr} / {len(TransectInterGDFWater)} transects", end='')       
-        # Gather and match dates for each transect's observations
-        dates_dt_tr = [datetime.strptime(date_str, '%Y-%m-%d').date() for date_str in transect['wldates']]
-        dates_sat_tr = [datetime.combine(date, next(dt.time() for dt in dates_sat if dt.date() == date)) for date in dates_dt_tr]
-        tides_sat_tr = [tide_dict[date] for date in dates_sat_tr]
+        dates_sat_tr = DatesSatTrs[Tr]
+        tides_sat_tr = TidesSatTrs[Tr]
         TWL_tr = [TWL_dict[date] for date in dates_sat_tr]
         
         # Retrieve transect cross distances
         cross_distances = transect['wldists']
-    
-        # Determine beach slope for this transect
-        if BeachSlopeDEM is not None:
-            BeachSlope = BeachSlopeDEM
-        elif AvBeachSlope is not None:
-            BeachSlope = AvBeachSlope
-        else:
-            # Calculate beach slope dynamically if needed
-            if len(dates_sat_tr) < 10:
-                BeachSlope = 0.1
-            else:
-                # tides needs to be used bc if any nan, then fine_tide_peak fails
-                BeachSlope = Slope.CoastSatSlope(dates_sat_tr, tides_sat_tr, cross_distances)
+        BeachSlope = TrBeachSlopes[Tr]
     
         # Correct each cross-shore distance for tidal elevation
         CorrectedDistsTr = [
@@ -1673,65 +1686,12 @@ def ValidateIntersects(ValidationShp, DatesCol, TransectGDF, TransectDict):
     else:
         print('No date column found - check your spelling')
         return
-    # initialise where each intersection between lines and transects will be saved
-    ColumnData = []
-    Geoms = []
-     # for each row/feature in transect
-    for _, _, ID, TrGeom, refpnt in TransectGDF.itertuples():
-         # for each row/feature shoreline
-        for _,dates,SGeom in ValidGDF.itertuples():
-             # calculate intersections between each transect and shoreline
-            Intersects = TrGeom.intersection(SGeom)
-            ColumnData.append((ID,dates))
-            Geoms.append(Intersects)
-            
-    # create GDF from appended lists of intersections        
-    AllIntersects = gpd.GeoDataFrame(ColumnData,geometry=Geoms,columns=['TransectID','Vdates'])
-    # remove any rows with no intersections
-    AllIntersects = AllIntersects[~AllIntersects.is_empty].reset_index().drop('index',axis=1)
-    # duplicate geom column to save point intersections
-    AllIntersects['Vinterpnt'] = AllIntersects['geometry']
-    # take only first point on any transects which intersected a single shoreline more than once
-    for inter in range(len(AllIntersects)):
-        if AllIntersects['Vinterpnt'][inter].geom_type == 'MultiPoint':
-            AllIntersects['Vinterpnt'][inter] = list(AllIntersects['Vinterpnt'][inter].geoms)[0] # list() accesses individual points in MultiPoint
-    # AllIntersects = AllIntersects.drop('geometry',axis=1)
-    AllIntersects = AllIntersects.rename_geometry('pntgeometry')
-
-    # attribute join on transect ID to get transect geometry back
-    AllIntersects = AllIntersects.merge(TransectGDF[['TransectID','geometry']], on='TransectID')
-    AllIntersects = AllIntersects.drop('pntgeometry',axis=1)
+    AllIntersects = IntersectTransects(TransectGDF, ValidGDF, {'Vdates':DatesCol}, PntName='Vinterpnt', DistName='Vdists')
 
     print("formatting into GeoDataFrame...")
-    # initialise distances of intersections 
-    distances = []
-    # for each intersection
-    for i in range(len(AllIntersects)):
-        # calculate distance of intersection along transect
-        distances.append(Toolbox.CalcDistance(AllIntersects['Vinterpnt'][i], AllIntersects['geometry'][i]))
-    AllIntersects['Vdists'] = distances
-    
-    #initialise lists used for storing each transect's intersection values
-    Vdates,Vdists, Vinterpnt = ([] for i in range(3)) # per-transect lists of values
-
-    Key = [Vdates, Vdists, Vinterpnt]
-    KeyName = ['Vdates', 'Vdists', 'Vinterpnt']
     ValidDict = TransectDict.copy()
-    
-    # for each column name
-    for i in range(len(Key)):
-        # for each transect
-        for Tr in range(len(TransectGDF['TransectID'])):
-            # refresh per-transect list
-            TrKey = []
-            # for each matching intersection on a single transect
-            for j in range(len(AllIntersects.loc[AllIntersects['TransectID']==Tr])):
-                # append each intersection value to a list for each transect
-                # iloc used so index doesn't restart at 0 each loop
-                TrKey.append(AllIntersects[KeyName[i]].loc[AllIntersects['TransectID']==Tr].iloc[j]) 
-            Key[i].append(TrKey)
-    
-        ValidDict[KeyName[i]] = Key[i]
+    # split intersection values out into lists for each transect
+    ValidDict.update(TransectLists(AllIntersects, TransectGDF['TransectID'], ['Vdates', 'Vdists', 'Vinterpnt']))
     
     print('calculating distances between validation and sat lines...')
     ValidDict['valsatdist'] = ValidDict['TransectID'].copy()
@@ -1796,100 +1756,40 @@ def ValidateSatIntersects(sitename, ValidationShp, DatesCol, TransectGDF, Transe
     else:
         print('No date column found - check your spelling')
         return
-    # initialise where each intersection between lines and transects will be saved
-    ColumnData = []
-    Geoms = []
-     # for each row/feature in transect
-    for _, _, ID, TrGeom, refpnt in TransectGDF.itertuples():
-         # for each row/feature shoreline
-        for _,dates,SGeom in ValidGDF.itertuples():
-             # calculate intersections between each transect and shoreline
-            Intersects = TrGeom.intersection(SGeom)
-            ColumnData.append((ID,dates))
-            Geoms.append(Intersects)
-            
-    # create GDF from appended lists of intersections        
-    AllIntersects = gpd.GeoDataFrame(ColumnData,geometry=Geoms,columns=['TransectID','Vdates'])
-    # remove any rows with no intersections
-    AllIntersects = AllIntersects[~AllIntersects.is_empty].reset_index().drop('index',axis=1)
-    # duplicate geom column to save point intersections
-    AllIntersects['Vinterpnt'] = AllIntersects['geometry']
-    # take only first point on any transects which intersected a single shoreline more than once
-    for inter in range(len(AllIntersects)):
-        if AllIntersects['Vinterpnt'][inter].geom_type == 'MultiPoint':
-            AllIntersects['Vinterpnt'][inter] = list(AllIntersects['Vinterpnt'][inter].geoms)[0] # list() accesses individual points in MultiPoint
-    # AllIntersects = AllIntersects.drop('geometry',axis=1)
-    AllIntersects = AllIntersects.rename_geometry('pntgeometry')
-
-    # attribute join on transect ID to get transect geometry back
-    AllIntersects = AllIntersects.merge(TransectGDF[['TransectID','geometry']], on='TransectID')
-    AllIntersects = AllIntersects.drop('pntgeometry',axis=1)
-    
+    AllIntersects = IntersectTransects(TransectGDF, ValidGDF, {'Vdates':DatesCol}, PntName='Vinterpnt', DistName='Vdists')
+
     print("formatting into GeoDataFrame...")
-    # initialise distances of intersections 
-    distances = []
-    # for each intersection
-    for i in range(len(AllIntersects)):
-        # calculate distance of intersection along transect
-        distances.append(Toolbox.CalcDistance(AllIntersects['Vinterpnt'][i], AllIntersects['geometry'][i]))
-    AllIntersects['Vdists'] = distances
-    
-    #initialise lists used for storing each transect's intersection values
-    Vdates,Vdists, Vinterpnt = ([] for i in range(3)) # per-transect lists of values
-
-    Key = [Vdates, Vdists, Vinterpnt]
-    KeyName = ['Vdates', 'Vdists', 'Vinterpnt']
     ValidInterGDF = TransectInterGDF.copy()
-    
-    # for each column name
-    for i in range(len(Key)):
-        # for each transect
-        for Tr in range(len(TransectGDF['TransectID'])):
-            # refresh per-transect list
-            TrKey = []
-            # for each matching intersection on a single transect
-            for j in range(len(AllIntersects.loc[AllIntersects['TransectID']==Tr])):
-                # append each intersection value to a list for each transect
-                # iloc used so index doesn't restart at 0 each loop
-                TrKey.append(AllIntersects[KeyName[i]].loc[AllIntersects['TransectID']==Tr].iloc[j]) 
-            Key[i].append(TrKey)
-    
-        ValidInterGDF[KeyName[i]] = Key[i]
+    # split intersection values out into lists for each transect
+    for Key, Data in TransectLists(AllIntersects, TransectGDF['TransectID'], ['Vdates', 'Vdists', 'Vinterpnt']).items():
+        ValidInterGDF[Key] = Data
     
     print('calculating distances between validation and sat lines...')
-    # must initialise with list of same length as veg dates
-    ValidInterGDF['valsatdist'] = ValidInterGDF['dates'].copy()
-    ValidInterGDF['valsatdate'] = ValidInterGDF['dates'].copy()
-    # for each transect
-    for Tr in range(len(TransectGDF['TransectID'])):
-        # dates into transect-specific list
-        VDateList = [datetime.strptime(date, '%Y-%m-%d') for date in ValidInterGDF['Vdates'].iloc[Tr]]
-        DateList = [datetime.strptime(date, '%Y-%m-%d') for date in ValidInterGDF['dates'].iloc[Tr]]
-        # find index of closest validation date to each sat date
-        # previously was empty list with nans or distances appended
-        # now should start with list of nans with n=n(dates)
-        ValSatDists = list(np.empty(len(ValidInterGDF['dates'].iloc[Tr]))*np.nan)
-        ValSatDates = list(np.empty(len(ValidInterGDF['dates'].iloc[Tr]))*np.nan)
-        for D, Date in enumerate(DateList):
-            # index of matching nearest date
-            if VDateList != []:
-                NearestDate = Toolbox.NearDate(Date,VDateList)
-                if NearestDate == False: # if no matching validation date exists, add nan to the list
-                    continue
-                else:
-                    # use date index to identify matching distance along transect
-                    # and calculate distance between two intersections (sat - validation means +ve is seaward/-ve is landward)
-                    DateStr = datetime.strftime(Date,'%Y-%m-%d')
-                    SDateIndex = ValidInterGDF['dates'].iloc[Tr].index(DateStr)
-                    VDateIndex = VDateList.index(NearestDate)
-                    ValSatDists[SDateIndex] = ValidInterGDF['distances'].iloc[Tr][D] - ValidInterGDF['Vdists'].iloc[Tr][VDateIndex]
-                    ValSatDates[SDateIndex] = ValidInterGDF['Vdates'].iloc[Tr][VDateIndex]
-            else:
-                continue
-       
-
-        ValidInterGDF['valsatdist'].iloc[Tr] = ValSatDists
-        ValidInterGDF['valsatdate'].iloc[Tr] = ValSatDates
+    SatDates, SatTrs, SatLengths = FlattenTransectLists(ValidInterGDF['dates'])
+    VDates, VTrs, _ = FlattenTransectLists(ValidInterGDF['Vdates'])
+    SatDists, _, _ = FlattenTransectLists(ValidInterGDF['distances'])
+    VDists, _, _ = FlattenTransectLists(ValidInterGDF['Vdists'])
+    
+    # find index of closest validation date to each sat date, on all transects at once
+    VDateIndex = Toolbox.NearDates(SatDates, VDates, SatTrs, VTrs)
+    Matched = np.where(VDateIndex > -1)[0]
+    # repeated sat dates on a transect are all stored against the first of them
+    # (later matches overwriting earlier ones)
+    _, SDateFirst, SDateInv = np.unique(np.char.add(np.char.add(SatTrs.astype(str), '_'), SatDates.astype(str)), 
+                                        return_index=True, return_inverse=True)
+    SDateIndex = SDateFirst[SDateInv.ravel()][Matched]
+    _, LastMatch = np.unique(SDateIndex[::-1], return_index=True)
+    LastMatch = len(SDateIndex) - 1 - LastMatch
+    
+    # start with list of nans with n=n(dates)
+    ValSatDists = np.full(len(SatDates), np.nan)
+    ValSatDates = np.full(len(SatDates), np.nan, dtype=object)
+    # calculate distance between two intersections (sat - validation means +ve is seaward/-ve is landward)
+    ValSatDists[SDateIndex[LastMatch]] = SatDists[Matched[LastMatch]] - VDists[VDateIndex[Matched[LastMatch]]]
+    ValSatDates[SDateIndex[LastMatch]] = VDates[VDateIndex[Matched[LastMatch]]]
+    
+    ValidInterGDF['valsatdist'] = SplitTransectLists(ValSatDists, SatLengths)
+    ValidInterGDF['valsatdate'] = SplitTransectLists(ValSatDates, SatLengths)
         
     print("ValidInterGDF with intersections created.")
     
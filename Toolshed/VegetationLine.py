@@ -11,18 +11,12 @@ import ee
 import skimage.filters as filters
 import skimage.measure as measure
 import skimage.morphology as morphology
+from scipy import ndimage
 from shapely import geometry
 from shapely.geometry import Point, LineString, Polygon
 import geopandas as gpd
 from rasterio import features
 
-# machine learning modules
-import sklearn
-if sklearn.__version__[:4] == '0.20':
-    from sklearn.externals import joblib
-else:
-    import joblib
-
 # other modules
 import matplotlib.patches as mpatches
 import matplotlib.lines as mlines
@@ -30,8 +24,10 @@ import matplotlib.cm as cm
 from matplotlib import colors
 from matplotlib import gridspec
 import pickle
+import hashlib
 from datetime import datetime
 from pylab import ginput
+from concurrent.futures import ProcessPoolExecutor
 
 # CoastSat modules
 from Toolshed import Toolbox, Image_Processing
@@ -42,6 +38,14 @@ np.seterr(all='ignore') # raise/ignore divisions by 0 and nans
 def extract_veglines(metadata, settings, polygon, dates, savetifs=True):
     """
     Main function to extract vegetation edges from satellite imagery (Landsat 5-9, Sentinel-2 or local images (e.g. Planet)).
+    Each image is processed independently by ExtractSingleVegline(); if 
+    settings['n_workers'] is greater than 1, images from each platform are 
+    farmed out to a pool of that many processes and reassembled in date order.
+    Each platform is saved to the site's GeoParquet output store as it is 
+    finished (Toolbox.SaveOutputParquet()).
+    Only the lines in the image CRS are stored and saved; the lat-long and 
+    projected outputs returned are views which reproject them when used 
+    (see Toolbox.ReadOutput()).
     
     FM Aug 2022    
     
@@ -75,9 +79,11 @@ def extract_veglines(metadata, settings, polygon, dates, savetifs=True):
     filepath_out = os.path.join(filepath_data, sitename)
     
     # Check if run already exists partially or if it needs to be initialised
-    satnames, output, output_latlon, output_proj, skipped = Toolbox.ResumeVeglines(filepath_data, filepath_out, sitename, metadata)
+    satnames, output, skipped, journal = Toolbox.ResumeVeglines(filepath_data, filepath_out, sitename, metadata)
+    # each processed (or skipped) image is journalled so a failed run can pick up where it left off
+    journalpath = os.path.join(filepath_out, sitename + '_output_journal.pkl')
     if len(satnames) == 0: # if there are no more sats to process, finish process
-        return output, output_latlon, output_proj
+        return Toolbox.ReadOutput(settings['inputs'])
     
     # create a subfolder to store the .jpg images showing the detection
     filepath_jpg = os.path.join(filepath_data, sitename, 'jpg_files', 'detection')
@@ -85,6 +91,9 @@ def extract_veglines(metadata, settings, polygon, dates, savetifs=True):
         os.makedirs(filepath_jpg)
     # close all open figures
     plt.close('all')
+    
+    # number of processes to spread images across (interactive runs stay serial)
+    n_workers = GetWorkerCount(settings)
 
     print('Mapping veglines:')
 
@@ -98,21 +107,15 @@ def extract_veglines(metadata, settings, polygon, dates, savetifs=True):
         # get images
         #filepath = Toolbox.get_filepath(settings['inputs'],satname)
         filenames = metadata[satname]['filenames']
-        datelist = metadata[satname]['dates']
-        # Collate filenames of images per platform
-        imgs = []
-        for i in range(len(filenames)):
-            imgs.append(ee.Image(filenames[i]))
+        # images already processed in a previous (failed) run
+        journal_sat = journal.get(satname, {})
+        fns_todo = [fn for fn in range(len(filenames)) if filenames[fn] not in journal_sat.keys()]
         
         # initialise the output variables
         output_date = []       # datetime at which the image was acquired (YYYY-MM-DD)
         output_time = []            # UTC timestamp
         output_vegline = []         # vector of vegline points
-        output_vegline_latlon = []
-        output_vegline_proj = []
         output_shoreline = []       # vector of waterline points
-        output_shoreline_latlon = []
-        output_shoreline_proj = []
         output_filename = []        # filename of the images from which the veglines are derived
         output_cloudcover = []      # cloud cover of the images
         output_geoaccuracy = []     # georeferencing accuracy of the images
@@ -120,179 +123,78 @@ def extract_veglines(metadata, settings, polygon, dates, savetifs=True):
         output_t_ndvi = []          # NDVI threshold used to map the vegline
         output_t_ndwi = []          # NDWI threshold used to map the vegline
         
-        # get pixel sizes, image collections and georefs for each platform
-        pixel_size, clf_model, ImgColl, init_georef = Image_Processing.InitialiseImgs(metadata, settings, satname, imgs)
-        # load in trained classifier pkl file
-        clf = joblib.load(os.path.join(filepath_models, clf_model))
-            
-        # convert settings['min_beach_area'] and settings['buffer_size'] from metres to pixels
-        # TO DO: figure out why these exist
-        buffer_size_pixels = np.ceil(settings['buffer_size']/pixel_size)
-        min_beach_area_pixels = np.ceil(settings['min_beach_area']/pixel_size**2)
-
-
-        # loop through the images
-        for fn in range(len(filenames)):
+        if n_workers > 1 and len(fns_todo) > 1:
+            # fetch (and save) the platform's image metadata and load the classifiers 
+            # before the pool starts, so workers reuse them rather than all asking at once
+            if satname in ['L5','L7','L8','L9','S2']:
+                imgs = [ee.Image(filename) for filename in filenames]
+                _, clf_model, _, _ = Image_Processing.InitialiseImgs(metadata, settings, satname, imgs)
+                Toolbox.LoadModel(os.path.join(filepath_models, clf_model), settings.get('numpy_mlp', False))
+            if settings['wetdry'] == True:
+                ShoreClassifier(filepath_models, satname, settings)
+            # each worker sets up its own image collection and classifier once,
+            # then processes single images as they are handed out
+            executor = ProcessPoolExecutor(max_workers=n_workers, 
+                                           initializer=InitVeglineWorker,
+                                           initargs=(metadata, settings, satname, polygon, dates, savetifs))
+            # map() hands results back in filename (date) order
+            results = executor.map(VeglineWorker, fns_todo)
+        else:
+            executor = None
+            imgs = [ee.Image(filename) for filename in filenames]
+            # get pixel sizes, image collections and georefs for each platform
+            pixel_size, clf_model, ImgColl, init_georef = Image_Processing.InitialiseImgs(metadata, settings, satname, imgs)
+            # load in trained classifier pkl file (once per process)
+            clf = Toolbox.LoadModel(os.path.join(filepath_models, clf_model), settings.get('numpy_mlp', False))
             
-            print('\r%s:   %0.3f %% ' % (satname,((fn+1)/len(filenames))*100), end='')
-
-            # Image acqusition date
-            acqdate = metadata[satname]['dates'][fn]
-            # preprocess image (cloud mask + pansharpening/downsampling)
-            im_ms, georef, cloud_mask, im_extra, im_QA, im_nodata, acqtime = Image_Processing.preprocess_single(ImgColl, init_georef, fn, datelist, filenames, satname, settings, polygon, dates, skipped)
-
-            if im_ms is None:
-                continue
+            # download the next few images' bands in the background while each one is processed
+            results = (ExtractSingleVegline(fn, metadata, settings, satname, ImgColl, init_georef, clf, pixel_size,
+                                            polygon, dates, savetifs) 
+                       for fn in Image_Processing.PrefetchImgs(fns_todo, ImgColl, settings, satname, filenames, polygon))
+        
+        # merge per-image results back into platform outputs in filename order
+        # (if anything fails part way, stop the pool or prefetching from working
+        # through the rest of the images in the background)
+        try:
+            for fn in range(len(filenames)):
+                print('\r%s:   %0.3f %% ' % (satname,((fn+1)/len(filenames))*100), end='')
             
-            if cloud_mask is None:
-                continue
+                if filenames[fn] in journal_sat.keys():
+                    result = journal_sat[filenames[fn]]
+                else:
+                    result = next(results)
+                    Toolbox.AppendVeglineJournal(journalpath, satname, result)
             
-            # get image spatial reference system (epsg code) from refline location
-            image_epsg = settings['projection_epsg']
-            # compute cloud_cover percentage (with no data pixels)
-            cloud_cover_combined = np.divide(sum(sum(cloud_mask.astype(int))),
-                                    (cloud_mask.shape[0]*cloud_mask.shape[1]))
-            if cloud_cover_combined > 0.95: # if 99% of cloudy pixels in image skip
-                continue
-            # remove no data pixels from the cloud mask 
-            # (for example L7 bands of no data should not be accounted for)
-            cloud_mask_adv = np.logical_xor(cloud_mask, im_nodata) 
-            # compute updated cloud cover percentage (without no data pixels)
-            cloud_cover = np.divide(sum(sum(cloud_mask_adv.astype(int))),
-                                    (sum(sum((~im_nodata).astype(int)))))
-            # skip image if cloud cover is above user-defined threshold
-            if cloud_cover > settings['cloud_thresh']:
-                continue
-
-            # calculate a buffer around the reference shoreline
-            im_ref_buffer = BufferShoreline(settings,settings['reference_shoreline'],georef,cloud_mask)
-
-            # TO DO: figure out way to update refline ONLY if no gaps in previous line exist (length-based? based on number of coords?)
-            # elif output_shoreline[-1].length < im_ref_buffer_og: 
-            #     output_shorelineArr = Toolbox.GStoArr(output_shoreline[-1])
-            #     im_ref_buffer = BufferShoreline(settings,output_shorelineArr,georef,pixel_size,cloud_mask)
-            # # im_ref_buffer = BufferShoreline(settings,georef,pixel_size,cloud_mask)
-        
-            # Coregistration of satellite images based on AROSICS phase shifts
-            # Uses GeoArray(array, geotransform, projection)
-            # Read in provided reference image (if it has been provided)
-            if settings['reference_coreg_im'] is not None:                
-                georef, newbuff, coreg_stats = Image_Processing.Coreg(settings, im_ref_buffer, im_ms, cloud_mask, georef)
-                if newbuff is True:
-                    # Update coregistration counter and stats dict
+                for reason in result['skipped'].keys():
+                    skipped[reason].extend(result['skipped'][reason])
+                if result['coreg_stats'] is not None:
                     coreg_counter += 1
                     for key in coreg_stats_full:
-                        coreg_stats_full[key].append(coreg_stats[key])
-                    # recalculate buffer based on new georef
-                    im_ref_buffer = BufferShoreline(settings,settings['reference_shoreline'],georef,cloud_mask)
-            
-            if savetifs == True:
-                Image_Processing.save_RGB_NDVI(im_ms, cloud_mask, georef, filenames[fn], settings)
-             
-            # classify image with NN classifier
-            im_classif, im_labels = classify_image_NN(im_ms, im_extra, cloud_mask, min_beach_area_pixels, clf)
-            # if extracting shorelines alongside (using original CoastSat NN)
-            if settings['wetdry'] == True:
-                if satname in ['L5','L7','L8','L9']:
-                    sh_clf = joblib.load(os.path.join(filepath_models, 'NN_4classes_Landsat_new.pkl'))
-                    PS = False
-                elif satname == 'S2':
-                    sh_clf = joblib.load(os.path.join(filepath_models, 'NN_4classes_S2_new.pkl'))
-                    PS = False
-                else: # Planet or local image with no SWIR
-                    sh_clf = joblib.load(os.path.join(filepath_models, 'NN_4classes_PS_NARRA_new.pkl'))
-                    PS = True
-                sh_classif, sh_labels = classify_image_NN_shore(im_ms, im_extra, cloud_mask, min_beach_area_pixels, sh_clf, PS)
-            
-            # if classified image comes back with almost no pixels in either class (<5%), skip
-            if (np.count_nonzero(im_labels[:,:,0])/(len(im_labels) * len(im_labels[0]))) < 0.05 or (np.count_nonzero(im_labels[:,:,1])/(len(im_labels) * len(im_labels[0]))) < 0.05:
-                skipped['no_classes'].append([filenames[fn], satname, acqdate+' '+acqtime])
-                print(' - Skipped: classifier cannot find enough variety of classes')
-                continue
+                        coreg_stats_full[key].append(result['coreg_stats'][key])
             
-            # save classified image and transition zone mask after classification takes place
-            Image_Processing.save_ClassIm(im_classif, im_labels, cloud_mask, georef, filenames[fn], settings)
-            Image_Processing.save_TZone(im_ms, im_labels, cloud_mask, im_ref_buffer, georef, filenames[fn], settings)
-                
-            # compute NDVI image (NIR-R)
-            im_ndvi = Toolbox.nd_index(im_ms[:,:,3], im_ms[:,:,2], cloud_mask)
-
-            # contours_ndvi, t_ndvi = FindShoreContours_Enhc(im_ndvi, im_labels, cloud_mask, im_ref_buffer)
-            contours_ndvi, t_ndvi = FindShoreContours_WP(im_ndvi, im_labels, cloud_mask, im_ref_buffer)
-            if contours_ndvi is None:
-                skipped['no_contours'].append([filenames[fn], satname, acqdate+' '+acqtime])
-                print(' - Poor image quality: no contours generated.')
-                continue
-            
-            if settings['wetdry'] == True:
-                im_ndwi = Toolbox.nd_index(im_ms[:,:,3], im_ms[:,:,1], cloud_mask)
-                contours_ndwi, t_ndwi = FindShoreContours_Water(im_ndwi, sh_labels, cloud_mask, im_ref_buffer)
-                if contours_ndwi is None:
-                    skipped['no_contours'].append([filenames[fn], satname, acqdate+' '+acqtime])
-                    print(' - Poor image quality: no water contours generated.')
-                    continue
-                
-            # process the contours into a vegline
-            vegline, vegline_latlon, vegline_proj = ProcessShoreline(contours_ndvi, cloud_mask, georef, image_epsg, settings)
-            if settings['wetdry'] == True:
-                shoreline, shoreline_latlon, shoreline_proj = ProcessShoreline(contours_ndwi, cloud_mask, georef, image_epsg, settings)
-
-
-            # if adjust_detection is True, let the user adjust the detected shoreline
-            if settings['adjust_detection']:
-                date = metadata[satname]['dates'][fn]
-                if settings['wetdry'] == True:
-                    skip_image, vegline, vegline_latlon, vegline_proj, t_ndvi = adjust_detection(im_ms, cloud_mask, im_labels, im_ref_buffer, vegline, vegline_latlon, vegline_proj,
-                                                                                                 image_epsg, georef, settings, date, satname, contours_ndvi, t_ndvi,
-                                                                                                  sh_classif, sh_labels, contours_ndwi, t_ndwi)
-                else:
-                    skip_image, vegline, vegline_latlon, vegline_proj, t_ndvi = adjust_detection(im_ms, cloud_mask, im_labels, im_ref_buffer, vegline, vegline_latlon, vegline_proj,
-                                                                                                 image_epsg, georef,settings, date, satname, contours_ndvi, t_ndvi)
-                # if the user decides to skip the image, continue and do not save the mapped vegline
-                if skip_image:
+                if result['vegline'] is None:
                     continue
             
+                # append to output variables
+                output_date.append(result['date'])
+                output_time.append(result['time'])
+                output_vegline.append(result['vegline'])
+                output_shoreline.append(result['shoreline'])
+                output_t_ndwi.append(result['t_ndwi'])
+                output_filename.append(result['filename'])
+                output_cloudcover.append(result['cloud_cover'])
+                output_geoaccuracy.append(result['geoaccuracy'])
+                output_idxkeep.append(result['idx'])
+                output_t_ndvi.append(result['t_ndvi'])
+        except BaseException:
+            if executor is not None:
+                executor.shutdown(wait=False, cancel_futures=True)
             else:
-                if settings['check_detection'] or settings['save_figure']:
-                    date = metadata[satname]['dates'][fn]
-                    if not settings['check_detection']:
-                        plt.ioff() # turning interactive plotting off
-                    if settings['wetdry'] == True:
-                        skip_image = show_detection(im_ms, cloud_mask, im_labels, im_ref_buffer,
-                                                    image_epsg, georef, settings, date, satname, contours_ndvi, t_ndvi,
-                                                    sh_classif, sh_labels, contours_ndwi, t_ndwi)
-                    else:
-                        skip_image = show_detection(im_ms, cloud_mask, im_labels, im_ref_buffer,
-                                                    image_epsg, georef, settings, date, satname, contours_ndvi, t_ndvi)
-                        
-                        
-                        # if the user decides to skip the image, continue and do not save the mapped vegline
-                    if skip_image:
-                        continue
-            
-
-            # append to output variables
-            output_date.append(acqdate)
-            output_time.append(acqtime)
-            output_vegline.append(vegline)
-            output_vegline_latlon.append(vegline_latlon)
-            output_vegline_proj.append(vegline_proj)
-            if settings['wetdry'] == True:
-                output_shoreline.append(shoreline)
-                output_shoreline_latlon.append(shoreline_latlon)
-                output_shoreline_proj.append(shoreline_proj)
-                output_t_ndwi.append(t_ndwi)
-            else: # if not doing waterlines, fill with nans
-                output_shoreline.append(np.nan)
-                output_shoreline_latlon.append(np.nan)
-                output_shoreline_proj.append(np.nan)
-                output_t_ndwi.append(np.nan)
-            output_filename.append(filenames[fn])
-            output_cloudcover.append(cloud_cover)
-            output_geoaccuracy.append(metadata[satname]['acc_georef'][fn])
-            output_idxkeep.append(fn)
-            output_t_ndvi.append(t_ndvi)
-
+                results.close()
+            raise
+        
+        if executor is not None:
+            executor.shutdown()
 
         # Outside of per-image loop
         # create dictionary of output
@@ -308,30 +210,6 @@ def extract_veglines(metadata, settings, polygon, dates, savetifs=True):
                 'wthreshold': output_t_ndwi
                 }
     
-        output_latlon[satname] = {
-                'dates': output_date,
-                'times':output_time,
-                'veglines': output_vegline_latlon,
-                'waterlines':output_shoreline_latlon,
-                'filename': output_filename,
-                'cloud_cover': output_cloudcover,
-                'idx': output_idxkeep,
-                'vthreshold': output_t_ndvi,
-                'wthreshold': output_t_ndwi
-                }
-        
-        output_proj[satname] = {
-                'dates': output_date,
-                'times':output_time,
-                'veglines': output_vegline_proj,
-                'waterlines':output_shoreline_proj,
-                'filename': output_filename,
-                'cloud_cover': output_cloudcover,
-                'idx': output_idxkeep,
-                'vthreshold': output_t_ndvi,
-                'wthreshold': output_t_ndwi
-                }
-        
 
         dates_sat = []
         for i in range(len(output_date)):
@@ -349,24 +227,15 @@ def extract_veglines(metadata, settings, polygon, dates, savetifs=True):
             output_waterelev = list(np.empty(len(dates_sat)) * np.nan)
         
         output[satname]['tideelev'] = output_waterelev
-        output_latlon[satname]['tideelev'] = output_waterelev
-        output_proj[satname]['tideelev'] = output_waterelev
         
         # Save output after each platform is completed
-        with open(os.path.join(filepath_out, sitename + '_output.pkl'), 'wb') as f:
-            pickle.dump(output, f)
-        with open(os.path.join(filepath_out, sitename + '_output_latlon.pkl'), 'wb') as f:
-            pickle.dump(output_latlon, f)
-        with open(os.path.join(filepath_out, sitename + '_output_proj.pkl'), 'wb') as f:
-            pickle.dump(output_proj, f)
+        Toolbox.SaveOutputParquet(output[satname], satname, filepath_out, sitename, settings['output_epsg'])
         with open(os.path.join(filepath_out, sitename + '_skip_stats.pkl'), 'wb') as f:
             pickle.dump(skipped, f)
         
     # This is from previous structure where output is saved as one dict;
     # Now done when output is read in with Toolbox.ReadOutput()
     # output = Toolbox.merge_output(output)
-    # output_latlon = Toolbox.merge_output(output_latlon)
-    # output_proj = Toolbox.merge_output(output_proj)
     
     # print statistics of run
     for reason in skipped.keys():
@@ -378,24 +247,19 @@ def extract_veglines(metadata, settings, polygon, dates, savetifs=True):
           (np.nanmean(coreg_stats_full['dX']), np.nanmean(coreg_stats_full['dY'])))
     print("Average reliability of coregistration: %0.1f%%" % np.nanmean(coreg_stats_full['Reliability']))
     
-    # save per-platform output structure as output.pkl
+    # per-platform outputs are already in the output.parquet store
     print('saving output pickle files ...')
     filepath_out = os.path.join(filepath_data, sitename)
-    with open(os.path.join(filepath_out, sitename + '_output.pkl'), 'wb') as f:
-        pickle.dump(output, f)
-    
     with open(os.path.join(filepath_out, sitename + '_settings.pkl'), 'wb') as f:
         pickle.dump(settings, f)
-
-    with open(os.path.join(filepath_out, sitename + '_output_latlon.pkl'), 'wb') as f:
-        pickle.dump(output_latlon, f)
-        
-    with open(os.path.join(filepath_out, sitename + '_output_proj.pkl'), 'wb') as f:
-        pickle.dump(output_proj, f)
         
     with open(os.path.join(filepath_out, sitename + '_skip_stats.pkl'), 'wb') as f:
         pickle.dump(skipped, f)
     
+    # every platform is now saved, so the per-image journal is no longer needed
+    if os.path.isfile(journalpath):
+        os.remove(journalpath)
+    
     # close figure window if still open
     if plt.get_fignums():
         plt.close()
@@ -406,6 +270,354 @@ def extract_veglines(metadata, settings, polygon, dates, savetifs=True):
     return output, output_latlon, output_proj
 
 
+def ExtractSingleVegline(fn, metadata, settings, satname, ImgColl, init_georef, clf, pixel_size, polygon, dates, savetifs=True):
+    """
+    Run the full vegetation edge extraction chain on a single satellite image:
+    preprocessing, buffering, coregistration, classification, thresholding, 
+    contouring and conversion to world coordinates. Skip reasons are recorded
+    in a skipped dictionary local to this image, so results from different 
+    images (or processes) can be merged back together in order.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    fn : int
+        Index of image in the platform's list of filenames.
+    metadata : dict
+        Dictionary of sat image filenames, georeferencing info, EPSGs and dates of capture.
+    settings : dict
+        Dictionary of user-defined settings used for the veg edge extraction.
+    satname : str
+        Name of current satellite platform (L5, L7, L8, L9, S2 or PS/other).
+    ImgColl : ImageCollection
+        GEE ImageCollection of images to be processed.
+    init_georef : list
+        Initial georeferencing info for the platform.
+    clf : joblib object
+        Pre-trained vegetation classifier.
+    pixel_size : int
+        Size of the pixel in metres (15 for Landsat, 10 for Sentinel-2).
+    polygon : list
+        List of 5 WGS84 coordinate pairs marking rectangle of interest.
+    dates : list
+        Start and end dates of interest as yyyy-mm-dd strings.
+    savetifs : bool, optional
+        Flag to save RGB and NDVI images as georeferenced TIFFs. The default is True.
+
+    Returns
+    -------
+    result : dict
+        Extracted vegline (and waterline) and associated info for the image, 
+        with 'vegline' set to None if the image was skipped. Also holds the
+        image's skip reasons ('skipped') and coregistration stats ('coreg_stats',
+        None if the image was not coregistered).
+
+    """
+    filepath_models = os.path.join(os.getcwd(), 'Classification', 'models')
+    filenames = metadata[satname]['filenames']
+    datelist = metadata[satname]['dates']
+    
+    # initialise result with empty skip reasons for this image only
+    result = {'filename': filenames[fn],
+              'vegline': None,
+              'skipped': {'empty_poor': [],
+                          'missing_mask':[],
+                          'cloudy': [],
+                          'no_classes': [],
+                          'no_contours': []},
+              'coreg_stats': None}
+    
+    # convert settings['min_beach_area'] from metres to pixels
+    min_beach_area_pixels = np.ceil(settings['min_beach_area']/pixel_size**2)
+
+    # Image acqusition date
+    acqdate = metadata[satname]['dates'][fn]
+    # preprocess image (cloud mask + pansharpening/downsampling)
+    im_ms, georef, cloud_mask, im_extra, im_QA, im_nodata, acqtime = Image_Processing.preprocess_single(ImgColl, init_georef, fn, datelist, filenames, satname, settings, polygon, dates, result['skipped'])
+
+    if im_ms is None:
+        return result
+    
+    if cloud_mask is None:
+        return result
+    
+    # get image spatial reference system (epsg code) from refline location
+    image_epsg = settings['projection_epsg']
+    # compute cloud_cover percentage (with no data pixels)
+    cloud_cover_combined = np.divide(sum(sum(cloud_mask.astype(int))),
+                            (cloud_mask.shape[0]*cloud_mask.shape[1]))
+    if cloud_cover_combined > 0.95: # if 99% of cloudy pixels in image skip
+        return result
+    # remove no data pixels from the cloud mask 
+    # (for example L7 bands of no data should not be accounted for)
+    cloud_mask_adv = np.logical_xor(cloud_mask, im_nodata) 
+    # compute updated cloud cover percentage (without no data pixels)
+    cloud_cover = np.divide(sum(sum(cloud_mask_adv.astype(int))),
+                            (sum(sum((~im_nodata).astype(int)))))
+    # skip image if cloud cover is above user-defined threshold
+    if cloud_cover > settings['cloud_thresh']:
+        return result
+
+    # calculate a buffer around the reference shoreline
+    im_ref_buffer = BufferShoreline(settings,settings['reference_shoreline'],georef,cloud_mask)
+
+    # TO DO: figure out way to update refline ONLY if no gaps in previous line exist (length-based? based on number of coords?)
+    # elif output_shoreline[-1].length < im_ref_buffer_og: 
+    #     output_shorelineArr = Toolbox.GStoArr(output_shoreline[-1])
+    #     im_ref_buffer = BufferShoreline(settings,output_shorelineArr,georef,pixel_size,cloud_mask)
+    # # im_ref_buffer = BufferShoreline(settings,georef,pixel_size,cloud_mask)
+
+    # Coregistration of satellite images based on AROSICS phase shifts
+    # Uses GeoArray(array, geotransform, projection)
+    # Read in provided reference image (if it has been provided)
+    if settings['reference_coreg_im'] is not None:                
+        georef, newbuff, coreg_stats = Image_Processing.Coreg(settings, im_ref_buffer, im_ms, cloud_mask, georef)
+        if newbuff is True:
+            # Update coregistration stats
+            result['coreg_stats'] = coreg_stats
+            # recalculate buffer based on new georef
+            im_ref_buffer = BufferShoreline(settings,settings['reference_shoreline'],georef,cloud_mask)
+    
+    if savetifs == True:
+        Image_Processing.save_RGB_NDVI(im_ms, cloud_mask, georef, filenames[fn], settings)
+     
+    # classify image with NN classifier (optionally only around the reference line)
+    if settings.get('classify_roi', False):
+        im_roi = ClassifyROI(im_ref_buffer, settings.get('roi_dilation', 5 + min_beach_area_pixels))
+    else:
+        im_roi = None
+    im_classif, im_labels = classify_image_NN(im_ms, im_extra, cloud_mask, min_beach_area_pixels, clf, im_roi)
+    # if extracting shorelines alongside (using original CoastSat NN)
+    if settings['wetdry'] == True:
+        sh_clf, PS = ShoreClassifier(filepath_models, satname, settings)
+        sh_classif, sh_labels = classify_image_NN_shore(im_ms, im_extra, cloud_mask, min_beach_area_pixels, sh_clf, PS)
+    
+    # if classified image comes back with almost no pixels in either class (<5%), skip
+    # (as a fraction of the classified region if only the ROI was classified)
+    if im_roi is None:
+        n_classified = len(im_labels) * len(im_labels[0])
+    else:
+        n_classified = max(np.count_nonzero(im_roi), 1)
+    if (np.count_nonzero(im_labels[:,:,0])/n_classified) < 0.05 or (np.count_nonzero(im_labels[:,:,1])/n_classified) < 0.05:
+        result['skipped']['no_classes'].append([filenames[fn], satname, acqdate+' '+acqtime])
+        print(' - Skipped: classifier cannot find enough variety of classes')
+        return result
+    
+    # save classified image and transition zone mask after classification takes place
+    Image_Processing.save_ClassIm(im_classif, im_labels, cloud_mask, georef, filenames[fn], settings)
+    Image_Processing.save_TZone(im_ms, im_labels, cloud_mask, im_ref_buffer, georef, filenames[fn], settings)
+        
+    # compute NDVI image (NIR-R)
+    im_ndvi = Toolbox.nd_index(im_ms[:,:,3], im_ms[:,:,2], cloud_mask)
+
+    # contours_ndvi, t_ndvi = FindShoreContours_Enhc(im_ndvi, im_labels, cloud_mask, im_ref_buffer)
+    contours_ndvi, t_ndvi = FindShoreContours_WP(im_ndvi, im_labels, cloud_mask, im_ref_buffer)
+    if contours_ndvi is None:
+        result['skipped']['no_contours'].append([filenames[fn], satname, acqdate+' '+acqtime])
+        print(' - Poor image quality: no contours generated.')
+        return result
+    
+    if settings['wetdry'] == True:
+        im_ndwi = Toolbox.nd_index(im_ms[:,:,3], im_ms[:,:,1], cloud_mask)
+        contours_ndwi, t_ndwi = FindShoreContours_Water(im_ndwi, sh_labels, cloud_mask, im_ref_buffer)
+        if contours_ndwi is None:
+            result['skipped']['no_contours'].append([filenames[fn], satname, acqdate+' '+acqtime])
+            print(' - Poor image quality: no water contours generated.')
+            return result
+        
+    # process the contours into a vegline
+    vegline, vegline_latlon, vegline_proj = ProcessShoreline(contours_ndvi, cloud_mask, georef, image_epsg, settings)
+    if settings['wetdry'] == True:
+        shoreline, shoreline_latlon, shoreline_proj = ProcessShoreline(contours_ndwi, cloud_mask, georef, image_epsg, settings)
+
+
+    # if adjust_detection is True, let the user adjust the detected shoreline
+    if settings['adjust_detection']:
+        date = metadata[satname]['dates'][fn]
+        if settings['wetdry'] == True:
+            skip_image, vegline, vegline_latlon, vegline_proj, t_ndvi = adjust_detection(im_ms, cloud_mask, im_labels, im_ref_buffer, vegline, vegline_latlon, vegline_proj,
+                                                                                         image_epsg, georef, settings, date, satname, contours_ndvi, t_ndvi,
+                                                                                          sh_classif, sh_labels, contours_ndwi, t_ndwi)
+        else:
+            skip_image, vegline, vegline_latlon, vegline_proj, t_ndvi = adjust_detection(im_ms, cloud_mask, im_labels, im_ref_buffer, vegline, vegline_latlon, vegline_proj,
+                                                                                         image_epsg, georef,settings, date, satname, contours_ndvi, t_ndvi)
+        # if the user decides to skip the image, continue and do not save the mapped vegline
+        if skip_image:
+            return result
+    
+    else:
+        if settings['check_detection'] or settings['save_figure']:
+            date = metadata[satname]['dates'][fn]
+            if not settings['check_detection']:
+                plt.ioff() # turning interactive plotting off
+            if settings['wetdry'] == True:
+                skip_image = show_detection(im_ms, cloud_mask, im_labels, im_ref_buffer,
+                                            image_epsg, georef, settings, date, satname, contours_ndvi, t_ndvi,
+                                            sh_classif, sh_labels, contours_ndwi, t_ndwi)
+            else:
+                skip_image = show_detection(im_ms, cloud_mask, im_labels, im_ref_buffer,
+                                            image_epsg, georef, settings, date, satname, contours_ndvi, t_ndvi)
+                
+                
+                # if the user decides to skip the image, continue and do not save the mapped vegline
+            if skip_image:
+                return result
+    
+    
+    # fill result with vegline and image info
+    result['date'] = acqdate
+    result['time'] = acqtime
+    # (lat-long and projected lines are derived from these when needed)
+    result['vegline'] = vegline
+    if settings['wetdry'] == True:
+        result['shoreline'] = shoreline
+        result['t_ndwi'] = t_ndwi
+    else: # if not doing waterlines, fill with nans
+        result['shoreline'] = np.nan
+        result['t_ndwi'] = np.nan
+    result['cloud_cover'] = cloud_cover
+    result['geoaccuracy'] = metadata[satname]['acc_georef'][fn]
+    result['idx'] = fn
+    result['t_ndvi'] = t_ndvi
+    
+    return result
+
+
+def ShoreClassifier(filepath_models, satname, settings):
+    """
+    Original CoastSat (4 class) classifier used for wet/dry boundaries, 
+    taken from the process-wide model cache.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    filepath_models : str
+        Path to folder of trained classifier .pkl files.
+    satname : str
+        Name of current satellite platform (L5, L7, L8, L9, S2 or PS/other).
+    settings : dict
+        Dictionary of user-defined settings used for the veg edge extraction.
+
+    Returns
+    -------
+    sh_clf : sklearn classifier or Toolbox.NumpyMLP
+        Trained wet/dry classifier.
+    PS : bool
+        True if the 16-feature (no SWIR) PlanetScope classifier is used.
+
+    """
+    if satname in ['L5','L7','L8','L9']:
+        sh_clf = Toolbox.LoadModel(os.path.join(filepath_models, 'NN_4classes_Landsat_new.pkl'), settings.get('numpy_mlp', False))
+        PS = False
+    elif satname == 'S2':
+        sh_clf = Toolbox.LoadModel(os.path.join(filepath_models, 'NN_4classes_S2_new.pkl'), settings.get('numpy_mlp', False))
+        PS = False
+    else: # Planet or local image with no SWIR
+        sh_clf = Toolbox.LoadModel(os.path.join(filepath_models, 'NN_4classes_PS_NARRA_new.pkl'), settings.get('numpy_mlp', False))
+        PS = True
+    
+    return sh_clf, PS
+
+
+def GetWorkerCount(settings):
+    """
+    Number of processes to run vegline extraction across, taken from 
+    settings['n_workers'] (defaults to 1, i.e. serial). Runs which need the 
+    user to check or adjust each detection are always kept serial.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    settings : dict
+        Dictionary of user-defined settings used for the veg edge extraction.
+
+    Returns
+    -------
+    n_workers : int
+        Number of worker processes to use.
+
+    """
+    n_workers = settings.get('n_workers', 1)
+    if n_workers is None or n_workers < 1: # use every available core
+        n_workers = os.cpu_count()
+    if n_workers > 1 and (settings['check_detection'] or settings['adjust_detection']):
+        print('check_detection/adjust_detection need user input; running veglines serially.')
+        n_workers = 1
+    
+    return n_workers
+
+
+def InitVeglineWorker(metadata, settings, satname, polygon, dates, savetifs):
+    """
+    Set up a worker process for parallel vegline extraction. The platform's
+    image collection, georef and classifier are created once per process and 
+    stored for VeglineWorker() to use on each image it is handed.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    metadata : dict
+        Dictionary of sat image filenames, georeferencing info, EPSGs and dates of capture.
+    settings : dict
+        Dictionary of user-defined settings used for the veg edge extraction.
+    satname : str
+        Name of current satellite platform (L5, L7, L8, L9, S2 or PS/other).
+    polygon : list
+        List of 5 WGS84 coordinate pairs marking rectangle of interest.
+    dates : list
+        Start and end dates of interest as yyyy-mm-dd strings.
+    savetifs : bool
+        Flag to save RGB and NDVI images as georeferenced TIFFs.
+
+    """
+    global VeglineWorkerState
+    
+    # figures can only be saved (not shown) from a worker
+    plt.switch_backend('Agg')
+    # spawned processes don't share the parent's Earth Engine session
+    if satname in ['L5','L7','L8','L9','S2']:
+        ee.Initialize()
+    
+    filepath_models = os.path.join(os.getcwd(), 'Classification', 'models')
+    imgs = [ee.Image(filename) for filename in metadata[satname]['filenames']]
+    pixel_size, clf_model, ImgColl, init_georef = Image_Processing.InitialiseImgs(metadata, settings, satname, imgs)
+    clf = Toolbox.LoadModel(os.path.join(filepath_models, clf_model), settings.get('numpy_mlp', False))
+    
+    VeglineWorkerState = {'metadata': metadata,
+                          'settings': settings,
+                          'satname': satname,
+                          'ImgColl': ImgColl,
+                          'init_georef': init_georef,
+                          'clf': clf,
+                          'pixel_size': pixel_size,
+                          'polygon': polygon,
+                          'dates': dates,
+                          'savetifs': savetifs}
+
+
+def VeglineWorker(fn):
+    """
+    Extract a vegline from a single image inside a worker process set up by
+    InitVeglineWorker().
+    FM Nov 2024
+
+    Parameters
+    ----------
+    fn : int
+        Index of image in the platform's list of filenames.
+
+    Returns
+    -------
+    result : dict
+        Result of ExtractSingleVegline() for the image.
+
+    """
+    state = VeglineWorkerState
+    return ExtractSingleVegline(fn, state['metadata'], state['settings'], state['satname'],
+                                state['ImgColl'], state['init_georef'], state['clf'], state['pixel_size'],
+                                state['polygon'], state['dates'], state['savetifs'])
+
+
 ###################################################################################################
 # IMAGE CLASSIFICATION FUNCTIONS
 ###################################################################################################
@@ -435,49 +647,19 @@ def calculate_features(im_ms, cloud_mask, im_bool):
         
     """
 
-    # add all the multispectral bands
-    features = np.expand_dims(im_ms[im_bool,0],axis=1)
-    for k in range(1,im_ms.shape[2]):
-        feature = np.expand_dims(im_ms[im_bool,k],axis=1)
-        features = np.append(features, feature, axis=-1)
-    # if im_ms.shape[2]>4: # FM: exception for if SWIR band doesn't exist 
     # SWIR-G
     im_SWIRG = Toolbox.nd_index(im_ms[:,:,4], im_ms[:,:,1], cloud_mask)
-    features = np.append(features, np.expand_dims(im_SWIRG[im_bool],axis=1), axis=-1)
     # SWIR-NIR
     im_SWIRNIR = Toolbox.nd_index(im_ms[:,:,4], im_ms[:,:,3], cloud_mask)
-    features = np.append(features, np.expand_dims(im_SWIRNIR[im_bool],axis=1), axis=-1)
     # NIR-G
     im_NIRG = Toolbox.nd_index(im_ms[:,:,3], im_ms[:,:,1], cloud_mask)
-    features = np.append(features, np.expand_dims(im_NIRG[im_bool],axis=1), axis=-1)
     # NIR-R
     im_NIRR = Toolbox.nd_index(im_ms[:,:,3], im_ms[:,:,2], cloud_mask)
-    features = np.append(features, np.expand_dims(im_NIRR[im_bool],axis=1), axis=-1)
     # B-R
     im_BR = Toolbox.nd_index(im_ms[:,:,0], im_ms[:,:,2], cloud_mask)
-    features = np.append(features, np.expand_dims(im_BR[im_bool],axis=1), axis=-1)
-    
-    # calculate standard deviation of individual bands
-    for k in range(im_ms.shape[2]):
-        im_std =  Toolbox.image_std(im_ms[:,:,k], 1)
-        features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    # calculate standard deviation of the spectral indices
-    # if im_ms.shape[2]>4: # FM: exception for if SWIR band doesn't exist
-    # SWIR-G   
-    im_std = Toolbox.image_std(im_SWIRG, 1)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    #SWIR-NIR
-    im_std = Toolbox.image_std(im_SWIRNIR, 1)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    # NIR-G
-    im_std = Toolbox.image_std(im_NIRG, 1)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    # NIR-R
-    im_std = Toolbox.image_std(im_NIRR, 1)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    #B-R
-    im_std = Toolbox.image_std(im_BR, 1)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
+    
+    # bands, indices and standard deviation of each (written into one float32 array)
+    features = Toolbox.image_features(im_ms, [im_SWIRG, im_SWIRNIR, im_NIRG, im_NIRR, im_BR], im_bool, 1)
 
     # Total feature sets should be 20 for V+NIR+SWIR (5 bands, 5 indices, stdev on each)
 
@@ -510,49 +692,22 @@ def calculate_vegfeatures(im_ms, cloud_mask, im_bool):
         
     """
 
-    # add all the multispectral bands
-    features = np.expand_dims(im_ms[im_bool,0],axis=1)
-    
-    for k in range(1,im_ms.shape[2]):
-        feature = np.expand_dims(im_ms[im_bool,k],axis=1)
-        features = np.append(features, feature, axis=-1)
     # NDVI (NIR - R)
     im_NIRR = Toolbox.nd_index(im_ms[:,:,3], im_ms[:,:,2], cloud_mask)
-    features = np.append(features, np.expand_dims(im_NIRR[im_bool],axis=1), axis=-1)
     # NDWI (NIR-G)
     im_NIRG = Toolbox.nd_index(im_ms[:,:,3], im_ms[:,:,1], cloud_mask)
-    features = np.append(features, np.expand_dims(im_NIRG[im_bool],axis=1), axis=-1)
     # R-G
     im_RG = Toolbox.nd_index(im_ms[:,:,2], im_ms[:,:,1], cloud_mask)
-    features = np.append(features, np.expand_dims(im_NIRG[im_bool],axis=1), axis=-1)
     # SAVI
     im_SAVI = Toolbox.savi_index(im_ms[:,:,3], im_ms[:,:,2], cloud_mask)
-    features = np.append(features, np.expand_dims(im_SAVI[im_bool],axis=1), axis=-1)
     # RB-NDVI (NIR -+ (R + B))
     im_RBNDVI = Toolbox.rbnd_index(im_ms[:,:,3], im_ms[:,:,2], im_ms[:,:,0], cloud_mask)
-    features = np.append(features, np.expand_dims(im_RBNDVI[im_bool],axis=1), axis=-1)
     
-    # calculate standard deviation of individual bands
-    for k in range(im_ms.shape[2]):
-        im_std =  Toolbox.image_std(im_ms[:,:,k], 1)
-        features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    
-    # calculate standard deviation of the spectral indices
-    # NDVI  (NIR - R)
-    im_std = Toolbox.image_std(im_NIRR, 1)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    # NDWI (NIR-G)
-    im_std = Toolbox.image_std(im_NIRG, 1)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    # R-G
-    im_std = Toolbox.image_std(im_RG, 1)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    # SAVI
-    im_std = Toolbox.image_std(im_SAVI, 1)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    # RB-NDVI
-    im_std = Toolbox.image_std(im_RBNDVI, 1)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
+    # bands, indices and standard deviation of each (written into one float32 array)
+    # NB: the R-G feature slot holds NDWI values (but R-G stdev), which is what
+    # the trained classifiers expect
+    features = Toolbox.image_features(im_ms, [im_NIRR, im_NIRG, im_NIRG, im_SAVI, im_RBNDVI], im_bool, 1,
+                                      im_std_inds=[im_NIRR, im_NIRG, im_RG, im_SAVI, im_RBNDVI])
 
     # Total feature num should be 20 (5 bands, 5 band indices, stdev on each)
     # or 18 for Planet (4 bands, 5 band indices, stdev on each)
@@ -585,57 +740,29 @@ def calculate_WV_features(im_ms, cloud_mask, im_bool):
         
     """
 
-    # add all the multispectral bands
-    features = np.expand_dims(im_ms[im_bool,0],axis=1)
-    
-    for k in range(1,im_ms.shape[2]):
-        feature = np.expand_dims(im_ms[im_bool,k],axis=1)
-        features = np.append(features, feature, axis=-1)
+    im_inds, im_std_inds = [], []
     if im_ms.shape[2]>4: # FM: exception for if SWIR band doesn't exist 
         # SWIR-G
         im_SWIRG = Toolbox.nd_index(im_ms[:,:,4], im_ms[:,:,1], cloud_mask)
-        features = np.append(features, np.expand_dims(im_SWIRG[im_bool],axis=1), axis=-1)
         # SWIR-NIR
         im_SWIRNIR = Toolbox.nd_index(im_ms[:,:,4], im_ms[:,:,3], cloud_mask)
-        features = np.append(features, np.expand_dims(im_SWIRNIR[im_bool],axis=1), axis=-1)
+        im_inds.extend([im_SWIRG, im_SWIRNIR])
+        im_std_inds.extend([im_SWIRG, im_SWIRNIR])
     # NDVI (NIR - R)
     im_NIRR = Toolbox.nd_index(im_ms[:,:,3], im_ms[:,:,2], cloud_mask)
-    features = np.append(features, np.expand_dims(im_NIRR[im_bool],axis=1), axis=-1)
     # NIR-G
     im_NIRG = Toolbox.nd_index(im_ms[:,:,3], im_ms[:,:,1], cloud_mask)
-    features = np.append(features, np.expand_dims(im_NIRG[im_bool],axis=1), axis=-1)
     # R-G
     im_RG = Toolbox.nd_index(im_ms[:,:,2], im_ms[:,:,1], cloud_mask)
-    features = np.append(features, np.expand_dims(im_NIRG[im_bool],axis=1), axis=-1)
     # B-R
     im_BR = Toolbox.nd_index(im_ms[:,:,0], im_ms[:,:,2], cloud_mask)
-    features = np.append(features, np.expand_dims(im_BR[im_bool],axis=1), axis=-1)
-    
-    # calculate standard deviation of individual bands
-    for k in range(im_ms.shape[2]):
-        im_std =  Toolbox.image_std(im_ms[:,:,k], 1)
-        features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    if im_ms.shape[2]>4: # FM: exception for if SWIR band doesn't exist
-        # SWIR-G   
-        im_std = Toolbox.image_std(im_SWIRG, 1)
-        features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-        #SWIR-NIR
-        im_std = Toolbox.image_std(im_SWIRNIR, 1)
-        features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    # calculate standard deviation of the spectral indices
-    # NDVI  (NIR - R)
-    im_std = Toolbox.image_std(im_NIRR, 1)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    # NIR-G
-    im_std = Toolbox.image_std(im_NIRG, 1)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    # R-G
-    im_std = Toolbox.image_std(im_RG, 1)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    #B-R
-    im_std = Toolbox.image_std(im_BR, 1)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-
+    # NB: the R-G feature slot holds NIR-G values (but R-G stdev), which is what
+    # the trained classifiers expect
+    im_inds.extend([im_NIRR, im_NIRG, im_NIRG, im_BR])
+    im_std_inds.extend([im_NIRR, im_NIRG, im_RG, im_BR])
+    
+    # bands, indices and standard deviation of each (written into one float32 array)
+    features = Toolbox.image_features(im_ms, im_inds, im_bool, 1, im_std_inds=im_std_inds)
     
     # Total feature sets should be 22 for V+NIR+SWIR (5 bands, 6 indices, stdev on each)
     # and 16 for V+NIR (4 bands, 4 indices, stdev on each)
@@ -669,51 +796,28 @@ def calculate_features_PS(im_ms, cloud_mask, im_bool):
         
     """
 
-    # add all the multispectral bands
-    features = np.expand_dims(im_ms[im_bool,0],axis=1)
-    for k in range(1,im_ms.shape[2]):
-        feature = np.expand_dims(im_ms[im_bool,k],axis=1)
-        features = np.append(features, feature, axis=-1)
-        
     # NIR-G
     im_NIRG = Toolbox.nd_index(im_ms[:,:,3], im_ms[:,:,1], cloud_mask)
-    features = np.append(features, np.expand_dims(im_NIRG[im_bool],axis=1), axis=-1)
-    
     # NIR-B
     im_NIRB = Toolbox.nd_index(im_ms[:,:,3], im_ms[:,:,0], cloud_mask)
-    features = np.append(features, np.expand_dims(im_NIRB[im_bool],axis=1), axis=-1)
-    
     # NIR-R
     im_NIRR = Toolbox.nd_index(im_ms[:,:,3], im_ms[:,:,2], cloud_mask)
-    features = np.append(features, np.expand_dims(im_NIRR[im_bool],axis=1), axis=-1)
-        
     # B-R
     im_BR = Toolbox.nd_index(im_ms[:,:,0], im_ms[:,:,2], cloud_mask)
-    features = np.append(features, np.expand_dims(im_BR[im_bool],axis=1), axis=-1)
     
-    # calculate standard deviation of individual bands
-    for k in range(im_ms.shape[2]):
-        im_std =  Toolbox.image_std(im_ms[:,:,k], 2)
-        features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-        
-    # calculate standard deviation of the spectral indices
-    im_std = Toolbox.image_std(im_NIRG, 2)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    im_std = Toolbox.image_std(im_NIRB, 2)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    im_std = Toolbox.image_std(im_NIRR, 2)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
-    im_std = Toolbox.image_std(im_BR, 2)
-    features = np.append(features, np.expand_dims(im_std[im_bool],axis=1), axis=-1)
+    # bands, indices and standard deviation of each (5x5 window for PS)
+    features = Toolbox.image_features(im_ms, [im_NIRG, im_NIRB, im_NIRR, im_BR], im_bool, 2)
 
     return features
 
 
-def classify_image_NN(im_ms, im_extra, cloud_mask, min_beach_area, clf):
+def classify_image_NN(im_ms, im_extra, cloud_mask, min_beach_area, clf, im_roi=None):
     """
     Classifies every pixel in the image into classes.
 
-    The classifier is a Neural Network that is already trained.
+    The classifier is a Neural Network that is already trained. If a region of
+    interest is given, features are only calculated and classified for pixels 
+    inside it; everything else is left unclassified (NaN), like cloud pixels.
 
     FM Aug 2022
 
@@ -729,6 +833,9 @@ def classify_image_NN(im_ms, im_extra, cloud_mask, min_beach_area, clf):
         minimum number of pixels that have to be connected to belong to the SAND class
     clf : joblib object
         pre-trained classifier
+    im_roi : np.array, optional
+        2D boolean mask of the pixels to classify (see ClassifyROI). Default
+        None classifies the whole image.
 
     Returns:    
     -----------
@@ -739,12 +846,28 @@ def classify_image_NN(im_ms, im_extra, cloud_mask, min_beach_area, clf):
 
     """
 
+    im_classif = np.nan*np.ones((cloud_mask.shape[0], cloud_mask.shape[1]))
+    if im_roi is None:
+        im_roi = np.ones(cloud_mask.shape).astype(bool)
+        rowslice, colslice = slice(None), slice(None)
+    else:
+        ROIrows = np.where(np.any(im_roi, axis=1))[0]
+        ROIcols = np.where(np.any(im_roi, axis=0))[0]
+        if len(ROIrows) == 0: # nothing to classify
+            im_labels = np.stack((im_classif == 1, im_classif == 2), axis=-1)
+            return im_classif, im_labels
+        # crop to the ROI extent plus the 1px stdev window, so features at ROI
+        # pixels match those calculated on the full image
+        rowslice = slice(max(ROIrows[0]-1, 0), ROIrows[-1]+2)
+        colslice = slice(max(ROIcols[0]-1, 0), ROIcols[-1]+2)
+    im_roi_crop = im_roi[rowslice, colslice]
+    
     # calculate features
-    vec_features = calculate_vegfeatures(im_ms, cloud_mask, np.ones(cloud_mask.shape).astype(bool))
+    vec_features = calculate_vegfeatures(im_ms[rowslice, colslice, :], cloud_mask[rowslice, colslice], im_roi_crop)
     vec_features[np.isnan(vec_features)] = 1e-9 # NaN values are create when std is too close to 0
 
     # remove NaNs and cloudy pixels
-    vec_cloud = cloud_mask.reshape(cloud_mask.shape[0]*cloud_mask.shape[1])
+    vec_cloud = cloud_mask[rowslice, colslice][im_roi_crop]
     vec_nan = np.any(np.isnan(vec_features), axis=1)
     vec_mask = np.logical_or(vec_cloud, vec_nan)
     vec_features = vec_features[~vec_mask, :]
@@ -753,9 +876,9 @@ def classify_image_NN(im_ms, im_extra, cloud_mask, min_beach_area, clf):
     labels = clf.predict(vec_features)
     
     # recompose image
-    vec_classif = np.nan*np.ones((cloud_mask.shape[0]*cloud_mask.shape[1]))
+    vec_classif = np.nan*np.ones(len(vec_mask))
     vec_classif[~vec_mask] = labels
-    im_classif = vec_classif.reshape((cloud_mask.shape[0], cloud_mask.shape[1]))
+    im_classif[rowslice, colslice][im_roi_crop] = vec_classif
     # create a stack of boolean images for each label
     im_veg = im_classif == 1
     im_nonveg = im_classif == 2
@@ -768,6 +891,39 @@ def classify_image_NN(im_ms, im_extra, cloud_mask, min_beach_area, clf):
 
     return im_classif, im_labels
 
+
+def ClassifyROI(im_ref_buffer, dilation):
+    """
+    Region of interest for classify_image_NN: the reference line buffer grown
+    by a number of pixels. FindShoreContours_WP only uses labels within 5px of
+    the buffer (see Image_Processing.ClipIndexVec). Growing it by 5px plus 
+    min_beach_area pixels (chessboard distance, so each step of an 8-connected
+    patch moves at most 1px further out) means any patch reaching those labels
+    and crossing the ROI edge keeps at least min_beach_area pixels inside it, 
+    so small-patch removal gives the same labels as on the full image.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    im_ref_buffer : np.array
+        Boolean 2D array with True inside the reference shoreline buffer.
+    dilation : int
+        Distance in pixels to grow the buffer by (settings['roi_dilation'], 
+        default 5px plus min_beach_area in pixels).
+
+    Returns
+    -------
+    im_roi : np.array
+        Boolean 2D array with True where pixels should be classified.
+
+    """
+    if not np.any(im_ref_buffer):
+        return im_ref_buffer.copy()
+    # distance transform is linear in image size, unlike dilating with a big disk
+    im_roi = ndimage.distance_transform_cdt(~im_ref_buffer, metric='chessboard') <= dilation
+    
+    return im_roi
+
 def classify_image_NN_shore(im_ms, im_extra, cloud_mask, min_beach_area, clf, PS):
     """
     Classifies every pixel in the image in one of 4 classes:
@@ -1260,6 +1416,9 @@ def create_shoreline_buffer(im_shape, georef, image_epsg, pixel_size, settings,
 def BufferShoreline(settings,refline,georef,cloud_mask):
     """
     Buffer reference line and utilise geopandas to generate boolean mask of where shoreline swath is.
+    Masks are cached (Toolbox.CachedMask) by reference line, buffer distance, 
+    georef, image shape and EPSG, so images sharing a georef only build it once.
+    The returned mask is read-only.
     FM 2022
 
     Parameters
@@ -1278,16 +1437,26 @@ def BufferShoreline(settings,refline,georef,cloud_mask):
 
     """
     if type(refline) == np.ndarray:
-        refGS = Toolbox.ArrtoGS(refline, georef)
+        refHash = Toolbox.ArrayHash(refline)
     else: # if refline is read in as shapefile
-        refGS = gpd.GeoSeries(refline['geometry'])
+        refHash = hashlib.sha1(b''.join(geom.wkb for geom in refline['geometry'])).hexdigest()
+    BuffKey = ('refbuffer', refHash, settings['max_dist_ref'], tuple(georef), 
+               cloud_mask.shape, settings.get('projection_epsg'))
+    
+    def MakeBuffer():
+        if type(refline) == np.ndarray:
+            refGS = Toolbox.ArrtoGS(refline, georef)
+        else: # if refline is read in as shapefile
+            refGS = gpd.GeoSeries(refline['geometry'])
+        
+        buffDist = settings['max_dist_ref']/georef[1] # convert from metres to pixels using georef cell size
+        refLSBuffer = refGS.buffer(buffDist)
+        refShapes = ((geom,value) for geom, value in zip(refLSBuffer.geometry, np.ones(len(refLSBuffer))))
+        im_buffer_float = features.rasterize(refShapes,out_shape=cloud_mask.shape)
+        # convert to bool
+        return im_buffer_float > 0 
     
-    buffDist = settings['max_dist_ref']/georef[1] # convert from metres to pixels using georef cell size
-    refLSBuffer = refGS.buffer(buffDist)
-    refShapes = ((geom,value) for geom, value in zip(refLSBuffer.geometry, np.ones(len(refLSBuffer))))
-    im_buffer_float = features.rasterize(refShapes,out_shape=cloud_mask.shape)
-    # convert to bool
-    im_buffer = im_buffer_float > 0 
+    im_buffer = Toolbox.CachedMask(BuffKey, MakeBuffer)
     
     return im_buffer
 
@@ -1364,34 +1533,17 @@ def ProcessShoreline(contours, cloud_mask, georef, image_epsg, settings):
     
     # remove any coordinates that fall within cloud pixels
     if sum(sum(cloud_mask)) > 0:
-        # get the coordinates of the cloud pixels
-        idx_cloud = np.where(cloud_mask)
-        idx_cloud = np.array([(idx_cloud[0][k], idx_cloud[1][k]) for k in range(len(idx_cloud[0]))])
-        # convert to world coordinates and same epsg as the shoreline points
-        if idx_cloud.dtype == 'int64': # fix for S2 pix coords being int64 and unwriteable as float64
-            idx_cloud = idx_cloud.astype('float64')
-        coords_cloud = Toolbox.convert_epsg(Toolbox.convert_pix2world(idx_cloud, georef),
-                                               image_epsg, settings['output_epsg'])[:,:-1]
         # only keep the shoreline points that are at least 30m from any cloud pixel
-        if type(contours_world) == list: # for multilines; extra nested loop
-            idx_keep = [] # initialise indexes of coords to keep
-            for j in range(len(contours_world)):  # for every line feature
-                idx_keep.append(np.ones(len(contours_world[j][:])).astype(bool)) # length should be number of coord pairs
-                for k in range(len(contours_world[j])): # for every coord pair in each line feature
-                    if np.any(np.linalg.norm(contours_world[j][k] - coords_cloud, axis=1) < 30):
-                        idx_keep[j][k] = False
+        if type(contours_world) == list: # for multilines; check each line feature
             contours_world_list = [] # initialise contour list
-            for i in range(len(contours_world)): # for each multiline feature
-                contour_world = contours_world[i]
+            for contour_world in contours_world: # for each multiline feature
+                idx_keep = ~Toolbox.NearCloud(contour_world, cloud_mask, georef, image_epsg, settings['output_epsg'], 30)
                 # only keep coords away from clouds in each line feature
-                contours_world_list.append(contour_world[idx_keep[i]])  
+                contours_world_list.append(contour_world[idx_keep])  
             contour_world = contours_world_list    
         elif type(contours_world) == np.ndarray:
             # only keep the shoreline points that are at least 30m from any cloud pixel
-            idx_keep = np.ones(len(contours_world)).astype(bool)
-            for k in range(len(contours_world)): # for every coord pair in the one line feature
-                if np.any(np.linalg.norm(contours_world[k,:] - coords_cloud, axis=1) < 30):
-                    idx_keep[k] = False
+            idx_keep = ~Toolbox.NearCloud(contours_world, cloud_mask, georef, image_epsg, settings['output_epsg'], 30)
             contours_world = contours_world[idx_keep]
     
     # world coordinates array to geoseries
@@ -1399,10 +1551,11 @@ def ProcessShoreline(contours, cloud_mask, georef, image_epsg, settings):
     # remove any lines that fall below the threshold length defined by user
     shoreline = contoursGS[contoursGS.length > settings['min_length_sl']]
     
-    # convert shorelines to different coord systems
-    shoreline = shoreline.to_crs(settings['output_epsg'])
-    shoreline_latlon = shoreline.to_crs(settings['ref_epsg'])
-    shoreline_proj = shoreline.to_crs(settings['projection_epsg'])
+    # convert shorelines to different coord systems (all in one pass over the vertices)
+    shoreline, shoreline_latlon, shoreline_proj = Toolbox.ReprojectLines(shoreline, image_epsg, 
+                                                                         [settings['output_epsg'], 
+                                                                          settings['ref_epsg'], 
+                                                                          settings['projection_epsg']])
         
     return shoreline, shoreline_latlon, shoreline_proj
     
@@ -1497,19 +1650,8 @@ def process_shoreline(contours, cloud_mask, georef, image_epsg, settings):
 
     # now remove any shoreline points that are attached to cloud pixels
     if sum(sum(cloud_mask)) > 0:
-        # get the coordinates of the cloud pixels
-        idx_cloud = np.where(cloud_mask)
-        idx_cloud = np.array([(idx_cloud[0][k], idx_cloud[1][k]) for k in range(len(idx_cloud[0]))])
-        # convert to world coordinates and same epsg as the shoreline points
-        if idx_cloud.dtype == 'int64': # fix for S2 pix coords being int64 and unwriteable as float64
-            idx_cloud = idx_cloud.astype('float64')
-        coords_cloud = Toolbox.convert_epsg(Toolbox.convert_pix2world(idx_cloud, georef),
-                                               image_epsg, settings['output_epsg'])[:,:-1]
         # only keep the shoreline points that are at least 30m from any cloud pixel
-        idx_keep = np.ones(len(shoreline)).astype(bool)
-        for k in range(len(shoreline)):
-            if np.any(np.linalg.norm(shoreline[k,:] - coords_cloud, axis=1) < 30):
-                idx_keep[k] = False
+        idx_keep = ~Toolbox.NearCloud(shoreline, cloud_mask, georef, image_epsg, settings['output_epsg'], 30)
         shoreline = shoreline[idx_keep]
     return shoreline, shoreline_latlon, shoreline_proj
 
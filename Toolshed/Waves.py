@@ -139,35 +139,208 @@ def ReadWaveFile(WaveFilePath):
         # can be rectangular, resulting in differently sized arrays, so transforming as two coordinate arrays doesn't work
         WaveX  = WaveData.variables['longitude'][:]
         WaveY  = WaveData.variables['latitude'][:]
-
-        SigWaveHeight = WaveData.variables['VHM0'][:,:,:]  # Spectral significant wave height (Hs)
-        MeanWaveDir = WaveData.variables['VMDR'][:,:,:] # Mean wave direction from (Dir)
-        PeakWavePer = WaveData.variables['VTPK'][:,:,:] # Wave period at spectral peak (Tp)
-        WaveSeconds = WaveData.variables['time'][:]
         
         #  Fill empty cells of each raster in stack using interpolation
-        for t in range(SigWaveHeight.shape[0]):
-            SigWaveHeight[t] = Toolbox.InterpolateRaster(SigWaveHeight[t])
-            PeakWavePer[t] = Toolbox.InterpolateRaster(PeakWavePer[t])
-            # catch empty wave data and fill with nan
-            if MeanWaveDir[t].count()/MeanWaveDir[t].size > 0:
-                MeanWaveDir[t] = Toolbox.InterpolateCircRaster(MeanWaveDir[t]) # Needs circular interpolation instead
+        SigWaveHeight = ReadWaveVar(WaveData.variables['VHM0'])  # Spectral significant wave height (Hs)
+        MeanWaveDir = ReadWaveVar(WaveData.variables['VMDR'], Circular=True) # Mean wave direction from (Dir); needs circular interpolation instead
+        PeakWavePer = ReadWaveVar(WaveData.variables['VTPK']) # Wave period at spectral peak (Tp)
             
-        WaveTime = []
-        for i in range(0,len(WaveSeconds)):
-            if 'UK' in WaveData.institution:
-                # European NW Shelf stored as 'seconds since 1970-01-01 00:00:00'
-                WaveTime.append(datetime(1970,1,1,0,0,0)+timedelta(seconds=int(WaveSeconds[i])))
-                # OLD # WaveTime.append(datetime.strptime(datetime.fromtimestamp(WaveSeconds.astype(int)[i]).strftime('%Y-%m-%d %H:%M:%S'),'%Y-%m-%d %H:%M:%S'))
-            else:
-                # Global Wave Reanalysis is stored as 'number of hours since 1950-01-01 00:00:00'
-                WaveTime.append(datetime(1950,1,1,0,0,0)+timedelta(hours=int(WaveSeconds[i])))
+        WaveTime = ReadWaveTime(WaveData)
                 
         StormEvents = CalcStorms(WaveTime, SigWaveHeight)
         
     return WaveX, WaveY, SigWaveHeight, MeanWaveDir, PeakWavePer, WaveTime, StormEvents
 
 
+def ReadWaveCells(WaveFilePath, Lons, Lats, TimeChunk=1000):
+    """
+    Read wave data stored in NetCDF file for only the grid cells closest to a 
+    set of points (e.g. transect midpoints), rather than the full wave rasters.
+    Empty (land) cells are filled in the same way as ReadWaveFile(), but the 
+    fill is worked out once from the first timestep and reused for every 
+    timestep, and the file is read in chunks of time covering only the cells needed.
+    FM Nov 2024
+
+    Parameters
+    -------
+    WaveFilePath : str
+        Path to wave timeseries NetCDF file.
+    Lons : array
+        Longitudes of points to sample wave data at.
+    Lats : array
+        Latitudes of points to sample wave data at.
+    TimeChunk : int, optional
+        Number of timesteps to read from the file at once. The default is 1000.
+
+    Returns
+    -------
+    WaveX : array
+        Longitudes of wave grid cells.
+    WaveY : array
+        Latitudes of wave grid cells.
+    GridCells : list
+        (lat ID, long ID) of wave grid cell closest to each point.
+    UniqueCells : list
+        Unique (lat ID, long ID) grid cells, in the order of the wave data columns.
+    SigWaveHeight : array
+        Timeseries of significant wave height (in metres) for each unique cell (shape=(time, cells)).
+    MeanWaveDir : array
+        Timeseries of mean wave direction (in degrees from) for each unique cell.
+    PeakWavePer : array
+        Timeseries of peak wave period (in seconds) for each unique cell.
+    WaveTime : list
+        Timestamps of timeseries to match wave conditions.
+    StormEvents : array
+        Timeseries of bools for each unique cell (1 where wave heights
+        exceed the 95th percentile for each individual cell's timeseries.)
+
+    """
+    with netCDF4.Dataset(WaveFilePath) as WaveData:
+        
+        WaveX  = WaveData.variables['longitude'][:]
+        WaveY  = WaveData.variables['latitude'][:]
+        
+        # get index of closest matching grid square of wave data for each point
+        IDLats = np.abs(np.asarray(WaveY)[None,:] - np.asarray(Lats)[:,None]).argmin(axis=1)
+        IDLongs = np.abs(np.asarray(WaveX)[None,:] - np.asarray(Lons)[:,None]).argmin(axis=1)
+        GridCells = [(int(IDLat), int(IDLong)) for IDLat, IDLong in zip(IDLats, IDLongs)]
+        UniqueCells = list(dict.fromkeys(GridCells))
+        
+        SigWaveHeight = ReadWaveVar(WaveData.variables['VHM0'], Cells=UniqueCells, TimeChunk=TimeChunk)
+        MeanWaveDir = ReadWaveVar(WaveData.variables['VMDR'], Circular=True, Cells=UniqueCells, TimeChunk=TimeChunk)
+        PeakWavePer = ReadWaveVar(WaveData.variables['VTPK'], Cells=UniqueCells, TimeChunk=TimeChunk)
+        
+        WaveTime = ReadWaveTime(WaveData)
+        
+        StormEvents = CalcStorms(WaveTime, SigWaveHeight)
+    
+    return WaveX, WaveY, GridCells, UniqueCells, SigWaveHeight, MeanWaveDir, PeakWavePer, WaveTime, StormEvents
+
+
+def ReadWaveTime(WaveData):
+    """
+    Convert the time variable of an open wave NetCDF into a list of datetimes.
+    FM Nov 2024
+
+    Parameters
+    -------
+    WaveData : netCDF4.Dataset
+        Open wave timeseries NetCDF file.
+
+    Returns
+    -------
+    WaveTime : list
+        Timestamps of timeseries to match wave conditions.
+
+    """
+    WaveSeconds = np.asarray(WaveData.variables['time'][:]).astype(np.int64)
+    if 'UK' in WaveData.institution:
+        # European NW Shelf stored as 'seconds since 1970-01-01 00:00:00'
+        WaveTime = np.datetime64('1970-01-01T00:00:00') + WaveSeconds.astype('timedelta64[s]')
+    else:
+        # Global Wave Reanalysis is stored as 'number of hours since 1950-01-01 00:00:00'
+        WaveTime = np.datetime64('1950-01-01T00:00:00') + WaveSeconds.astype('timedelta64[h]')
+    
+    return WaveTime.astype('datetime64[us]').tolist()
+
+
+def ReadWaveVar(WaveVar, Circular=False, Cells=None, TimeChunk=1000):
+    """
+    Read a wave variable from an open NetCDF, filling empty (land) cells with
+    interpolated values. The empty cells are taken from the first timestep and
+    the fill (nearest valid cell, or linear circular interpolation for 
+    directions) is calculated once with Toolbox.RasterFillWeights() then 
+    applied to every timestep.
+    FM Nov 2024
+
+    Parameters
+    -------
+    WaveVar : netCDF4.Variable
+        Wave variable with shape (time, lat, long).
+    Circular : bool, optional
+        Whether values are directions in degrees. The default is False.
+    Cells : list, optional
+        (lat ID, long ID) grid cells to read; if None, the full rasters are read.
+        The default is None.
+    TimeChunk : int, optional
+        Number of timesteps to read/fill at once. The default is 1000.
+
+    Returns
+    -------
+    WaveProp : array
+        Filled wave variable, either as a masked array with shape (time, lat, long)
+        or an array with shape (time, cells) if Cells are given.
+
+    """
+    Mask = np.ma.getmaskarray(WaveVar[0,:,:])
+    # only fill if raster has some but not all cells empty
+    if Mask.any() and not Mask.all():
+        FillCoords, SrcCoords, Weights = Toolbox.RasterFillWeights(Mask, method='linear' if Circular else 'nearest')
+    else:
+        FillCoords, SrcCoords, Weights = np.empty((0,2), dtype=int), np.empty((0,1,2), dtype=int), np.empty((0,1))
+    
+    if Cells is None:
+        WaveProp = np.ma.filled(WaveVar[:].astype(float), np.nan)
+        for t in range(0, WaveProp.shape[0], TimeChunk):
+            Chunk = WaveProp[t:t+TimeChunk]
+            Chunk[:, FillCoords[:,0], FillCoords[:,1]] = FillWaveValues(Chunk[:, SrcCoords[...,0], SrcCoords[...,1]], 
+                                                                        Weights, Circular)
+        return np.ma.masked_invalid(WaveProp)
+    
+    # each requested cell is read from itself if valid, or from its fill cells if empty
+    FillIndex = {(Row, Col): i for i, (Row, Col) in enumerate(FillCoords)}
+    CellSrc = np.empty((len(Cells),) + SrcCoords.shape[1:], dtype=int)
+    CellWeights = np.zeros((len(Cells), Weights.shape[1]))
+    for c, Cell in enumerate(Cells):
+        if Cell in FillIndex:
+            CellSrc[c] = SrcCoords[FillIndex[Cell]]
+            CellWeights[c] = Weights[FillIndex[Cell]]
+        else:
+            CellSrc[c] = Cell
+            CellWeights[c, 0] = 1.
+    
+    # only read the box of grid cells that covers the cells needed
+    Row0, Col0 = CellSrc.reshape(-1,2).min(axis=0)
+    Row1, Col1 = CellSrc.reshape(-1,2).max(axis=0) + 1
+    WaveProp = np.empty((WaveVar.shape[0], len(Cells)))
+    for t in range(0, WaveVar.shape[0], TimeChunk):
+        Chunk = np.ma.filled(WaveVar[t:t+TimeChunk, Row0:Row1, Col0:Col1].astype(float), np.nan)
+        WaveProp[t:t+TimeChunk] = FillWaveValues(Chunk[:, CellSrc[...,0]-Row0, CellSrc[...,1]-Col0], 
+                                                 CellWeights, Circular)
+    
+    return WaveProp
+
+
+def FillWaveValues(SrcVals, Weights, Circular=False):
+    """
+    Combine values from source cells into filled values using weights from 
+    Toolbox.RasterFillWeights().
+    FM Nov 2024
+
+    Parameters
+    -------
+    SrcVals : array
+        Source cell values (shape=(time, cells, k)).
+    Weights : array
+        Weight of each source cell (shape=(cells, k)).
+    Circular : bool, optional
+        Whether values are directions in degrees (combined as sin/cos components). 
+        The default is False.
+
+    Returns
+    -------
+    array
+        Filled values (shape=(time, cells)).
+
+    """
+    if Circular:
+        SrcRad = np.deg2rad(SrcVals)
+        FillRad = np.arctan2(np.sum(Weights * np.sin(SrcRad), axis=-1), np.sum(Weights * np.cos(SrcRad), axis=-1))
+        return np.mod(np.rad2deg(FillRad), 360)
+    else:
+        return np.sum(Weights * SrcVals, axis=-1)
+
+
 def SampleWaves(settings, output, TransectInterGDF, WaveFilePath):
     """
     Function to extract wave information from Copernicus NWS data
@@ -471,8 +644,14 @@ def SampleWavesSimple(settings, output, TransectInterGDF, WaveFilePath):
 
     print('Loading wave data for extraction ...')
     
-    # Read in wave data (and interpolate empty cells in rasters if need be)
-    WaveX, WaveY, SigWaveHeight, MeanWaveDir, PeakWavePer, WaveTime, StormEvents = ReadWaveFile(WaveFilePath)
+    # Get centroid locations of each transect (in lat long)
+    Centroids = TransectInterGDF.to_crs('4326').centroid
+    
+    # Read in wave data only for the grid cells matching the midpoint of each 
+    # cross-shore transect (and interpolate empty cells in rasters if need be)
+    WaveX, WaveY, GridCells, UniqueCells, CellHs, CellDir, CellTp, WaveTime, StormEvents = ReadWaveCells(WaveFilePath, 
+                                                                                                          Centroids.x.to_numpy(), 
+                                                                                                          Centroids.y.to_numpy())
 
     # Extract unique satellite image dates list
     DateTimeSat = [datetime.strptime(f"{date} {time}", '%Y-%m-%d %H:%M:%S.%f')
@@ -487,11 +666,28 @@ def SampleWavesSimple(settings, output, TransectInterGDF, WaveFilePath):
                                   end=WaveTimeClip.iloc[-1],
                                   freq='D')
 
-    # Get centroid locations of each transect (in lat long)
-    Centroids = TransectInterGDF.to_crs('4326').centroid
+    # Process each grid cell of data only once (interpolated between timesteps to 
+    # find exact value, mean and st dev calculated), with all cells done in one go
+    CellWaves = {'Hs': CellHs, 'Dir': CellDir, 'Tp': CellTp}
+    CellData = {}
+    for WaveType, WaveProp in CellWaves.items():
+        CellData['TrWave'+WaveType] = SampleWavesSimple_interp(WaveProp, WaveTime, DateTimeSat)
+        CellData['TrNormWave'+WaveType] = SampleWavesSimple_norm(WaveProp, WaveTime, DateTimeSat, WaveType)
+        CellData['TrStDevWave'+WaveType] = SampleWavesSimple_stdev(WaveProp, WaveTime, DateTimeSat, WaveType)
     
-    # Initialise caching and output dicts
+    # Split the batched results into cached data for each grid cell
     Cached = {}
+    for Cell, GridCell in enumerate(UniqueCells):
+        GridData = {'TrWaveDates': DateTimeSat}
+        for gridkey in CellData:
+            GridData[gridkey] = CellData[gridkey][:, Cell].tolist()
+        GridData['TrWaveDatesFD'] = DateTimeDaily.to_list()
+        GridData['TrWaveHsFD'] = SampleWavesSimple_daily(CellWaves['Hs'][:, Cell], 'Hs', WaveTime, DateTimeDaily)
+        GridData['TrWaveDirFD'] = SampleWavesSimple_daily(CellWaves['Dir'][:, Cell], 'Dir', WaveTime, DateTimeDaily)
+        GridData['TrWaveTpFD'] = SampleWavesSimple_daily(CellWaves['Tp'][:, Cell], 'Tp', WaveTime, DateTimeDaily)
+        Cached[GridCell] = GridData
+    
+    # Initialise output dict
     ResultsDict = {'WaveDates': [], 
                    'WaveHs': [],
                    'WaveDir': [],
@@ -511,57 +707,25 @@ def SampleWavesSimple(settings, output, TransectInterGDF, WaveFilePath):
                    'WaveTpFD': []}
     
     
+    # Calculate the angle of the shoreline at each transect (clockwise from north)
+    ResultsDict['ShoreAngles'] = [CalcShoreAngle(TransectInterGDF, Tr) for Tr in range(len(TransectInterGDF))]
+    
+    # Calculate WaveDiffusivity and WaveStability for each transect based on transect-specific ShoreAngle
+    # Uses full wave timeseries rather than just sat obs, with all transects done at once
+    CellIndex = {GridCell: Cell for Cell, GridCell in enumerate(UniqueCells)}
+    CellIDs = [CellIndex[GridCell] for GridCell in GridCells]
+    WaveDiffusivity, WaveStability = WaveClimateSimple(np.array(ResultsDict['ShoreAngles']), 
+                                                       CellWaves['Hs'], CellWaves['Dir'], CellWaves['Tp'], 
+                                                       WaveTime, CellIDs)
+    # Single values per-transect in results dictionary
+    ResultsDict['WaveDiffusivity'] = list(WaveDiffusivity)
+    ResultsDict['WaveStability'] = list(WaveStability)
+    
     for Tr in range(len(TransectInterGDF)):
         print('\r %i / %i transects processed' % (Tr, len(TransectInterGDF)), end='')
         
-        # Clculate the midpoint of each cross-shore transect geometry
-        MidPnt = Centroids.iloc[Tr].coords[0]
-        IDLat = (np.abs(WaveY - MidPnt[1])).argmin()
-        IDLong = (np.abs(WaveX - MidPnt[0])).argmin()
-        # Feed the matching wave grid lat and long IDs to be used as a key in the cached data dict
-        GridCell = (IDLat, IDLong)
-
-        # Calculate the angle of the shoreline at each transect (clockwise from north)
-        ShoreAngle = CalcShoreAngle(TransectInterGDF, Tr)
-        ResultsDict['ShoreAngles'].append(ShoreAngle)
-        
-        # Calculate WaveDiffusivity and WaveStability for each transect based on transect-specific ShoreAngle
-        # Uses full wave timeseries rather than just sat obs
-        TrWaveDiffusivity, TrWaveStability = WaveClimateSimple(ShoreAngle, 
-                                                               SigWaveHeight[:, IDLat, IDLong], 
-                                                               MeanWaveDir[:, IDLat, IDLong], 
-                                                               PeakWavePer[:, IDLat, IDLong], 
-                                                               WaveTime)
-        # Append single values per-transect to results dictionary
-        ResultsDict['WaveDiffusivity'].append(TrWaveDiffusivity)
-        ResultsDict['WaveStability'].append(TrWaveStability)
-        
-        # If the grid cell is already present in the cached data file, 
-        # don't re-calculate anything and just load in the wave values for that grid cell
-        if GridCell in Cached:
-            GridData = Cached[GridCell]
-        else:
-            # Otherwise, compute wave data for this grid cell
-            # IDLat, IDLong = GridCell
-            GridData = {
-                'TrWaveDates': DateTimeSat,
-                'TrWaveHs': SampleWavesSimple_interp(SigWaveHeight[:, IDLat, IDLong], WaveTime, DateTimeSat),
-                'TrWaveDir': SampleWavesSimple_interp(MeanWaveDir[:, IDLat, IDLong], WaveTime, DateTimeSat),
-                'TrWaveTp': SampleWavesSimple_interp(PeakWavePer[:, IDLat, IDLong], WaveTime, DateTimeSat),
-                'TrNormWaveHs': SampleWavesSimple_norm(SigWaveHeight[:, IDLat, IDLong], WaveTime, DateTimeSat, 'Hs'),
-                'TrNormWaveDir': SampleWavesSimple_norm(MeanWaveDir[:, IDLat, IDLong], WaveTime, DateTimeSat, 'Dir'),
-                'TrNormWaveTp': SampleWavesSimple_norm(PeakWavePer[:, IDLat, IDLong], WaveTime, DateTimeSat, 'Tp'),
-                'TrStDevWaveHs': SampleWavesSimple_stdev(SigWaveHeight[:, IDLat, IDLong], WaveTime, DateTimeSat, 'Hs'),
-                'TrStDevWaveDir': SampleWavesSimple_stdev(MeanWaveDir[:, IDLat, IDLong], WaveTime, DateTimeSat, 'Dir'),
-                'TrStDevWaveTp': SampleWavesSimple_stdev(PeakWavePer[:, IDLat, IDLong], WaveTime, DateTimeSat, 'Tp'),
-                'TrWaveDatesFD': DateTimeDaily.to_list(),
-                'TrWaveHsFD': SampleWavesSimple_daily(SigWaveHeight[:, IDLat, IDLong], 'Hs', WaveTime, DateTimeDaily),
-                'TrWaveDirFD': SampleWavesSimple_daily(MeanWaveDir[:, IDLat, IDLong], 'Dir', WaveTime, DateTimeDaily),
-                'TrWaveTpFD': SampleWavesSimple_daily(PeakWavePer[:, IDLat, IDLong], 'Tp', WaveTime, DateTimeDaily)
-                }
-            
-            # Cache the results for this grid cell to avoid redundant calculations
-            Cached[GridCell] = GridData
+        # Load in the wave values already processed for the matching grid cell
+        GridData = Cached[GridCells[Tr]]
             
         # Append grid data results to output_results with the ShoreAngle-specific adjustments
         for key in ResultsDict:
@@ -577,23 +741,45 @@ def SampleWavesSimple(settings, output, TransectInterGDF, WaveFilePath):
 
 
 def SampleWavesSimple_interp(WaveProp, WaveTime, DateTimeSat):
-    interpolated_values = []
+    """
+    Linearly interpolate wave conditions to the time of each satellite image,
+    using a binary search of the wave timesteps. Satellite images captured 
+    after the end of the wave timeseries are given NaN.
+    FM Nov 2024
 
-    for Dt in DateTimeSat:
-        if WaveTime[-1] < Dt:
-            interpolated_values.append(np.nan)
-        else:
-            # Find surrounding wave data points and times for interpolation
-            Prev_t = max([t for t in WaveTime if t <= Dt], default=WaveTime[0])
-            Next_t = min([t for t in WaveTime if t > Dt], default=WaveTime[-1])
-            
-            Prev_val = WaveProp[WaveTime.index(Prev_t)]
-            Next_val = WaveProp[WaveTime.index(Next_t)]
-            
-            # Calculate interpolated wave value
-            TimeFrac = (Dt - Prev_t) / (Next_t - Prev_t)
-            interpolated_value = Prev_val + TimeFrac * (Next_val - Prev_val)
-            interpolated_values.append(interpolated_value)
+    Parameters
+    ----------
+    WaveProp : array
+        Wave property timeseries, with time on the first axis (shape=(time,) 
+        or (time, grid cells)).
+    WaveTime : list
+        Timestamps of wave timeseries.
+    DateTimeSat : list
+        Timestamps of satellite images.
+
+    Returns
+    -------
+    interpolated_values : array
+        Wave property at each satellite timestamp (shape=(sat dates,) + WaveProp.shape[1:]).
+
+    """
+    WaveProp = np.ma.filled(np.ma.asarray(WaveProp, dtype=float), np.nan)
+    WaveTime = np.asarray(WaveTime, dtype='datetime64[ns]').astype(np.int64)
+    SatTime = np.asarray(DateTimeSat, dtype='datetime64[ns]').astype(np.int64)
+    
+    # Find surrounding wave data points and times for interpolation
+    Next_i = np.searchsorted(WaveTime, SatTime, side='right')
+    Prev_i = np.clip(Next_i - 1, 0, None)
+    Next_i = np.clip(Next_i, None, len(WaveTime) - 1)
+    TimeGap = WaveTime[Next_i] - WaveTime[Prev_i]
+    
+    # Calculate interpolated wave value (just the nearest value at either end of the timeseries)
+    TimeFrac = np.where(TimeGap > 0, (SatTime - WaveTime[Prev_i]) / np.where(TimeGap > 0, TimeGap, 1), 0.)
+    TimeFrac = TimeFrac.reshape((-1,) + (1,)*(WaveProp.ndim - 1))
+    interpolated_values = WaveProp[Prev_i] + TimeFrac * (WaveProp[Next_i] - WaveProp[Prev_i])
+    
+    # if sat image date falls outside wave data window, assign nan
+    interpolated_values[SatTime > WaveTime[-1]] = np.nan
     
     return interpolated_values
 
@@ -614,45 +800,96 @@ def SampleWavesSimple_daily(WaveProp, PropName, WaveTime, DateTimeDaily):
     return daily_values.to_list()
 
 
-def SampleWavesSimple_norm(WaveProp, WaveTime, DateTimeSat, WaveType):
-    NormVals = []
+def SampleWavesSimple_window(WaveProp, WaveTime, DateTimeSat, WaveType, Days=90):
+    """
+    Mean and standard deviation of wave conditions over the window of time 
+    before each satellite image (inclusive of both ends). Window sums are taken
+    as differences of cumulative sums, so every image (and every grid cell) is 
+    done at once. Wave directions use circular statistics (as per Toolbox.CircMean()
+    and Toolbox.CircStd()), and NaNs/masked values are ignored.
+    FM Nov 2024
+
+    Parameters
+    ----------
+    WaveProp : array
+        Wave property timeseries, with time on the first axis (shape=(time,) 
+        or (time, grid cells)).
+    WaveTime : list
+        Timestamps of wave timeseries.
+    DateTimeSat : list
+        Timestamps of satellite images.
+    WaveType : str
+        Wave property ('Hs', 'Dir' or 'Tp').
+    Days : int, optional
+        Length of window before each image in days. The default is 90.
+
+    Returns
+    -------
+    MeanVals : array
+        Windowed means (shape=(sat dates,) + WaveProp.shape[1:]).
+    StDVals : array
+        Windowed standard deviations (shape=(sat dates,) + WaveProp.shape[1:]).
+
+    """
+    WaveProp = np.ma.filled(np.ma.asarray(WaveProp, dtype=float), np.nan)
+    WaveTime = np.asarray(WaveTime, dtype='datetime64[ns]').astype(np.int64)
+    SatTime = np.asarray(DateTimeSat, dtype='datetime64[ns]').astype(np.int64)
     
-    for Dt in DateTimeSat:
-        # Find the 3-month period before sat_time
-        start_t = Dt - timedelta(days=90)
-        Indices = [i for i, t in enumerate(WaveTime) if start_t <= t <= Dt]
-        
-        if Indices:
-            ValsIn = WaveProp[Indices]
-            if WaveType == 'Dir':
-                # Use circular mean for directions
-                MeanVal = Toolbox.CircMean(ValsIn)
-            else:
-                MeanVal = np.mean(ValsIn)
-            NormVals.append(MeanVal)
+    # Find the window period (e.g. 3 months) before each sat_time
+    Start = np.searchsorted(WaveTime, SatTime - np.timedelta64(Days, 'D').astype('timedelta64[ns]').astype(np.int64), side='left')
+    End = np.searchsorted(WaveTime, SatTime, side='right')
+    
+    Valid = ~np.isnan(WaveProp)
+    def WindowSum(Vals):
+        CumVals = np.cumsum(np.where(Valid, Vals, 0.), axis=0)
+        CumVals = np.concatenate((np.zeros((1,) + CumVals.shape[1:]), CumVals), axis=0)
+        return CumVals[End] - CumVals[Start]
+    
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Count = WindowSum(np.ones(WaveProp.shape))
+        if WaveType == 'Dir':
+            # Use circular mean and std for directions
+            WaveRad = np.deg2rad(WaveProp)
+            SinSum = WindowSum(np.sin(WaveRad))
+            CosSum = WindowSum(np.cos(WaveRad))
+            MeanVals = np.rad2deg(np.arctan2(SinSum, CosSum) % (2*np.pi))
+            R = np.minimum(1, np.hypot(SinSum, CosSum) / Count)
+            StDVals = np.rad2deg(np.sqrt(-2 * np.log(R)))
         else:
-            NormVals.append(np.nan)
+            # offset by the overall mean first to keep the sums of squares precise
+            RefVal = np.nan_to_num(np.nanmean(WaveProp, axis=0))
+            WaveDiff = WaveProp - RefVal
+            DiffMean = WindowSum(WaveDiff) / Count
+            MeanVals = RefVal + DiffMean
+            StDVals = np.sqrt(np.maximum(WindowSum(WaveDiff**2) / Count - DiffMean**2, 0))
+    
+    # no wave data in window
+    MeanVals[Count == 0] = np.nan
+    StDVals[Count == 0] = np.nan
+    
+    return MeanVals, StDVals
+
+
+def SampleWavesSimple_norm(WaveProp, WaveTime, DateTimeSat, WaveType):
+    """
+    Mean of wave conditions over the 3 months before each satellite image
+    (circular mean for directions). See SampleWavesSimple_window().
+    FM Nov 2024
+    
+    """
+    NormVals, _ = SampleWavesSimple_window(WaveProp, WaveTime, DateTimeSat, WaveType)
     
     return NormVals
     
 
 def SampleWavesSimple_stdev(WaveProp, WaveTime, DateTimeSat, WaveType):
-    StDVals = []
-
-    for Dt in WaveTime:
-        start_t = Dt - timedelta(days=90)
-        Indices = [i for i, t in enumerate(WaveTime) if start_t <= t <= Dt]
-        
-        if Indices:
-            ValsIn = WaveProp[Indices]
-            if WaveType == 'Dir':
-                # Use circular standard deviation for directions
-                StDVal = Toolbox.CircStd(ValsIn)
-            else:
-                StDVal = np.std(ValsIn)
-            StDVals.append(StDVal)
-        else:
-            StDVals.append(np.nan)
+    """
+    Standard deviation of wave conditions over the 3 months before each satellite
+    image (circular std for directions). See SampleWavesSimple_window().
+    FM Nov 2024
+    
+    """
+    _, StDVals = SampleWavesSimple_window(WaveProp, WaveTime, DateTimeSat, WaveType)
     
     return StDVals
 
@@ -853,7 +1090,7 @@ def WaveClimate(ShoreAngle, WaveHs, WaveDir, WaveTp, WaveTime):
     return WaveDiffusivity, WaveStability
 
 
-def WaveClimateSimple(ShoreAngle, WaveHs, WaveDir, WaveTp, WaveTime):
+def WaveClimateSimple(ShoreAngle, WaveHs, WaveDir, WaveTp, WaveTime, CellIDs=None):
     """
     IN DEVELOPMENT
     Calculate indicators of wave climate per transect, following equations of
@@ -863,66 +1100,88 @@ def WaveClimateSimple(ShoreAngle, WaveHs, WaveDir, WaveTp, WaveTime):
       or growth of shoreline perturbations (-ve diffusivity, Stability)
     - Stability index (Gamma) represents wave angle with respect to shoreline
       orientation, with 1 = low-angle climate and -1 = high-angle climate
-    Simplified version of WaveClimate() with angles in radians instead.
+    Simplified version of WaveClimate() with angles in radians instead. Can be
+    run for many transects at once, by passing an array of shore angles and a 
+    (time x grid cell) stack of wave data.
       
-    FM Oct 2024
+    FM Oct 2024 (updated Nov 2024)
 
     Parameters
     ----------
-    TransectInterGDF : GeoDataFrame
-        GeoDataFrame of transects with veg edge intersection info assigned.
+    ShoreAngle : float or array
+        Angle of shoreline at each transect (in degrees clockwise from N).
+    WaveHs : array
+        Significant wave height timeseries (shape=(time,) or (time, grid cells)).
+    WaveDir : array
+        Mean wave direction timeseries (shape=(time,) or (time, grid cells)).
+    WaveTp : array
+        Peak wave period timeseries (shape=(time,) or (time, grid cells)).
+    WaveTime : list
+        Timestamps of wave timeseries.
+    CellIDs : array of int, optional
+        Grid cell (column of wave data) to use for each transect. The default 
+        is None (one column per transect, or one column for all).
 
     Returns
     -------
-    WaveDiffusivity : float
+    WaveDiffusivity : float or array
         Wave climate indicating perturbation growth or smoothing.
-    WaveStability : float
+    WaveStability : float or array
         Dimensionless measure of stability in offshore wave vs shore angles.
 
     """
     
-    # for each transect in run
-    # for Tr in range(len(TransectInterGDF)):
     K2 = 0.15 # Ashton & Murray (2006) value for significant wave heights
     D = 10. # average estimated depth of closure
     
     # Time interval between wave observations
     TimeStep = np.mean(np.diff(WaveTime)).seconds
     
-    # Convert shore angle and wave directions to radians
-    # theta_rad = np.radians(ShoreAngle)
-    # Phi_0_rad = np.radians(WaveDir)
-    # Calculate the angle difference (theta - Phi_0) in degrees
-    Alpha = (ShoreAngle - WaveDir + 180) % 360 - 180  # Compute angle diff in degrees
-      
-    # Initialize an array to store mu values, applying shadowing condition
-    mu_values = []
-    for i in range(len(WaveDir)):        
-        if Alpha[i] <= 0:  # Only include waves that are onshore (angle_diff <= 0)
-            # Calculate the diffusivity (mu) using the formula for onshore waves
-            # abs() value used to avoid NaNs from raising a negative number to a decimal power
-            mu = (K2 / D) * (WaveTp[i]**(1/3)) * (WaveHs[i]**(12/5)) * \
-                 (abs(np.cos(np.radians(Alpha[i])))**(1/5)) * \
-                 ((6/5) * np.sin(np.radians(Alpha[i]))**2 - np.cos(np.radians(Alpha[i]))**2)
-
-            mu_values.append(mu)
-        else:
-            # Set mu to zero for offshore waves (shadowed conditions)
-            mu_values.append(0.0)
-    mu_values = np.array(mu_values)
+    ShoreAngles = np.atleast_1d(np.asarray(ShoreAngle, dtype=float))
+    WaveHs, WaveDir, WaveTp = (np.ma.filled(np.ma.asarray(WaveProp, dtype=float), np.nan).reshape(len(WaveTime), -1) 
+                               for WaveProp in [WaveHs, WaveDir, WaveTp])
+    if CellIDs is None:
+        CellIDs = np.zeros(len(ShoreAngles), dtype=int) if WaveHs.shape[1] == 1 else np.arange(len(ShoreAngles))
+    CellIDs = np.asarray(CellIDs, dtype=int)
     
-    # # Net diffusivity (Mu_net) [m/s-2]
-    # Since each interval should be equal, delta_{t,i} cancels out in the division
-    WaveDiffusivity = np.nanmean(mu_values)  # Equivalent to sum(mu * delta_t) / sum(delta_t) for equal intervals
-
-    # Stability index (Gamma) [dimensionless]
-    Stabil_num = np.nansum(mu_values * TimeStep)
-    Stabil_denom = np.nansum(np.abs(mu_values) * TimeStep)
-    # Check to make sure no division by zero; if that happens, return 0 
-    # (low and high angle waves balanced out, no longshore wave effects)
-    WaveStability = Stabil_num / Stabil_denom if Stabil_denom != 0 else 0
+    # wave height and period part of diffusivity only depends on grid cell
+    WaveMag = (K2 / D) * (WaveTp**(1/3)) * (WaveHs**(12/5))
     
-    return WaveDiffusivity, WaveStability
+    WaveDiffusivity = np.empty(len(ShoreAngles))
+    WaveStability = np.empty(len(ShoreAngles))
+    # run transects in chunks to limit the size of the (time x transect) arrays
+    ChunkSize = max(1, int(1e7 // len(WaveTime)))
+    for Chunk in range(0, len(ShoreAngles), ChunkSize):
+        Trs = slice(Chunk, Chunk+ChunkSize)
+        # Calculate the angle difference (theta - Phi_0) in degrees
+        Alpha = (ShoreAngles[Trs] - WaveDir[:, CellIDs[Trs]] + 180) % 360 - 180  # Compute angle diff in degrees
+        AlphaRad = np.radians(Alpha)
+        # Calculate the diffusivity (mu) using the formula for onshore waves
+        # abs() value used to avoid NaNs from raising a negative number to a decimal power
+        with np.errstate(invalid='ignore'):
+            mu_values = WaveMag[:, CellIDs[Trs]] * \
+                        (np.abs(np.cos(AlphaRad))**(1/5)) * \
+                        ((6/5) * np.sin(AlphaRad)**2 - np.cos(AlphaRad)**2)
+            # Only include waves that are onshore (angle_diff <= 0), 
+            # set mu to zero for offshore waves (shadowed conditions)
+            mu_values = np.where(Alpha <= 0, mu_values, 0.0)
+        
+        # # Net diffusivity (Mu_net) [m/s-2]
+        # Since each interval should be equal, delta_{t,i} cancels out in the division
+        WaveDiffusivity[Trs] = np.nanmean(mu_values, axis=0)  # Equivalent to sum(mu * delta_t) / sum(delta_t) for equal intervals
+    
+        # Stability index (Gamma) [dimensionless]
+        Stabil_num = np.nansum(mu_values * TimeStep, axis=0)
+        Stabil_denom = np.nansum(np.abs(mu_values) * TimeStep, axis=0)
+        # Check to make sure no division by zero; if that happens, return 0 
+        # (low and high angle waves balanced out, no longshore wave effects)
+        WaveStability[Trs] = np.divide(Stabil_num, Stabil_denom, out=np.zeros(len(Stabil_num)), where=Stabil_denom != 0)
+    
+    # single transect
+    if np.ndim(ShoreAngle) == 0:
+        return WaveDiffusivity[0], WaveStability[0]
+    else:
+        return WaveDiffusivity, WaveStability
 
 
 def CalcShoreAngle(TransectInterGDF, Tr):
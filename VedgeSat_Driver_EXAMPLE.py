@@ -111,6 +111,12 @@ settings = {
     'buffer_size': 250,         # radius (in metres) for buffer around sandy pixels considered in the shoreline detection
     'min_length_sl': 500,       # minimum length (in metres) of shoreline perimeter to be valid
     'cloud_mask_issue': False,  # switch this parameter to True if sand pixels are masked (in black) on many images  
+    'n_workers': 1,             # number of processes to extract veglines with (1 = serial, None = all available cores)
+    'classify_roi': False,      # if True, only classifies pixels around the reference line buffer (faster on large AOIs)
+    'numpy_mlp': False,         # if True, runs the trained classifiers as a plain numpy forward pass (skips sklearn overhead)
+    'tile_cache_gb': 5,         # size limit (in GB) of the local cache of downloaded image bands (0 = no cache)
+    'n_prefetch': 4,            # number of images to download ahead while processing (0 = no prefetching)
+    'coreg_fft': False,         # if True, tries a fast masked cross-correlation before AROSICS when coregistering
     # add the inputs defined previously
     'inputs': inputs,
     'projection_epsg': projection_epsg,
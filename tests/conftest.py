@@ -0,0 +1,5 @@
+import os
+import sys
+
+# run tests against the Toolshed package in this repo
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,66 @@
+"""
+Classifying only around the reference line (VegetationLine.ClassifyROI) should
+give the same labels as the full image wherever FindShoreContours_WP uses them.
+"""
+import numpy as np
+import pytest
+
+VegetationLine = pytest.importorskip('Toolshed.VegetationLine')
+from scipy import ndimage
+from skimage import morphology
+
+
+class ThresholdClassifier:
+    # veg (1) where NDVI plus its local stdev is high, else non-veg (2)
+    def predict(self, features):
+        return np.where(features[:,5] + features[:,15] > 0.05, 1, 2)
+
+
+def VegImage(im_veg):
+    im_ms = np.full(im_veg.shape + (5,), 0.2)
+    im_ms[:,:,2] = 0.3
+    im_ms[:,:,3] = np.where(im_veg, 0.5, 0.1)
+    return im_ms
+
+
+@pytest.fixture
+def scene():
+    rng = np.random.default_rng(0)
+    # blobby veg/non-veg pattern with speckle
+    im_veg = ndimage.gaussian_filter(rng.normal(size=(120, 140)), 3) > 0.05
+    im_veg |= rng.random(im_veg.shape) > 0.97
+    # reference buffer along a band of rows
+    im_ref_buffer = np.zeros(im_veg.shape, dtype=bool)
+    im_ref_buffer[40:46, :] = True
+    # thin 8-connected veg strip starting 5px from the buffer and running out
+    # past the ROI, in an otherwise non-veg corner
+    im_veg[50:, 80:] = False
+    for step in range(60):
+        im_veg[50 + step, 81 + step//2] = True
+    cloud_mask = np.zeros(im_veg.shape, dtype=bool)
+    cloud_mask[:8, :20] = True
+    return VegImage(im_veg), cloud_mask, im_ref_buffer
+
+
+@pytest.mark.parametrize('min_beach_area', [4, 20])
+def test_roi_labels_match_full_image(scene, min_beach_area):
+    im_ms, cloud_mask, im_ref_buffer = scene
+    clf = ThresholdClassifier()
+
+    _, FullLabels = VegetationLine.classify_image_NN(im_ms, None, cloud_mask, min_beach_area, clf)
+    im_roi = VegetationLine.ClassifyROI(im_ref_buffer, 5 + min_beach_area)
+    assert not im_roi.all()
+    _, ROILabels = VegetationLine.classify_image_NN(im_ms, None, cloud_mask, min_beach_area, clf, im_roi)
+
+    # labels used to find the threshold (see Image_Processing.ClipIndexVec)
+    im_zone = morphology.binary_dilation(im_ref_buffer, morphology.disk(5))
+    assert FullLabels[50, 81, 0]
+    assert np.array_equal(ROILabels[im_zone], FullLabels[im_zone])
+    assert not ROILabels[~im_roi].any()
+
+
+def test_empty_buffer_classifies_nothing(scene):
+    im_ms, cloud_mask, im_ref_buffer = scene
+    im_roi = VegetationLine.ClassifyROI(np.zeros(im_ref_buffer.shape, dtype=bool), 10)
+    im_classif, im_labels = VegetationLine.classify_image_NN(im_ms, None, cloud_mask, 4, ThresholdClassifier(), im_roi)
+    assert np.isnan(im_classif).all() and not im_labels.any()
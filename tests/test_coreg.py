@@ -0,0 +1,59 @@
+"""
+Known-shift tests for the masked cross-correlation fast path used by 
+Image_Processing.Coreg(), with a reference line buffer masked out of both images.
+"""
+import numpy as np
+import pytest
+
+ndimage = pytest.importorskip('scipy.ndimage')
+Image_Processing = pytest.importorskip('Toolshed.Image_Processing')
+
+
+def ShiftedPair(dy, dx, size=200, seed=0):
+    # smooth random texture; target pixel (r+dy, c+dx) shows reference pixel (r, c)
+    rng = np.random.default_rng(seed)
+    big = ndimage.gaussian_filter(rng.normal(size=(size+100, size+100)), 2)
+    shifted = ndimage.shift(big, (dy, dx), order=3)
+    return big[50:50+size, 50:50+size], shifted[50:50+size, 50:50+size]
+
+
+def BufferMask(size=200):
+    # diagonal reference line buffer, 30px wide, at the same pixels in both images
+    rows, cols = np.mgrid[0:size, 0:size]
+    return np.abs(rows - 0.8*cols - 30) < 15
+
+
+@pytest.mark.parametrize('shift', [(2, -3), (-5.3, 0.2), (3, 3), (0, 0), (7.5, -8.25)])
+def test_known_shift_with_buffer_mask(shift):
+    im_ref, im_trg = ShiftedPair(*shift)
+    buff = BufferMask()
+    rows, cols = np.mgrid[0:200, 0:200]
+    cloud = (rows - 150)**2 + (cols - 50)**2 < 25**2
+    
+    shift_px, ncc = Image_Processing.MaskedCorrShift(im_ref, im_trg, buff, np.logical_or(buff, cloud))
+    
+    assert np.allclose(shift_px, shift, atol=0.1)
+    assert ncc*100 >= 40
+
+
+def test_buffer_mask_alone_gives_no_match():
+    # unrelated images sharing only the mask must not pass the reliability gate
+    im_ref, _ = ShiftedPair(0, 0, seed=1)
+    _, im_trg = ShiftedPair(0, 0, seed=2)
+    buff = BufferMask()
+    
+    shift_px, ncc = Image_Processing.MaskedCorrShift(im_ref, im_trg, buff, buff)
+    
+    assert ncc*100 < 40
+
+
+def test_multiband_and_nan_pixels():
+    im_ref, im_trg = ShiftedPair(-4, 6)
+    im_ref = np.dstack([im_ref]*3)
+    im_trg = np.dstack([im_trg]*3)
+    im_trg[:20, :, :] = np.nan
+    buff = BufferMask()
+    
+    shift_px, ncc = Image_Processing.MaskedCorrShift(im_ref, im_trg, buff, buff)
+    
+    assert np.allclose(shift_px, (-4, 6), atol=0.1)
@@ -0,0 +1,155 @@
+"""
+Earth Engine pixel downloads (Image_Processing.EEDownload and PrefetchImgs)
+against a local fake of geemap.ee_to_numpy with configurable latency and
+injected errors: retries, backoff, rate limiting and download/compute overlap.
+"""
+import threading
+import time
+
+import numpy as np
+import pytest
+
+Image_Processing = pytest.importorskip('Toolshed.Image_Processing')
+
+
+class FakeEE:
+    """
+    Stand-in for geemap.ee_to_numpy which takes latency seconds per request and
+    raises the errors in errors (one per request, in order) before succeeding.
+    """
+    def __init__(self, latency=0, errors=()):
+        self.latency = latency
+        self.errors = list(errors)
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def ee_to_numpy(self, img, bands, region, scale):
+        with self.lock:
+            self.calls.append(time.monotonic())
+            error = self.errors.pop(0) if self.errors else None
+        time.sleep(self.latency)
+        if error is not None:
+            raise error
+        return np.ones((8, 8, len(bands)))
+
+
+class HttpError(Exception):
+    # like googleapiclient.errors.HttpError, with the status on resp
+    def __init__(self, status, msg=''):
+        super().__init__(msg)
+        self.resp = type('Response', (), {'status': status})()
+
+
+@pytest.fixture
+def settings(tmp_path):
+    (tmp_path / 'site').mkdir()
+    return {'ee_max_rate': 1000, 'ee_retries': 3, 'ee_backoff': 0.001, 'tile_cache_gb': 0,
+            'ref_epsg': 4326, 'projection_epsg': 32630, 'cloud_thresh': 0.5,
+            'inputs': {'sitename': 'site', 'filepath': str(tmp_path)}}
+
+
+@pytest.fixture
+def fake_ee(monkeypatch):
+    def Install(**kwargs):
+        Fake = FakeEE(**kwargs)
+        monkeypatch.setattr(Image_Processing.geemap, 'ee_to_numpy', Fake.ee_to_numpy)
+        return Fake
+    monkeypatch.setattr(Image_Processing.ee.Geometry, 'Polygon', lambda coords: coords)
+    monkeypatch.setattr(Image_Processing.ee, 'Image', lambda ImgID: ImgID)
+    return Install
+
+
+polygon = [[[-2.82, 56.33], [-2.81, 56.33], [-2.81, 56.335], [-2.82, 56.335], [-2.82, 56.33]]]
+
+
+@pytest.mark.parametrize('error', [
+    Exception('Too many concurrent aggregations.'),
+    Exception('Earth Engine capacity exceeded.'),
+    Exception('<HttpError 503 when requesting https://earthengine.googleapis.com/...>'),
+    ConnectionResetError('Connection reset by peer'),
+    TimeoutError('The read operation timed out'),
+    HttpError(429),
+    HttpError(500),
+])
+def test_transient_errors_retried(settings, fake_ee, error):
+    Fake = fake_ee(errors=[error, error])
+    im = Image_Processing.EEDownload(None, ['B2'], polygon, 10, settings)
+    assert im.shape == (8, 8, 1)
+    assert len(Fake.calls) == 3
+
+
+@pytest.mark.parametrize('error', [
+    Exception('Too many pixels in the region. Found 1500000, but maxPixels allows only 262144.'),
+    Exception('Total request size (55000500 bytes) must be less than or equal to 50331648 bytes.'),
+    Exception("Image.select: Pattern 'QA60' did not match any bands."),
+    HttpError(400, 'Service unavailable'),
+])
+def test_permanent_errors_raised_at_once(settings, fake_ee, error):
+    Fake = fake_ee(errors=[error])
+    with pytest.raises(type(error)):
+        Image_Processing.EEDownload(None, ['B2'], polygon, 10, settings)
+    assert len(Fake.calls) == 1
+
+
+def test_gives_up_after_retries(settings, fake_ee):
+    Fake = fake_ee(errors=[HttpError(503)]*10)
+    with pytest.raises(HttpError):
+        Image_Processing.EEDownload(None, ['B2'], polygon, 10, settings)
+    assert len(Fake.calls) == settings['ee_retries'] + 1
+
+
+def test_backoff_grows(settings, fake_ee):
+    settings['ee_backoff'] = 0.05
+    Fake = fake_ee(errors=[HttpError(503)]*2)
+    Image_Processing.EEDownload(None, ['B2'], polygon, 10, settings)
+    Gaps = np.diff(Fake.calls)
+    # backoff * 2**attempt * (1 + jitter in [0, 1))
+    assert 0.05 <= Gaps[0] < 0.1 + 0.05
+    assert 0.1 <= Gaps[1] < 0.2 + 0.05
+
+
+def test_rate_limit_across_threads(settings, fake_ee):
+    settings['ee_max_rate'] = 50
+    Fake = fake_ee(latency=0.01)
+    Threads = [threading.Thread(target=lambda: [Image_Processing.EEDownload(None, ['B2'], polygon, 10, settings)
+                                                for _ in range(5)]) for _ in range(4)]
+    for Thread in Threads:
+        Thread.start()
+    for Thread in Threads:
+        Thread.join()
+    Starts = np.sort(Fake.calls)
+    assert len(Starts) == 20
+    # requests from all threads of the process are spaced out to the rate
+    assert np.all(np.diff(Starts) >= 1/50 - 1e-3)
+
+
+def RunImages(settings, Features, compute):
+    # image loop as in extract_veglines: fetch each image's bands, then process it
+    ImgColl = type('ImageCollection', (), {'getInfo': lambda self: {'features': Features}})()
+    filenames = [Feature['id'] for Feature in Features]
+    Image_Processing.ImgMetaCache.clear()
+    Start = time.monotonic()
+    for fn in Image_Processing.PrefetchImgs(range(len(Features)), ImgColl, settings, 'S2', filenames, polygon):
+        for bands, scale in Image_Processing.EETileRequests['S2']:
+            im = Image_Processing.EEToNumpyCached(filenames[fn], filenames[fn], bands, polygon, scale, settings)
+            assert im.shape == (8, 8, len(bands))
+        time.sleep(compute)
+    return time.monotonic() - Start
+
+
+def test_prefetch_overlaps_downloads(settings, fake_ee):
+    Features = [{'id': 'COPERNICUS/S2/%d' % i, 'properties': {'CLOUDY_PIXEL_PERCENTAGE': 10}} for i in range(8)]
+    Latency, Compute = 0.04, 0.04
+
+    fake_ee(latency=Latency)
+    settings['n_prefetch'] = 0
+    Serial = RunImages(settings, Features, Compute)
+
+    # with a couple of transient failures thrown in
+    Fake = fake_ee(latency=Latency, errors=[None]*5 + [HttpError(503), None, Exception('Too many concurrent aggregations.')])
+    settings.update({'n_prefetch': 4, 'n_downloads': 4})
+    Prefetched = RunImages(settings, Features, Compute)
+
+    print('serial %.2fs, prefetched %.2fs' % (Serial, Prefetched))
+    assert len(Fake.calls) == len(Features)*3 + 2
+    assert Prefetched < 0.6*Serial
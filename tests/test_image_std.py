@@ -0,0 +1,73 @@
+"""
+Moving window standard deviation (Toolbox.image_std / image_std_stack) against
+the previous astropy convolve implementation, and the stacked feature matrix.
+"""
+import numpy as np
+import pytest
+
+convolution = pytest.importorskip('astropy.convolution')
+Toolbox = pytest.importorskip('Toolshed.Toolbox')
+
+
+def OldImageStd(image, radius):
+    # previous image_std (astropy convolve over a reflect padded image), with
+    # the variance clamped at 0 as flat windows now give 0 rather than NaN
+    image = image.copy()
+    image_padded = np.pad(image, radius, 'reflect')
+    win_rows, win_cols = radius*2 + 1, radius*2 + 1
+    win_mean = convolution.convolve(image_padded, np.ones((win_rows,win_cols)), boundary='extend',
+                                    normalize_kernel=True, nan_treatment='interpolate', preserve_nan=True)
+    win_sqr_mean = convolution.convolve(image_padded**2, np.ones((win_rows,win_cols)), boundary='extend',
+                                        normalize_kernel=True, nan_treatment='interpolate', preserve_nan=True)
+    win_var = np.maximum(win_sqr_mean - win_mean**2, 0)
+    win_std = np.sqrt(win_var)
+    return win_std[radius:-radius, radius:-radius]
+
+
+def Reflectances(shape=(60, 70), seed=0):
+    return np.random.default_rng(seed).uniform(0, 0.6, shape)
+
+
+@pytest.mark.parametrize('radius', [1, 2])
+def test_matches_astropy(radius):
+    image = Reflectances()
+    np.testing.assert_allclose(Toolbox.image_std(image, radius), OldImageStd(image, radius), atol=1e-10)
+
+
+@pytest.mark.parametrize('radius', [1, 2])
+def test_matches_astropy_with_nans(radius):
+    image = Reflectances(seed=1)
+    image[10:14, 20:30] = np.nan   # cloud masked block
+    image[0, :5] = np.nan          # on the edge
+    image[40, 50] = np.nan         # single pixel
+    new, old = Toolbox.image_std(image, radius), OldImageStd(image, radius)
+    assert np.array_equal(np.isnan(new), np.isnan(image))
+    np.testing.assert_array_equal(np.isnan(new), np.isnan(old))
+    np.testing.assert_allclose(new, old, atol=1e-10, equal_nan=True)
+
+
+def test_flat_patch_is_zero():
+    # round-off in mean(x^2) - mean(x)^2 used to go negative on flat areas (NaN std)
+    image = Reflectances(seed=2)
+    image[5:55, 10:60] = 0.1234567
+    win_std = Toolbox.image_std(image, 1)
+    assert not np.isnan(win_std).any()
+    np.testing.assert_allclose(win_std[6:54, 11:59], 0, atol=1e-6)
+
+
+def test_image_features_layout():
+    rng = np.random.default_rng(3)
+    im_ms = rng.uniform(0, 0.6, (30, 40, 5))
+    im_ms[3:6, 3:6, :] = np.nan
+    im_inds = [Toolbox.nd_index(im_ms[:,:,3], im_ms[:,:,1], np.isnan(im_ms[:,:,0])),
+               Toolbox.nd_index(im_ms[:,:,4], im_ms[:,:,1], np.isnan(im_ms[:,:,0]))]
+    im_bool = np.ones(im_ms.shape[:2], dtype=bool)
+    im_bool[0, :] = False
+
+    features = Toolbox.image_features(im_ms, im_inds, im_bool, radius=1)
+
+    layers = [im_ms[:,:,k] for k in range(5)] + im_inds
+    layers += [OldImageStd(layer, 1) for layer in layers]
+    expected = np.stack([layer[im_bool] for layer in layers], axis=1)
+    assert features.dtype == np.float32
+    np.testing.assert_allclose(features, expected, rtol=1e-6, atol=1e-6, equal_nan=True)
@@ -0,0 +1,83 @@
+"""
+Earth Engine image metadata (Image_Processing.GetImgMetadata) fetched once per
+platform and then served from the saved pickle, counted with a local mock-EE.
+"""
+import os
+
+import pytest
+
+Image_Processing = pytest.importorskip('Toolshed.Image_Processing')
+
+
+class MockEE:
+    """
+    Offline stand-in for Earth Engine getInfo() round trips, counting requests
+    made for each collection.
+    """
+    def __init__(self, collections):
+        self.collections = collections
+        self.requests = []
+
+    def GetInfo(self, ImgColl):
+        self.requests.append(ImgColl)
+        return {'type': 'ImageCollection',
+                'features': [{'type': 'Image', 'id': ImgID,
+                              'properties': {'CLOUD_COVER': 10.0, 'system:time_start': 1e12},
+                              'bands': [{'id': 'B2', 'crs': 'EPSG:32630',
+                                         'crs_transform': [30, 0, 500000, 0, -30, 6250000]}]}
+                             for ImgID in self.collections[ImgColl]]}
+
+
+@pytest.fixture
+def settings(tmp_path):
+    (tmp_path / 'site').mkdir()
+    Image_Processing.ImgMetaCache.clear()
+    yield {'inputs': {'sitename': 'site', 'filepath': str(tmp_path)}}
+    Image_Processing.ImgMetaCache.clear()
+
+
+@pytest.fixture
+def mock_ee():
+    return MockEE({'L8coll': ['LANDSAT/LC08/C02/T1_TOA/LC08_%d' % i for i in range(5)],
+                   'S2coll': ['COPERNICUS/S2_HARMONIZED/%d' % i for i in range(7)]})
+
+
+def test_one_request_per_platform(settings, mock_ee):
+    for satname, ImgColl in [('L8', 'L8coll'), ('S2', 'S2coll')]:
+        filenames = mock_ee.collections[ImgColl]
+        # as InitialiseImgs and preprocess_single on every image would ask
+        for fn in range(len(filenames)):
+            ImgInfo = Image_Processing.GetImgMetadata(ImgColl, settings, satname, filenames, mock_ee.GetInfo)[fn]
+            assert ImgInfo['id'] == filenames[fn]
+    assert mock_ee.requests == ['L8coll', 'S2coll']
+    assert os.path.isfile(os.path.join(settings['inputs']['filepath'], 'site', 'site_imgmetadata.pkl'))
+
+
+def test_no_requests_when_saved(settings, mock_ee):
+    for satname, ImgColl in [('L8', 'L8coll'), ('S2', 'S2coll')]:
+        Image_Processing.GetImgMetadata(ImgColl, settings, satname, mock_ee.collections[ImgColl], mock_ee.GetInfo)
+    # a rerun (or a worker process) starts with nothing in memory
+    Image_Processing.ImgMetaCache.clear()
+    Rerun = MockEE(mock_ee.collections)
+    for satname, ImgColl in [('L8', 'L8coll'), ('S2', 'S2coll')]:
+        Features = Image_Processing.GetImgMetadata(ImgColl, settings, satname, Rerun.collections[ImgColl], Rerun.GetInfo)
+        assert [Feature['id'] for Feature in Features] == Rerun.collections[ImgColl]
+    assert Rerun.requests == []
+
+
+def test_refetched_when_images_change(settings, mock_ee):
+    Image_Processing.GetImgMetadata('L8coll', settings, 'L8', mock_ee.collections['L8coll'], mock_ee.GetInfo)
+    Image_Processing.ImgMetaCache.clear()
+    # new images since the last run
+    mock_ee.collections['L8coll'] = mock_ee.collections['L8coll'] + ['LANDSAT/LC08/C02/T1_TOA/LC08_5']
+    Features = Image_Processing.GetImgMetadata('L8coll', settings, 'L8', mock_ee.collections['L8coll'], mock_ee.GetInfo)
+    assert len(Features) == 6
+    assert mock_ee.requests == ['L8coll', 'L8coll']
+
+
+def test_default_backend_uses_getinfo(settings, mock_ee):
+    # without a GetInfo function, the collection's own getInfo() is called once
+    ImgColl = type('ImageCollection', (), {'getInfo': lambda self: mock_ee.GetInfo('S2coll')})()
+    for _ in range(3):
+        Image_Processing.GetImgMetadata(ImgColl, settings, 'S2', mock_ee.collections['S2coll'])
+    assert mock_ee.requests == ['S2coll']
@@ -0,0 +1,129 @@
+"""
+Transect intersections on the shared indexed core (Transects.IntersectTransects)
+against the previous per-pair intersection loops, with lines crossing transects
+more than once and waterlines only reached by the 300m transect extension.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+gpd = pytest.importorskip('geopandas')
+Transects = pytest.importorskip('Toolshed.Transects')
+Toolbox = pytest.importorskip('Toolshed.Toolbox')
+from shapely.geometry import LineString, Point
+
+LineFields = ['dates','times','filename','cloud_cove','idx','vthreshold','wthreshold','tideelev','satname']
+
+
+def BaselineAllIntersects(TransectGDF, LineGDF, KeyNames, PntName, DistName, ExtendDist=None):
+    # previous GetIntersections/GetBeachWidth loops: every transect against every line
+    ColumnData = []
+    Geoms = []
+    for _, _, ID, TrGeom, refpnt in TransectGDF.itertuples():
+        if ExtendDist is not None:
+            TrGeom = Toolbox.ExtendLine(TrGeom, ExtendDist)
+        for Row in LineGDF.itertuples():
+            ColumnData.append((ID, refpnt) + tuple(Row[1:-1]))
+            Geoms.append(TrGeom.intersection(Row[-1]))
+    AllIntersects = gpd.GeoDataFrame(ColumnData, geometry=Geoms, columns=['TransectID','reflinepnt'] + KeyNames)
+    AllIntersects = AllIntersects[~AllIntersects.is_empty].reset_index().drop('index',axis=1)
+    AllIntersects[PntName] = AllIntersects['geometry']
+    for inter in range(len(AllIntersects)):
+        if AllIntersects[PntName][inter].geom_type == 'MultiPoint':
+            AllIntersects.at[inter, PntName] = list(AllIntersects[PntName][inter].geoms)[0]
+    AllIntersects = AllIntersects.rename_geometry('pntgeometry')
+    # distances from the start of the original (unextended) transect
+    AllIntersects = AllIntersects.merge(TransectGDF[['TransectID','geometry']], on='TransectID')
+    AllIntersects = AllIntersects.drop('pntgeometry',axis=1)
+    AllIntersects[DistName] = [np.sqrt((AllIntersects[PntName][i].x - AllIntersects['geometry'][i].coords[0][0])**2 +
+                                       (AllIntersects[PntName][i].y - AllIntersects['geometry'][i].coords[0][1])**2)
+                               for i in range(len(AllIntersects))]
+    return AllIntersects
+
+
+def BaselineTransectLists(AllIntersects, TransectGDF, KeyNames):
+    TrLists = {}
+    for KeyName in KeyNames:
+        TrLists[KeyName] = []
+        for Tr in range(len(TransectGDF['TransectID'])):
+            TrKey = []
+            for j in range(len(AllIntersects.loc[AllIntersects['TransectID']==Tr])):
+                TrKey.append(AllIntersects[KeyName].loc[AllIntersects['TransectID']==Tr].iloc[j])
+            TrLists[KeyName].append(TrKey)
+    return TrLists
+
+
+@pytest.fixture
+def transects():
+    # shore-normal transects running seaward (y decreasing) from y = 1000 to 800
+    Xs = np.arange(0, 500, 25.)
+    return gpd.GeoDataFrame({'LineID': 0, 'TransectID': np.arange(len(Xs)),
+                             'geometry': [LineString([(x, 1000), (x, 800)]) for x in Xs],
+                             'reflinepnt': [Point(x, 900) for x in Xs]}, crs=32630)
+
+
+def Lines(rng, n, y0, amp):
+    # wavy lines which fold back alongshore (so some cross a transect several
+    # times), some only running partly along the coast
+    T = np.linspace(-20, 520, 400)
+    Geoms = []
+    for i in range(n):
+        t0, t1 = sorted(rng.uniform(-20, 520, 2)) if i % 4 == 3 else (-20, 520)
+        keep = (T >= t0) & (T <= t1)
+        X = T + 25*np.sin(T/rng.uniform(4, 10))
+        Y = y0 + rng.normal(0, 20) + amp*np.sin(T/rng.uniform(3, 30) + rng.uniform(0, 6))
+        Geoms.append(LineString(np.column_stack([X[keep], Y[keep]])))
+    return gpd.GeoDataFrame({'dates': ['2020-01-%02d' % (i+1) for i in range(n)],
+                             'times': ['10:%02d:00' % i for i in range(n)],
+                             'filename': ['img%d' % i for i in range(n)],
+                             'cloud_cove': rng.uniform(0, 0.5, n),
+                             'idx': np.arange(n),
+                             'vthreshold': rng.uniform(0, 0.3, n),
+                             'wthreshold': rng.uniform(-0.2, 0.2, n),
+                             'tideelev': rng.normal(0, 1, n),
+                             'satname': ['S2' if i % 2 else 'L8' for i in range(n)],
+                             'geometry': Geoms}, crs=32630)
+
+
+def AssertListsEqual(New, Old):
+    assert len(New) == len(Old)
+    for NewTr, OldTr in zip(New, Old):
+        assert len(NewTr) == len(OldTr)
+        for NewVal, OldVal in zip(NewTr, OldTr):
+            assert NewVal == OldVal
+
+
+def test_veglines_match_baseline(transects):
+    VeglineGDF = Lines(np.random.default_rng(0), 30, 900, 15)
+
+    TransectInterGDF = Transects.GetIntersections('', transects.copy(), VeglineGDF)
+
+    AllIntersects = BaselineAllIntersects(transects, VeglineGDF, LineFields, 'interpnt', 'distances')
+    KeyNames = ['reflinepnt'] + LineFields + ['interpnt', 'distances']
+    Baseline = BaselineTransectLists(AllIntersects, transects, KeyNames)
+    # some transects cross a line more than once (the first point is kept)
+    assert any(TrGeom.intersection(LineGeom).geom_type == 'MultiPoint'
+               for TrGeom in transects.geometry for LineGeom in VeglineGDF.geometry)
+
+    assert list(TransectInterGDF.columns) == list(transects.columns) + LineFields + ['interpnt', 'distances']
+    pd.testing.assert_series_equal(TransectInterGDF['TransectID'], transects['TransectID'])
+    for KeyName in KeyNames:
+        AssertListsEqual(TransectInterGDF[KeyName], Baseline[KeyName])
+
+
+def test_extended_waterlines_match_baseline(transects):
+    # waterlines out past the seaward end of the transects, only crossed by the extension
+    WaterlineGDF = Lines(np.random.default_rng(1), 20, 790, 8)
+
+    AllIntersects = Transects.IntersectTransects(transects, WaterlineGDF, {'wldates': WaterlineGDF.columns[0]},
+                                                 ExtendDist=300, PntName='wlinterpnt', DistName='wldists')
+    WLData = Transects.TransectLists(AllIntersects, transects['TransectID'], ['wldates','wldists','wlinterpnt'])
+
+    BaselineIntersects = BaselineAllIntersects(transects, WaterlineGDF, LineFields[:1] + ['_%d' % i for i in range(8)],
+                                               'wlinterpnt', 'wldists', ExtendDist=300)
+    BaselineIntersects = BaselineIntersects.rename(columns={'dates': 'wldates'})
+    Baseline = BaselineTransectLists(BaselineIntersects, transects, ['wldates','wldists','wlinterpnt'])
+
+    assert max(max(Dists, default=0) for Dists in WLData['wldists']) > 200
+    for KeyName in ['wldates','wldists','wlinterpnt']:
+        AssertListsEqual(WLData[KeyName], Baseline[KeyName])
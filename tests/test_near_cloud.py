@@ -0,0 +1,72 @@
+"""
+Cloud proximity filter (Toolbox.NearCloud) against the previous brute force
+distance from every point to every cloud pixel, with a timing comparison on
+a 2,000 x 2,000 mask.
+"""
+import time
+
+import numpy as np
+import pytest
+
+Toolbox = pytest.importorskip('Toolshed.Toolbox')
+from scipy import ndimage
+
+georef = np.array([500000, 10, 0, 6250000, 0, -10]) # [Xtr, Xscale, Xshear, Ytr, Yshear, Yscale]
+epsg = 32630
+
+
+def BruteNearCloud(points, cloud_mask, dist=30):
+    # previous ProcessShoreline filter: distance from each point to every cloud pixel
+    idx_cloud = np.argwhere(cloud_mask).astype('float64')
+    coords_cloud = Toolbox.convert_epsg(Toolbox.convert_pix2world(idx_cloud, georef), epsg, epsg)[:,:-1]
+    return np.array([np.any(np.linalg.norm(point - coords_cloud, axis=1) < dist) for point in points])
+
+
+def CloudMask(shape, seed=0, cover=0.1):
+    Noise = ndimage.gaussian_filter(np.random.default_rng(seed).normal(size=shape), shape[0]/50)
+    return Noise > np.quantile(Noise, 1 - cover)
+
+
+def ImagePoints(shape, n, seed=1):
+    # world coordinates anywhere within the image
+    rng = np.random.default_rng(seed)
+    X = georef[0] + rng.uniform(-0.5, shape[1] - 0.5, n)*georef[1]
+    Y = georef[3] + rng.uniform(-0.5, shape[0] - 0.5, n)*georef[5]
+    return np.column_stack([X, Y])
+
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_matches_brute_force(seed):
+    cloud_mask = CloudMask((150, 200), seed, cover=0.15)
+    cloud_mask[:10, :30] = True   # cloud over the image corner
+    cloud_mask[70, 100] = True    # single cloud pixel
+    points = ImagePoints(cloud_mask.shape, 3000, seed)
+    # points right on cloud pixel centres and exactly 30m from them
+    points = np.vstack([points, [[georef[0] + 100*10, georef[3] - 70*10], [georef[0] + 103*10, georef[3] - 70*10]]])
+
+    near = Toolbox.NearCloud(points, cloud_mask, georef, epsg, epsg, 30)
+
+    assert near.any() and not near.all()
+    np.testing.assert_array_equal(near, BruteNearCloud(points, cloud_mask))
+
+
+def test_no_cloud():
+    points = ImagePoints((50, 50), 10)
+    assert not Toolbox.NearCloud(points, np.zeros((50, 50), dtype=bool), georef, epsg, epsg, 30).any()
+
+
+def test_speedup_on_large_mask():
+    cloud_mask = CloudMask((2000, 2000), cover=0.1)
+    points = ImagePoints(cloud_mask.shape, 200)
+
+    Start = time.perf_counter()
+    near = Toolbox.NearCloud(points, cloud_mask, georef, epsg, epsg, 30)
+    KDTime = time.perf_counter() - Start
+    Start = time.perf_counter()
+    nearBrute = BruteNearCloud(points, cloud_mask)
+    BruteTime = time.perf_counter() - Start
+
+    print('2000x2000 mask, %d cloud pixels, %d points: brute force %.2fs, KD-tree %.3fs (%.0fx)'
+          % (cloud_mask.sum(), len(points), BruteTime, KDTime, BruteTime/KDTime))
+    np.testing.assert_array_equal(near, nearBrute)
+    assert KDTime < BruteTime/5
@@ -0,0 +1,60 @@
+"""
+Round trip of vegline outputs through the GeoParquet output store 
+(Toolbox.SaveOutputParquet / Toolbox.ReadOutputParquet).
+"""
+import os
+import numpy as np
+import pytest
+
+gpd = pytest.importorskip('geopandas')
+pytest.importorskip('pyarrow')
+Toolbox = pytest.importorskip('Toolshed.Toolbox')
+from shapely.geometry import LineString
+
+
+def Veglines():
+    return gpd.GeoSeries([LineString([(500000, 6000000), (500010, 6000010)]),
+                          LineString([(500100, 6000100), (500120, 6000090)])], crs=32630)
+
+
+def PlatformOutput(dates):
+    return {'dates': list(dates),
+            'times': ['10:00:00.0'] * len(dates),
+            'veglines': [Veglines() for _ in dates],
+            'waterlines': [np.nan for _ in dates],
+            'filename': ['img%d' % i for i in range(len(dates))],
+            'cloud_cover': [0.1] * len(dates),
+            'idx': list(range(len(dates))),
+            'vthreshold': [0.2] * len(dates),
+            'wthreshold': [np.nan] * len(dates),
+            'tideelev': [np.nan] * len(dates)}
+
+
+@pytest.fixture
+def store(tmp_path):
+    # L5 had every image skipped (e.g. all cloudy); S2 has two images out of date order
+    Toolbox.SaveOutputParquet(PlatformOutput([]), 'L5', str(tmp_path), 'site', 32630)
+    Toolbox.SaveOutputParquet(PlatformOutput(['2021-02-01', '2021-01-05']), 'S2', str(tmp_path), 'site', 32630)
+    return os.path.join(str(tmp_path), 'site_output.parquet')
+
+
+def test_round_trip_with_empty_platform(store):
+    output = Toolbox.ReadOutputParquet(store)
+    
+    assert sorted(os.listdir(store)) == ['L5.parquet', 'S2.parquet']
+    assert output['dates'] == ['2021-01-05', '2021-02-01']
+    assert output['satname'] == ['S2', 'S2']
+    assert output['idx'] == [1, 0]
+    assert all(np.isnan(w) for w in output['waterlines'])
+    assert all(np.isnan(t) for t in output['wthreshold'])
+    for lines in output['veglines']:
+        assert lines.crs.to_epsg() == 32630
+        assert lines.geom_equals(Veglines()).all()
+
+
+def test_filters_and_columns(store):
+    output = Toolbox.ReadOutputParquet(store, dates=['2021-01-10', '2021-03-01'], columns=['vthreshold'])
+    assert output == {'dates': ['2021-02-01'], 'times': ['10:00:00.0'], 'vthreshold': [0.2]}
+    
+    output = Toolbox.ReadOutputParquet(store, satnames=['L5'])
+    assert output['dates'] == [] and output['veglines'] == []
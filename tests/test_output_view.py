@@ -0,0 +1,52 @@
+"""
+Reprojected views of a merged output dict (Toolbox.OutputView), which should
+behave like independent dicts when output is edited in place.
+"""
+import numpy as np
+import pytest
+
+gpd = pytest.importorskip('geopandas')
+Toolbox = pytest.importorskip('Toolshed.Toolbox')
+from shapely.geometry import LineString
+
+
+def Lines(x0, length):
+    return gpd.GeoSeries([LineString([(x0, 6250000), (x0 + length, 6250100)])], crs=32630)
+
+
+@pytest.fixture
+def output():
+    # two images on the same day from the same platform (overlapping tiles)
+    return {'dates': ['2020-01-01', '2020-01-01', '2020-02-01'],
+            'times': ['11:00:00.0', '11:00:00.0', '11:00:00.0'],
+            'satname': ['L8', 'L8', 'L8'],
+            'veglines': [Lines(500000, 50), Lines(501000, 200), Lines(502000, 100)],
+            'idx': [0, 1, 2]}
+
+
+def test_view_reprojects(output):
+    output_latlon = Toolbox.OutputView(output, 4326)
+    Expected = output['veglines'][2].to_crs(4326)
+    assert output_latlon['veglines'][2].crs.to_epsg() == 4326
+    assert np.allclose(np.asarray(output_latlon['veglines'][2].iloc[0].coords),
+                       np.asarray(Expected.iloc[0].coords), rtol=0, atol=1e-9)
+
+
+def test_view_unchanged_by_remove_duplicates(output):
+    Originals = list(output['veglines'])
+    output_latlon = Toolbox.OutputView(output, 4326)
+    output_proj = Toolbox.OutputView(output, 32630)
+    # read before the duplicates are removed, so they are cached by position
+    Before = [output_latlon['veglines'][i] for i in range(3)]
+
+    output = Toolbox.RemoveDuplicates(output)
+
+    assert len(output['dates']) == 2
+    for view in [output_latlon, output_proj]:
+        assert len(view['veglines']) == len(view['dates']) == len(view['idx']) == 3
+    for i in range(3):
+        assert output_latlon['veglines'][i] is Before[i]
+        assert output_proj['veglines'][i] is Originals[i]
+        Expected = Originals[i].to_crs(4326)
+        assert np.allclose(np.asarray(output_latlon['veglines'][i].iloc[0].coords),
+                           np.asarray(Expected.iloc[0].coords), rtol=0, atol=1e-9)
@@ -0,0 +1,68 @@
+"""
+Batched slope-vs-energy curve (Slope.integrate_power_spectrum) against the
+previous per-slope tide correction, LombScargle and simps integration, on
+synthetic tide + cross-shore signals.
+"""
+from datetime import datetime, timedelta
+
+import numpy as np
+import pytest
+
+Slope = pytest.importorskip('Toolshed.Slope')
+import pytz
+from scipy import integrate as sintegrate
+
+
+def OldEnergy(dates, tides, chain):
+    # previous CoastSatSlope: one tide-corrected series and LombScargle per trial slope
+    settings_slope = Slope.DefineSlopeSettings(chain)
+    settings_slope['freqs_max'] = Slope.find_tide_peak(dates, tides, settings_slope)
+    tsall = Slope.tide_correct(chain, tides, settings_slope['beach_slopes'])
+    t, _, _, _, freqs = Slope.FreqParams(dates, settings_slope)
+    idx_interval = np.logical_and(freqs >= settings_slope['freqs_max'][0], freqs <= settings_slope['freqs_max'][1])
+    E = np.zeros(settings_slope['beach_slopes'].size)
+    for i in range(len(tsall)):
+        ps, _, _ = Slope.power_spectrum(t, tsall[i], freqs, [])
+        E[i] = sintegrate.simps(ps[idx_interval], x=freqs[idx_interval], even='avg')
+    return settings_slope['beach_slopes'], E
+
+
+def Synthetic(seed, slope, years=5):
+    # Landsat-like 8 day revisits with cloudy gaps, mixed semidiurnal/diurnal tide,
+    # and a trend + seasonal cycle + noise shoreline pushed around by the tide
+    rng = np.random.default_rng(seed)
+    t0 = pytz.utc.localize(datetime(2000, 1, 1, 10, 30))
+    dates = [t0 + timedelta(days=8*k, minutes=float(rng.normal(0, 5)))
+             for k in range(int(years*365/8)) if rng.random() > 0.4]
+    hours = np.array([(date - t0).total_seconds()/3600 for date in dates])
+    tides = (1.2*np.cos(2*np.pi*hours/12.4206 + 0.3) + 0.4*np.cos(2*np.pi*hours/12.0)
+             + 0.2*np.cos(2*np.pi*hours/23.9345 + 1) + 0.15*np.cos(2*np.pi*hours/25.8193))
+    years = hours/24/365.25
+    chain = 60 + 0.8*years + 8*np.sin(2*np.pi*years) + rng.normal(0, 4, len(hours)) - tides/slope
+    return dates, tides, chain
+
+
+@pytest.mark.parametrize('seed, slope', [(0, 0.02), (1, 0.1), (2, 0.2)])
+def test_slope_pick_matches_per_slope_lombscargle(seed, slope):
+    dates, tides, chain = Synthetic(seed, slope)
+
+    beach_slopes, E = OldEnergy(dates, tides, chain)
+    slope_est = Slope.CoastSatSlope(dates, tides, chain)
+
+    assert slope_est == beach_slopes[np.argmin(E)]
+
+
+def test_site_slopes_report_failures(capsys):
+    dates, tides, chain = Synthetic(0, 0.05)
+    Trs = [(dates, tides, chain),
+           (dates[:5], tides[:5], chain[:5]),  # too few observations
+           (dates, tides, chain[:-3]),         # mismatched timeseries
+           (dates, tides, chain + 10)]
+    
+    slope_ests = Slope.CoastSatSlopes(dates, tides, *zip(*Trs), n_workers=1)
+    
+    assert slope_ests[1] == slope_ests[2] == 0.1
+    assert slope_ests[0] == slope_ests[3] != 0.1
+    Printed = capsys.readouterr().out
+    assert 'failed on 1 transect(s)' in Printed
+    assert 'ValueError' in Printed and '(transect(s) [2])' in Printed
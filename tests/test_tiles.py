@@ -0,0 +1,155 @@
+"""
+Mosaicking of large AOIs downloaded in tiles (Image_Processing.EEToNumpyCached),
+with Earth Engine stubbed out by a function of projected pixel centres.
+"""
+import json
+import os
+
+import numpy as np
+import pytest
+
+Image_Processing = pytest.importorskip('Toolshed.Image_Processing')
+
+
+class FakeImage:
+    def reproject(self, crs, crsTransform):
+        return self
+
+
+def PixelValues(Xs, Ys, nbands=3):
+    # value of each band at pixel centres (distinct everywhere in the AOI)
+    X, Y = np.meshgrid(Xs, Ys)
+    return np.dstack([X*1e-3 + Y*1e-6 + band for band in range(nbands)])
+
+
+@pytest.fixture
+def settings():
+    return {'ref_epsg': 4326, 'projection_epsg': 32630, 'ee_max_pixels': 50*50, 'tile_overlap': 2,
+            'tile_cache_gb': 0, 'ee_max_rate': 1e6, 'n_downloads': 2}
+
+
+@pytest.fixture
+def polygon():
+    # ~2km x 1.5km around St Andrews; corner 3 is the top left
+    return [[[-2.82, 56.33], [-2.787, 56.33], [-2.787, 56.3435], [-2.82, 56.3435], [-2.82, 56.33]]]
+
+
+@pytest.fixture
+def stub_ee(monkeypatch):
+    Requests = []
+    def Rectangle(coords, proj, geodesic):
+        return coords
+    def ee_to_numpy(img, bands, region, scale):
+        # region edges sit half a pixel inside the grid, i.e. on the outer pixel centres
+        xmin, ymin, xmax, ymax = region
+        Xs = np.arange(xmin, xmax + scale/2, scale)
+        Ys = np.arange(ymax, ymin - scale/2, -scale)
+        Requests.append(region)
+        return PixelValues(Xs, Ys)
+    monkeypatch.setattr(Image_Processing.ee.Geometry, 'Rectangle', Rectangle)
+    monkeypatch.setattr(Image_Processing.geemap, 'ee_to_numpy', ee_to_numpy)
+    return Requests
+
+
+def test_mosaic_matches_single_request(settings, polygon, stub_ee):
+    scale = 10
+    Tiles = Image_Processing.AOITiles(polygon, scale, settings)
+    assert Tiles is not None and len(Tiles) > 4
+    
+    im = Image_Processing.EEToNumpyCached(FakeImage(), 'img', ['B2','B3','B4'], polygon, scale, settings)
+    
+    # what one request over the whole AOI grid would give
+    Overlap = settings['tile_overlap']
+    x0 = Tiles[0][0]['transform'][2] + Overlap*scale
+    y0 = Tiles[0][0]['transform'][5] - Overlap*scale
+    nrows, ncols = Tiles[-1][1].stop, Tiles[-1][2].stop
+    Single = PixelValues(x0 + (np.arange(ncols) + 0.5)*scale, y0 - (np.arange(nrows) + 0.5)*scale)
+    
+    assert im.shape == Single.shape
+    assert np.allclose(im, Single, rtol=0, atol=1e-9)
+    assert len(stub_ee) == len(Tiles)
+
+
+def test_misaligned_tile_fails_loudly(settings, polygon, stub_ee, monkeypatch):
+    ee_to_numpy = Image_Processing.geemap.ee_to_numpy
+    # Earth Engine returning one of the tiles a row short
+    def ShortTile(img, bands, region, scale):
+        im = ee_to_numpy(img, bands, region, scale)
+        return im[1:] if len(stub_ee) == 3 else im
+    monkeypatch.setattr(Image_Processing.geemap, 'ee_to_numpy', ShortTile)
+    settings['n_downloads'] = 1
+    
+    with pytest.raises(ValueError):
+        Image_Processing.EEToNumpyCached(FakeImage(), 'img', ['B2','B3','B4'], polygon, 10, settings)
+
+
+def test_cache_scanned_only_when_full(settings, polygon, stub_ee, monkeypatch, tmp_path):
+    TrimTileCache = Image_Processing.TrimTileCache
+    Scans = []
+    def CountedTrim(CacheDir, MaxBytes):
+        Scans.append(CacheDir)
+        return TrimTileCache(CacheDir, MaxBytes)
+    monkeypatch.setattr(Image_Processing, 'TrimTileCache', CountedTrim)
+    settings['inputs'] = {'filepath': str(tmp_path)}
+    CacheDir = tmp_path / 'tile_cache'
+    
+    # plenty of room: one scan on the first write
+    settings['tile_cache_gb'] = 1
+    Image_Processing.EEToNumpyCached(FakeImage(), 'img1', ['B2','B3','B4'], polygon, 10, settings)
+    NTiles = len(list(CacheDir.glob('*.npy')))
+    assert NTiles == len(stub_ee) and len(Scans) == 1
+    
+    # room for about half the tiles: trimmed back under the limit as it goes
+    TileBytes = max(f.stat().st_size for f in CacheDir.glob('*.npy'))
+    settings['tile_cache_gb'] = (NTiles + NTiles//2)*TileBytes/1e9
+    Image_Processing.EEToNumpyCached(FakeImage(), 'img2', ['B2','B3','B4'], polygon, 10, settings)
+    CacheBytes = sum(f.stat().st_size for f in CacheDir.glob('*.npy'))
+    assert 1 < len(Scans) < 1 + NTiles//2
+    assert CacheBytes <= settings['tile_cache_gb']*1e9
+    assert Image_Processing.TileCacheBytes[str(CacheDir)] == CacheBytes
+
+
+@pytest.mark.parametrize('tiled', [False, True])
+def test_cache_hit_skips_download(settings, polygon, stub_ee, monkeypatch, tmp_path, tiled):
+    if not tiled:
+        # one request over the whole AOI (a small projected box stands in for the polygon)
+        settings['ee_max_pixels'] = 1e6
+        monkeypatch.setattr(Image_Processing.ee.Geometry, 'Polygon', lambda coords: [0, 0, 90, 90], raising=False)
+    settings.update({'tile_cache_gb': 1, 'inputs': {'filepath': str(tmp_path)}})
+    
+    First = Image_Processing.EEToNumpyCached(FakeImage(), 'img', ['B2','B3','B4'], polygon, 10, settings)
+    NRequests = len(stub_ee)
+    Second = Image_Processing.EEToNumpyCached(FakeImage(), 'img', ['B2','B3','B4'], polygon, 10, settings)
+    
+    assert NRequests == (len(Image_Processing.AOITiles(polygon, 10, settings)) if tiled else 1)
+    assert len(stub_ee) == NRequests
+    assert np.array_equal(First, Second)
+    # a different band list is a different request
+    Image_Processing.EEToNumpyCached(FakeImage(), 'img', ['B2','B3'], polygon, 10, settings)
+    assert len(stub_ee) == 2*NRequests
+    
+    # sidecars record the pixel grid of each request
+    for SidecarPath in (tmp_path / 'tile_cache').glob('*.json'):
+        georef = json.loads(SidecarPath.read_text())['georef']
+        assert georef['epsg'] == settings['projection_epsg']
+        assert georef['transform'][0] == 10 and georef['transform'][4] == -10
+
+
+def test_trim_keeps_tiles_in_use(monkeypatch, tmp_path):
+    for i in range(4):
+        np.save(tmp_path / ('%d.npy' % i), np.zeros(1000))
+        (tmp_path / ('%d.json' % i)).write_text('{}')
+        os.utime(tmp_path / ('%d.npy' % i), (i, i))
+    remove = os.remove
+    def LockedRemove(path):
+        # oldest tile still memory-mapped (as on Windows)
+        if os.path.basename(path) == '0.npy':
+            raise PermissionError(13, 'The process cannot access the file because it is being used by another process')
+        remove(path)
+    monkeypatch.setattr(Image_Processing.os, 'remove', LockedRemove)
+    TileBytes = os.path.getsize(tmp_path / '0.npy')
+    
+    CacheBytes = Image_Processing.TrimTileCache(str(tmp_path), 2*TileBytes)
+    
+    assert sorted(f.name for f in tmp_path.glob('*.npy')) == ['0.npy', '3.npy']
+    assert CacheBytes == 2*TileBytes